@@ -1,16 +1,68 @@
 from abc import ABC, abstractmethod
-from modules.Connection import Connection, TIMEOUT
+from modules.Connection import Connection, TIMEOUT, PAGE_SIZE, PaginationError
+from modules.AsyncConnection import AsyncConnection
+from modules.HttpAdapter import POOL_SIZE
+from modules.Topology import Topology, TOPOLOGY_TTL_SECONDS
+from modules.FaultIndex import FaultIndex, FAULT_QUERY
+from modules.Subscription import SubscriptionEngine
+import asyncio
 import logging
-from typing import Dict, List
+import threading
+from time import time
+from contextlib import contextmanager
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Iterator, List
 
 LOG = logging.getLogger('apic_exporter.exporter')
+MAX_PARALLEL_QUERIES = 8
+TIME_BUDGET_SECONDS = 0
+REFRESH_INTERVAL_SECONDS = 0
+run_result = namedtuple('run_result', 'metrics duration timed_out cached')
+
+# the concurrency limit applies per APIC host across all collectors
+_host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_host_semaphores_lock = threading.Lock()
 
 
 class BaseCollector(ABC):
 
+    # read raised and soaking faults from self.fault_index if the fault_source is subscription or delta
+    uses_fault_index = False
+
     def __init__(self, config: Dict):
         self.hosts: List[str] = config['apic_hosts'].split(',')
-        self.__connection = Connection(self.hosts, config['apic_user'], config['apic_password'])
+        pool_size = int(config.get('connection_pool_size', POOL_SIZE))
+        self.__connection = Connection(self.hosts, config['apic_user'], config['apic_password'], pool_size,
+                                       type(self).__name__)
+        self.__page_size = int(config.get('page_size', PAGE_SIZE))
+        self.__stream_responses = bool(config.get('stream_responses', False))
+        self.__max_parallel_queries = int(config.get('max_parallel_queries', MAX_PARALLEL_QUERIES))
+        # race slow queries of a single host against the next best host
+        self.hedge_requests: bool = bool(config.get('hedge_requests', False))
+        self.__hedge_delay = float(config['hedge_delay_seconds']) if 'hedge_delay_seconds' in config else None
+        self.__async_connection = None
+        if config.get('connection_engine', 'requests') == 'asyncio':
+            self.__async_connection = AsyncConnection(self.hosts, config['apic_user'], config['apic_password'],
+                                                      self.__max_parallel_queries)
+        # the topology is shared by the collectors of the fabric, its queries are labelled as collector topology
+        topology_connection = Connection(self.hosts, config['apic_user'], config['apic_password'], pool_size,
+                                         'topology')
+        self.topology = Topology(self.hosts, topology_connection,
+                                 int(config.get('topology_ttl_seconds', TOPOLOGY_TTL_SECONDS)))
+        self.fault_index = None
+        self.fault_source = config.get('fault_source', 'query')
+        if self.uses_fault_index and self.fault_source in ('subscription', 'delta'):
+            self.fault_index = FaultIndex(self.hosts)
+        if self.uses_fault_index and self.fault_source == 'subscription':
+            engine = SubscriptionEngine(self.hosts, config['apic_user'], config['apic_password'])
+            engine.subscribe(FAULT_QUERY, self.fault_index)
+        self.__time_budget = float(config.get('time_budget_seconds', TIME_BUDGET_SECONDS))
+        self.__deadline = None
+        self.__run_lock = threading.Lock()
+        self.__last_metrics = []
+        self.__refresh_interval = float(config.get('refresh_interval_seconds', REFRESH_INTERVAL_SECONDS))
+        self.__refreshed_at = 0
 
     @abstractmethod
     def describe(self):
@@ -20,10 +72,72 @@ class BaseCollector(ABC):
     def collect(self):
         pass
 
+    def run(self) -> run_result:
+        """Runs collect within the time budget of the collector. Once the budget is exceeded no further queries are
+           sent, and the metrics of the last run within the budget are returned instead of the partial result.
+           Until the refresh interval of the collector has passed, the metrics of the last run are returned without
+           running collect.
+        """
+        with self.exclusive():
+            started = time()
+            if self.__refresh_interval > 0 and (started - self.__refreshed_at) < self.__refresh_interval:
+                return run_result(self.__last_metrics, 0, False, True)
+
+            self.__deadline = started + self.__time_budget if self.__time_budget > 0 else None
+            try:
+                metrics = list(self.collect())
+            finally:
+                self.__deadline = None
+            duration = time() - started
+
+            timed_out = self.__time_budget > 0 and duration > self.__time_budget
+            if timed_out:
+                LOG.warning(f'{type(self).__name__} exceeded its time budget of {self.__time_budget} sec after '
+                            f'{duration:.1f} sec, returning the previous metrics')
+                return run_result(self.__last_metrics, duration, True, False)
+            # a run without metrics failed and is repeated on the next scrape, the last metrics are kept for a
+            # run exceeding its budget
+            if len(metrics) > 0:
+                self.__last_metrics = metrics
+                self.__refreshed_at = started
+            return run_result(metrics, duration, False, False)
+
+    @contextmanager
+    def exclusive(self):
+        """Serializes the runs of the collector. The deadline of the time budget belongs to the run holding the lock,
+           so overlapping scrapes or a profile during a background refresh wait instead of sharing it.
+        """
+        with self.__run_lock:
+            yield
+
+    def is_cancelled(self) -> bool:
+        """Returns True if the time budget of the current run is exceeded. Queries are not sent anymore."""
+        return self.__deadline is not None and time() > self.__deadline
+
+    def remaining_budget(self) -> float:
+        """Returns the seconds left of the time budget of the current run, None without a budget"""
+        deadline = self.__deadline
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time())
+
+    def _budgeted_timeout(self, timeout: float) -> float:
+        """Returns the request timeout limited to the rest of the time budget, None if the budget is exceeded"""
+        remaining = self.remaining_budget()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            return None
+        return min(timeout, remaining)
+
     def query_host(self, host: str, query: str, timeout: int = TIMEOUT) -> Dict:
         """Executes the query against a specific APIC host
-           Returns the fetched data or None if fetched data is invalid
+           Returns the fetched data or None if fetched data is invalid or the time budget is exceeded
         """
+        timeout = self._budgeted_timeout(timeout)
+        if timeout is None:
+            LOG.debug(f'apic host {host}, {query} cancelled, time budget exceeded')
+            return None
         fetched_data = self.__connection.getRequest(host, query, timeout)
         if fetched_data is None:
             return None
@@ -32,10 +146,102 @@ class BaseCollector(ABC):
             return None
         return fetched_data
 
-    def reset_unavailable_hosts(self):
-        """Reset the list of unavailable hosts. Move the previously unavailable host to the end of the list"""
-        unresponsive_hosts = self.__connection.get_unresponsive_hosts()
-        for host in unresponsive_hosts:
-            self.hosts.remove(host)
-            self.hosts.append(host)
-        self.__connection.reset_unavailable_hosts()
+    def query_hosts_hedged(self, query: str, timeout: int = TIMEOUT) -> tuple:
+        """Executes the query against the best host. If it does not answer within the hedge delay, the query is sent
+           to the next best host as well and the first valid answer wins. The hedge delay defaults to the p95
+           response time of the host. Returns the host that answered and the fetched data, (None, None) if no host
+           answered.
+        """
+        timeout = self._budgeted_timeout(timeout)
+        if timeout is None:
+            LOG.debug(f'{query} cancelled, time budget exceeded')
+            return None, None
+        host, fetched_data = self.__connection.getHedgedRequest(self.ranked_hosts(), query, timeout, self.__hedge_delay)
+        if host is None:
+            LOG.warning(f'no apic host returned anything for {query}')
+        return host, fetched_data
+
+    def query_host_paged(self, host: str, query: str, timeout: int = TIMEOUT) -> Dict:
+        """Executes the query page by page against a specific APIC host.
+           Returns None if the first page is invalid. Otherwise 'imdata' is a generator yielding the objects page by
+           page, which raises a PaginationError if a subsequent page fails. A page size of 0 disables paging.
+           With stream_responses the objects are decoded while they are read from the socket.
+        """
+        if self.__page_size <= 0 and not self.__stream_responses:
+            return self.query_host(host, query, timeout)
+        timeout = self._budgeted_timeout(timeout)
+        if timeout is None:
+            LOG.debug(f'apic host {host}, {query} cancelled, time budget exceeded')
+            return None
+        fetched_data = self.__connection.getPagedRequest(host, query, self.__page_size, timeout,
+                                                         self.__stream_responses)
+        if fetched_data is None:
+            LOG.warning(f'apic host {host}, {query} did not return anything')
+        elif self.__deadline is not None:
+            fetched_data['imdata'] = self._within_budget(fetched_data['imdata'], host, query)
+        return fetched_data
+
+    def _within_budget(self, objects: Iterator[Dict], host: str, query: str) -> Iterator[Dict]:
+        """Stops the iteration of paged objects with a PaginationError once the time budget is exceeded"""
+        for obj in objects:
+            if self.is_cancelled():
+                raise PaginationError(f'apic host {host}, {query} cancelled, time budget exceeded')
+            yield obj
+
+    def query_host_batch(self, host: str, queries: Dict[Hashable, str], timeout: int = TIMEOUT) -> Dict[Hashable, Dict]:
+        """Executes a batch of queries concurrently against a specific APIC host.
+           Returns the fetched data by key of the query. Failed queries are logged and left out of the result.
+        """
+        if len(queries) == 0:
+            return {}
+        if self.is_cancelled():
+            LOG.debug(f'apic host {host}, {len(queries)} queries cancelled, time budget exceeded')
+            return {}
+
+        if self.__async_connection is not None:
+            coroutine = self.__async_connection.getRequests(host, queries, timeout, type(self).__name__)
+            remaining = self.remaining_budget()
+            # the queries still in flight are cancelled once the budget is exceeded
+            if remaining is not None:
+                coroutine = asyncio.wait_for(coroutine, remaining)
+            try:
+                results = self.__async_connection.run(coroutine)
+            except asyncio.TimeoutError:
+                LOG.debug(f'apic host {host}, {len(queries)} queries cancelled, time budget exceeded')
+                return {}
+        else:
+            results = self._query_host_batch_threaded(host, queries, timeout)
+        if len(results) < len(queries):
+            LOG.warning(f'apic host {host}, {len(queries) - len(results)} of {len(queries)} queries failed')
+        return results
+
+    def _query_host_batch_threaded(self, host: str, queries: Dict[Hashable, str], timeout: int) -> Dict[Hashable, Dict]:
+        with _host_semaphores_lock:
+            if host not in _host_semaphores:
+                _host_semaphores[host] = threading.BoundedSemaphore(self.__max_parallel_queries)
+            semaphore = _host_semaphores[host]
+
+        def execute(query: str) -> Dict:
+            with semaphore:
+                return self.query_host(host, query, timeout)
+
+        workers = min(self.__max_parallel_queries, len(queries))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='apic-query') as executor:
+            futures = {key: executor.submit(execute, query) for key, query in queries.items()}
+
+        results = {}
+        for key, future in futures.items():
+            try:
+                fetched_data = future.result()
+            except Exception as e:
+                LOG.error(f'apic host {host}, {queries[key]} failed: {e}')
+                continue
+            if fetched_data is not None:
+                results[key] = fetched_data
+        return results
+
+    def ranked_hosts(self) -> List[str]:
+        """Returns the hosts ordered from the best to the worst by recent response time and error rate.
+           Unresponsive hosts come last.
+        """
+        return self.__connection.get_ranked_hosts(self.hosts)
@@ -4,20 +4,29 @@ from typing import Dict, List
 from prometheus_client.core import Summary
 from prometheus_client.metrics_core import Metric
 from BaseCollector import BaseCollector
+from modules.Connection import PaginationError
 
 LOG = logging.getLogger('apic_exporter.exporter')
+# collectors of different fabrics share the summary of their name
+REQUEST_TIMES: Dict[str, Summary] = {}
 
 
 class Collector(BaseCollector):
 
+    # fetch the query page by page, get_metrics receives 'imdata' as generator
+    paginated = False
+
     def __init__(self, name: str, config: Dict):
         super().__init__(config)
         self.__name = name
-        self.__request_time = Summary('{name}_processing_seconds'.format(name=self.__name),
-                                      'Time spend processing request')
+        if name not in REQUEST_TIMES:
+            REQUEST_TIMES[name] = Summary('{name}_processing_seconds'.format(name=self.__name),
+                                          'Time spend processing request')
+        self.__request_time = REQUEST_TIMES[name]
 
     @abstractmethod
     def get_query(self) -> str:
+        """Returns the query fetching the data for get_metrics or None if get_metrics fetches its data itself"""
         pass
 
     @abstractmethod
@@ -29,12 +38,16 @@ class Collector(BaseCollector):
         metric_counter = 0
         with self.__request_time.time():
             LOG.debug('Collecting %s metrics ...', self.__name)
-            for host in self.hosts:
-                fetched_data = self.query_host(host, self.get_query())
-                if fetched_data is None:
-                    LOG.warning(f'Skipping apic host {host} did not return anything for {self.get_query()}')
+            query = self.get_query()
+            for host, fetched_data in self._fetch(query):
+                if query is not None and fetched_data is None:
+                    LOG.warning(f'Skipping apic host {host} did not return anything for {query}')
+                    continue
+                try:
+                    metrics = self.get_metrics(host, fetched_data)
+                except PaginationError as e:
+                    LOG.warning(f'Skipping apic host {host}: {e}')
                     continue
-                metrics = self.get_metrics(host, fetched_data)
                 if metrics is None:
                     continue
                 for metric in metrics:
@@ -43,3 +56,25 @@ class Collector(BaseCollector):
                 break  # all hosts produce the same metrics, hence querying one is sufficient
             LOG.info('collected %s %s metrics', metric_counter, self.__name)
             return
+
+    def _fetch(self, query: str):
+        """Yields the hosts in ranked order together with the data fetched by the query. With hedge_requests the
+           query is raced across the hosts and the host that answered first is yielded. If its data is rejected, the
+           remaining hosts follow in ranked order.
+        """
+        hosts = self.ranked_hosts()
+        if query is not None and not self.paginated and self.hedge_requests:
+            winner, fetched_data = self.query_hosts_hedged(query)
+            # no host answered the hedged query
+            if winner is None:
+                return
+            yield winner, fetched_data
+            hosts = [host for host in hosts if host != winner]
+
+        for host in hosts:
+            if query is None:
+                yield host, None
+            elif self.paginated:
+                yield host, self.query_host_paged(host, query)
+            else:
+                yield host, self.query_host(host, query)
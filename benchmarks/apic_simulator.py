@@ -0,0 +1,874 @@
+"""Simulates the REST API of an APIC cluster serving a synthetic fabric.
+
+Implements aaaLogin, aaaRefresh, class and MO queries with query-target, target-subtree-class, query-target-filter,
+rsp-subtree, rsp-subtree-class, rsp-subtree-filter, rsp-subtree-include (stats, count), order-by and pagination for
+the classes queried by the collectors. Latency and errors can be injected per host. Class queries can be subscribed
+with subscription=yes, the changes made by SyntheticFabric.update and remove are pushed over the websocket
+/socket<token> of the host.
+
+    python benchmarks/apic_simulator.py --hosts 3 --port 8443 --leaves 100 --faults 20000
+
+The exporter can then be pointed at the printed hosts with any user and password.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import select
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import click
+
+from collections import namedtuple
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, List
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+TOKEN_LIFETIME_SECONDS = 600
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WEBSOCKET_POLL_SECONDS = 0.05
+OP_TEXT, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x8, 0x9, 0xA
+GEN1_LEAF_MODEL = 'N9K-C9396PX'
+LEAF_MODEL = 'N9K-C93180YC-EX'
+SPINE_MODEL = 'N9K-C9508'
+CONTROLLER_MODEL = 'APIC-SERVER-M3'
+FAULT_CODES = ('F0532', 'F0546', 'F1360', 'F1394', 'F2533', 'F2534', 'F0103', 'F1543')
+FAULT_SEVERITIES = ('critical', 'major', 'minor', 'warning', 'cleared')
+fabric_size = namedtuple('fabric_size', 'pods spines leaves controllers interfaces faults endpoints duplicate_ips')
+injection_tuple = namedtuple('injection_tuple', 'latency jitter latency_per_object error_rate')
+NO_INJECTION = injection_tuple(0.0, 0.0, 0.0, 0.0)
+
+
+class QueryError(Exception):
+    """Raised for queries the simulator does not understand, answered with 400 like the APIC does"""
+    pass
+
+
+def split_dn(dn: str) -> List[str]:
+    """Splits a dn into its rns. Slashes within brackets, as in phys-[eth1/1], do not separate rns."""
+    rns, depth, start = [], 0, 0
+    for i, c in enumerate(dn):
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        elif c == '/' and depth == 0:
+            rns.append(dn[start:i])
+            start = i + 1
+    rns.append(dn[start:])
+    return rns
+
+
+def parent_dn(dn: str) -> str:
+    return '/'.join(split_dn(dn)[:-1])
+
+
+def compare(value: str, other: str) -> int:
+    """Compares two attribute values, numerically if both are numbers and as points in time if both are timestamps"""
+    try:
+        a, b = float(value), float(other)
+    except (TypeError, ValueError):
+        try:
+            a, b = datetime.fromisoformat(value), datetime.fromisoformat(other)
+            if (a.tzinfo is None) != (b.tzinfo is None):
+                raise ValueError('timestamps with and without offset')
+        except (TypeError, ValueError):
+            a, b = str(value), str(other)
+    return (a > b) - (a < b)
+
+
+OPERATORS = {
+    'eq': lambda v, o: compare(v, o) == 0,
+    'ne': lambda v, o: compare(v, o) != 0,
+    'lt': lambda v, o: compare(v, o) < 0,
+    'le': lambda v, o: compare(v, o) <= 0,
+    'gt': lambda v, o: compare(v, o) > 0,
+    'ge': lambda v, o: compare(v, o) >= 0,
+    'wcard': lambda v, o: o in str(v),
+}
+
+
+def parse_filter(text: str) -> Callable[[str, Dict], bool]:
+    """Parses a query-target-filter like and(eq(faultInst.lc,"raised"),ne(faultInst.ack,"yes")) into a predicate
+       of the class and attributes of an object
+    """
+    pos = 0
+
+    def expect(token: str):
+        nonlocal pos
+        if not text.startswith(token, pos):
+            raise QueryError(f'invalid filter {text}, expected {token} at {pos}')
+        pos += len(token)
+
+    def expression():
+        nonlocal pos
+        match = re.compile(r'\s*(\w+)\(').match(text, pos)
+        if match is None:
+            raise QueryError(f'invalid filter {text} at {pos}')
+        op, pos = match.group(1), match.end()
+        if op in ('and', 'or', 'not'):
+            operands = [expression()]
+            while text.startswith(',', pos):
+                pos += 1
+                operands.append(expression())
+            expect(')')
+            if op == 'and':
+                return lambda cls, attrs: all(f(cls, attrs) for f in operands)
+            if op == 'or':
+                return lambda cls, attrs: any(f(cls, attrs) for f in operands)
+            return lambda cls, attrs: not operands[0](cls, attrs)
+        if op not in OPERATORS:
+            raise QueryError(f'unsupported filter operator {op}')
+        match = re.compile(r'\s*(\w+)\.(\w+)\s*,\s*"([^"]*)"\s*\)').match(text, pos)
+        if match is None:
+            raise QueryError(f'invalid filter {text} at {pos}')
+        pos = match.end()
+        property_class, name, value = match.groups()
+        compare_op = OPERATORS[op]
+        return lambda cls, attrs: cls == property_class and name in attrs and compare_op(attrs[name], value)
+
+    predicate = expression()
+    if pos != len(text):
+        raise QueryError(f'invalid filter {text}, unexpected {text[pos:]}')
+    return predicate
+
+
+def is_stats_class(cls: str) -> bool:
+    return cls.endswith('5min')
+
+
+def format_timestamp(seconds: float) -> str:
+    """Formats a unix time like the APIC, e.g. 2024-01-31T12:00:00.123+00:00"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + f'.{int(seconds * 1000) % 1000:03d}+00:00'
+
+
+class SyntheticFabric(object):
+
+    def __init__(self, size: fabric_size, seed: int = 0):
+        """Generates the managed objects of a fabric of the given size. The same seed generates the same fabric."""
+        self.__size = size
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__by_class: Dict[str, List[tuple]] = {}
+        self.__by_dn: Dict[str, tuple] = {}
+        self.__children: Dict[str, List[tuple]] = {}
+        self.__tokens = set()
+        self.__listeners: List[Callable] = []
+        self.__record_ids = itertools.count(4294967297)
+        self._generate()
+
+    @property
+    def size(self) -> fabric_size:
+        return self.__size
+
+    def add(self, cls: str, attrs: Dict):
+        obj = (cls, attrs)
+        self.__by_class.setdefault(cls, []).append(obj)
+        self.__by_dn[attrs['dn']] = obj
+        self.__children.setdefault(parent_dn(attrs['dn']), []).append(obj)
+
+    def update(self, cls: str, attrs: Dict) -> str:
+        """Creates the object with the dn of attrs or merges attrs into the existing object. The modTs of a modified
+           object is set to now unless given. The listeners are notified. Returns created or modified.
+        """
+        with self.__lock:
+            obj = self.__by_dn.get(attrs['dn'])
+            if obj is None:
+                self.add(cls, dict(attrs))
+                old, new, status = None, dict(attrs), 'created'
+            else:
+                old = dict(obj[1])
+                if 'modTs' in old and 'modTs' not in attrs:
+                    attrs = {**attrs, 'modTs': format_timestamp(time.time())}
+                obj[1].update(attrs)
+                new, status = dict(obj[1]), 'modified'
+            listeners = list(self.__listeners)
+        for listener in listeners:
+            listener(cls, old, new, status)
+        return status
+
+    def remove(self, dn: str):
+        """Deletes the object and notifies the listeners. Like the APIC, a deleted faultInst leaves a faultRecord
+           with ind deletion in the fault history.
+        """
+        with self.__lock:
+            obj = self.__by_dn.pop(dn)
+            self.__by_class[obj[0]].remove(obj)
+            self.__children[parent_dn(dn)].remove(obj)
+            if obj[0] == 'faultInst':
+                self._record_deletion(obj[1])
+            listeners = list(self.__listeners)
+        for listener in listeners:
+            listener(obj[0], dict(obj[1]), None, 'deleted')
+
+    def _record_deletion(self, fault: Dict):
+        affected = parent_dn(fault['dn'])
+        self.add(
+            'faultRecord', {
+                'dn': f'subj-[{affected}]/rec-{next(self.__record_ids)}',
+                'affected': affected,
+                'code': fault['code'],
+                'severity': fault['severity'],
+                'ind': 'deletion',
+                'created': format_timestamp(time.time())
+            })
+
+    def add_listener(self, listener: Callable[[str, Dict, Dict, str], None]):
+        """Calls listener(cls, old, new, status) on every change. old is None for created and new is None for
+           deleted objects.
+        """
+        with self.__lock:
+            self.__listeners.append(listener)
+
+    def set_controller_addresses(self, addresses: List[str]):
+        """Sets the oobMgmtAddr of the controllers to the addresses the simulated hosts are served on"""
+        controllers = [attrs for cls, attrs in self.__by_class.get('topSystem', []) if attrs['role'] == 'controller']
+        for attrs, address in zip(controllers, addresses):
+            attrs['oobMgmtAddr'] = address
+
+    def login(self) -> str:
+        token = uuid.uuid4().hex
+        with self.__lock:
+            self.__tokens.add(token)
+        return token
+
+    def is_valid_token(self, token: str) -> bool:
+        with self.__lock:
+            return token in self.__tokens
+
+    def expire_tokens(self):
+        """Invalidates all issued tokens, the next request with one of them is answered with 403"""
+        with self.__lock:
+            self.__tokens = set()
+
+    def _generate(self):
+        size, rnd = self.__size, self.__random
+        nodes = [('controller', CONTROLLER_MODEL, i + 1) for i in range(size.controllers)]
+        # spines are numbered from 201, or after the leaves if there are more than 100 leaves
+        spine_base = 201 if size.leaves <= 100 else 101 + (size.leaves + 99) // 100 * 100
+        nodes += [('spine', SPINE_MODEL, spine_base + i) for i in range(size.spines)]
+        nodes += [('leaf', GEN1_LEAF_MODEL if i % 4 == 0 else LEAF_MODEL, 101 + i) for i in range(size.leaves)]
+
+        switches = []
+        for role, model, node_id in nodes:
+            pod = 1 + node_id % size.pods
+            node_dn = f'topology/pod-{pod}/node-{node_id}'
+            self.add(
+                'fabricNode', {
+                    'dn': node_dn,
+                    'id': str(node_id),
+                    'role': role,
+                    'model': model,
+                    'name': f'{role}-{node_id}',
+                    'fabricSt': 'active'
+                })
+            self.add(
+                'topSystem', {
+                    'dn': f'{node_dn}/sys',
+                    'id': str(node_id),
+                    'podId': str(pod),
+                    'role': role,
+                    'name': f'{role}-{node_id}',
+                    'oobMgmtAddr': f'10.0.0.{node_id}'
+                })
+            self._generate_processes(node_dn)
+            if role == 'controller':
+                self.add(
+                    'procEntity', {
+                        'dn': f'{node_dn}/sys/proc',
+                        'cpuPct': str(rnd.randint(1, 90)),
+                        'maxMemAlloc': str(rnd.randint(10**7, 6 * 10**7)),
+                        'memFree': str(rnd.randint(10**6, 10**7))
+                    })
+                continue
+            switches.append((role, model, node_dn))
+            self.add(
+                'eqptFlash', {
+                    'dn': f'{node_dn}/sys/ch/supslot-1/sup/flash',
+                    'type': 'flash',
+                    'vendor': 'Micron',
+                    'model': 'Micron_M500IT_MTFDDAT064MBD',
+                    'acc': 'read-write' if rnd.random() < 0.95 else 'read-only'
+                })
+            self._generate_capacity(role, node_dn)
+            for port in range(1, size.interfaces + 1):
+                self._generate_interface(f'{node_dn}/sys/phys-[eth1/{port}]')
+
+        for i in range(size.faults):
+            # the codes rotate, so the dn of a fault (affected object and code) is unique
+            slot = i // len(FAULT_CODES)
+            _, _, node_dn = switches[slot % len(switches)]
+            port = 1 + slot // len(switches) % max(1, size.interfaces)
+            level = slot // (len(switches) * max(1, size.interfaces))
+            affected_dn = f'{node_dn}/sys/phys-[eth1/{port}]' if level == 0 else \
+                f'{node_dn}/sys/ctx-[vxlan-{level * 100000 + port}]'
+            self._generate_fault(affected_dn, FAULT_CODES[i % len(FAULT_CODES)], i)
+
+        leaves = [node_dn for role, _, node_dn in switches if role == 'leaf']
+        spines = [node_dn for role, _, node_dn in switches if role == 'spine']
+        for i in range(size.endpoints):
+            self._generate_endpoint(i, leaves, spines, i < size.duplicate_ips)
+
+    def _generate_processes(self, node_dn: str):
+        rnd = self.__random
+        for pid, name in ((1001, 'nfm'), (1002, 'mcecm')):
+            proc_dn = f'{node_dn}/sys/proc/proc-{pid}'
+            self.add('procProc', {'dn': proc_dn, 'id': str(pid), 'name': name, 'operState': 'up'})
+            used = rnd.randint(10**5, 10**6)
+            memory = {'usedMin': str(used), 'usedMax': str(used * 2), 'usedAvg': str(used * 3 // 2)}
+            self.add('procProcMem5min', {'dn': f'{proc_dn}/CDprocProcMem5min', **memory})
+            self.add('procProcMemHist5min', {'dn': f'{proc_dn}/HDprocProcMemHist5min-0', 'index': '0', **memory})
+
+    def _generate_capacity(self, role: str, node_dn: str):
+        entity_dn = f'{node_dn}/sys/eqptcapacity'
+        self.add('eqptcapacityEntity', {'dn': entity_dn})
+        if role != 'leaf':
+            return
+        rnd = self.__random
+        local, remote = rnd.randint(0, 12000), rnd.randint(0, 12000)
+        stats = {
+            'eqptcapacityL3TotalUsageCap5min': {
+                'v4TotalEpCapMax': '24576'
+            },
+            'eqptcapacityL3TotalUsage5min': {
+                'v4TotalEpLast': str(local + remote)
+            },
+            'eqptcapacityL3Usage5min': {
+                'v4LocalEpLast': str(local)
+            },
+            'eqptcapacityL3RemoteUsage5min': {
+                'v4RemoteEpLast': str(remote)
+            },
+            'eqptcapacityL3RemoteUsageCap5min': {
+                'v4RemoteEpCapMax': '12288'
+            },
+            'eqptcapacityL2TotalUsage5min': {
+                'totalEpCapMax': '24576',
+                'totalEpLast': str(local + remote)
+            },
+            'eqptcapacityL2Usage5min': {
+                'localEpCapMax': '12288',
+                'localEpLast': str(local)
+            },
+            'eqptcapacityL2RemoteUsage5min': {
+                'remoteEpLast': str(remote)
+            },
+        }
+        for cls, attrs in stats.items():
+            self.add(cls, {'dn': f'{entity_dn}/CD{cls}', **attrs})
+
+    def _generate_interface(self, if_dn: str):
+        rnd = self.__random
+        self.add('l1PhysIf', {
+            'dn': if_dn,
+            'id': split_dn(if_dn)[-1][6:-1],
+            'adminSt': 'up' if rnd.random() < 0.9 else 'down'
+        })
+        self.add(
+            'ethpmPhysIf', {
+                'dn': f'{if_dn}/phys',
+                'operSt': 'up' if rnd.random() < 0.7 else 'down',
+                'resetCtr': str(rnd.choice((0, 0, 0, 1, 2, 5)))
+            })
+
+    def _generate_fault(self, affected_dn: str, code: str, i: int):
+        rnd = self.__random
+        created = format_timestamp(time.time() - rnd.randint(0, 86400))
+        self.add(
+            'faultInst', {
+                'dn': f'{affected_dn}/fault-{code}',
+                'code': code,
+                'ack': 'no',
+                'cause': 'interface-physical-down',
+                'domain': 'access',
+                'type': 'communications',
+                'severity': rnd.choice(FAULT_SEVERITIES),
+                'lc': 'raised' if rnd.random() < 0.9 else 'soaking',
+                'created': created,
+                'modTs': created,
+                'descr': f'Synthetic fault {i} of {affected_dn}'
+            })
+
+    def _generate_endpoint(self, i: int, leaves: List[str], spines: List[str], duplicate: bool):
+        mac = ':'.join(f'{b:02X}' for b in (0, 0x50, 0x56, i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff))
+        ip = f'10.{i >> 16 & 0xff}.{i >> 8 & 0xff}.{i & 0xff}'
+        tenant, epg = f'tenant-{i % 10}', f'epg-{i % 50}'
+        ip_dn = f'uni/tn-{tenant}/ap-app/epg-{epg}/cep-{mac}/ip-[{ip}]'
+        message = f'duplicate ip {ip} learned on multiple MACs' if duplicate else ''
+        self.add('fvIp', {'dn': ip_dn, 'addr': ip, 'debugMACMessage': message})
+        if leaves:
+            leaf_dn = leaves[i % len(leaves)]
+            self.add('fvReportingNode', {
+                'dn': f'{ip_dn}/node-{leaf_dn.split("node-")[1]}',
+                'id': leaf_dn.split('node-')[1]
+            })
+        for spine_dn in spines:
+            self.add('coopEpRec', {'dn': f'{spine_dn}/sys/coop/inst/dom-overlay-1/db-ep/mac-{mac}', 'mac': mac})
+
+    def query(self, path: str, params: Dict[str, str]) -> Dict:
+        """Answers a class query /api/[node/]class/<class>.json or a MO query /api/[node/]mo/<dn>.json"""
+        match = re.match(r'^/api/(?:node/)?(class|mo)/(.+)\.json$', path)
+        if match is None:
+            raise QueryError(f'unsupported path {path}')
+        kind, target = match.groups()
+
+        if kind == 'class':
+            objects = list(self.__by_class.get(target, []))
+        else:
+            target_obj = self.__by_dn.get(target)
+            query_target = params.get('query-target', 'self')
+            if target_obj is None:
+                objects = []
+            elif query_target == 'self':
+                objects = [target_obj]
+            elif query_target == 'children':
+                objects = list(self.__children.get(target, []))
+            elif query_target == 'subtree':
+                objects = [target_obj] + self._descendants(target)
+            else:
+                raise QueryError(f'unsupported query-target {query_target}')
+            if 'target-subtree-class' in params and query_target != 'self':
+                classes = set(params['target-subtree-class'].split(','))
+                objects = [obj for obj in objects if obj[0] in classes]
+
+        if 'query-target-filter' in params:
+            predicate = parse_filter(params['query-target-filter'])
+            objects = [obj for obj in objects if predicate(*obj)]
+
+        includes = params.get('rsp-subtree-include', '').split(',')
+        if 'count' in includes:
+            return {'totalCount': '1', 'imdata': [{'moCount': {'attributes': {'count': str(len(objects))}}}]}
+
+        if 'order-by' in params:
+            objects = self._order(objects, params['order-by'])
+        total_count = len(objects)
+        if 'page-size' in params:
+            page_size, page = int(params['page-size']), int(params.get('page', 0))
+            objects = objects[page * page_size:(page + 1) * page_size]
+
+        mode = 'stats' if 'stats' in includes else params.get('rsp-subtree', 'no')
+        classes = set(params['rsp-subtree-class'].split(',')) if 'rsp-subtree-class' in params else None
+        child_filter = parse_filter(params['rsp-subtree-filter']) if 'rsp-subtree-filter' in params else None
+        return {
+            'totalCount': str(total_count),
+            'imdata': [self._render(cls, attrs, mode, classes, child_filter) for cls, attrs in objects]
+        }
+
+    def _descendants(self, dn: str) -> List[tuple]:
+        objects = []
+        for obj in self.__children.get(dn, []):
+            objects.append(obj)
+            objects.extend(self._descendants(obj[1]['dn']))
+        return objects
+
+    def _order(self, objects: List[tuple], order_by: str) -> List[tuple]:
+        prop, _, direction = order_by.partition('|')
+        name = prop.split('.')[-1]
+
+        def key(obj):
+            value = obj[1].get(name, '')
+            return (0, int(value), '') if value.isdigit() else (1, 0, value)
+
+        return sorted(objects, key=key, reverse=direction == 'desc')
+
+    def _render(self, cls: str, attrs: Dict, mode: str, classes: set, child_filter) -> Dict:
+        children = []
+        if mode != 'no':
+            children = self._subtree(attrs['dn'], mode, classes, child_filter)
+        if children:
+            return {cls: {'attributes': attrs, 'children': children}}
+        return {cls: {'attributes': attrs}}
+
+    def _subtree(self, dn: str, mode: str, classes: set, child_filter) -> List[Dict]:
+        """Returns the children of dn. With mode full, the descendants are included and children without a match
+           are kept if one of their descendants matches. Mode stats only returns statistics children.
+        """
+        subtree = []
+        for cls, attrs in self.__children.get(dn, []):
+            if mode == 'stats' and not is_stats_class(cls):
+                continue
+            descendants = self._subtree(attrs['dn'], mode, classes, child_filter) if mode == 'full' else []
+            matches = (classes is None or cls in classes) and (child_filter is None or child_filter(cls, attrs))
+            if not matches and not descendants:
+                continue
+            if descendants:
+                subtree.append({cls: {'attributes': attrs, 'children': descendants}})
+            else:
+                subtree.append({cls: {'attributes': attrs}})
+        return subtree
+
+
+class SimulatedHostHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        host = self.server.host
+        if urlsplit(self.path).path != '/api/aaaLogin.json':
+            return self._send(400, error_response(400, f'unsupported path {self.path}'))
+        try:
+            json.loads(body)['aaaUser']['attributes']['name']
+        except (KeyError, TypeError, ValueError):
+            return self._send(400, error_response(400, 'invalid login payload'))
+        host.count('logins')
+        self._send(200, login_response(host.fabric.login()))
+
+    def do_GET(self):
+        host = self.server.host
+        url = urlsplit(self.path)
+        if url.path.startswith('/socket'):
+            return self._serve_websocket(url.path[len('/socket'):])
+        cookie = re.search(r'APIC-cookie=([^;\s]+)', self.headers.get('Cookie', ''))
+        if cookie is None or not host.fabric.is_valid_token(cookie.group(1)):
+            return self._send(403, error_response(403, 'Token was invalid (Error: Token timeout)'))
+        if url.path == '/api/aaaRefresh.json':
+            host.count('refreshes')
+            return self._send(200, login_response(cookie.group(1)))
+
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        if url.path == '/api/subscriptionRefresh.json':
+            host.count('subscription_refreshes')
+            if not host.refresh_subscription(params.get('id')):
+                return self._send(400, error_response(400, f'unknown subscription {params.get("id")}'))
+            return self._send(200, {'totalCount': '0', 'imdata': []})
+
+        host.count('requests')
+        injection = host.injection
+        subscribe = params.pop('subscription', 'no') == 'yes'
+        try:
+            res = host.fabric.query(unquote(url.path), params)
+            # changes from now on are pushed, even while the response is delayed by the injected latency
+            if subscribe:
+                res['subscriptionId'] = host.subscribe(cookie.group(1), unquote(url.path), params)
+        except QueryError as e:
+            return self._send(400, error_response(400, str(e)))
+
+        time.sleep(injection.latency + random.uniform(0, injection.jitter) +
+                   injection.latency_per_object * len(res['imdata']))
+        if random.random() < injection.error_rate:
+            host.count('errors')
+            return self._send(500, error_response(500, 'simulated error'))
+        self._send(200, res)
+
+    def _serve_websocket(self, token: str):
+        """Upgrades the request to the websocket of the token, which carries the changes of its subscriptions"""
+        host = self.server.host
+        if not host.fabric.is_valid_token(token):
+            return self._send(403, error_response(403, 'Token was invalid (Error: Token timeout)'))
+        if not host.accept_websockets:
+            return self._send(503, error_response(503, 'websocket unavailable'))
+        key = self.headers.get('Sec-WebSocket-Key')
+        if self.headers.get('Upgrade', '').lower() != 'websocket' or key is None:
+            return self._send(400, error_response(400, 'websocket upgrade expected'))
+
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+        websocket = SimulatedWebSocket(self.connection)
+        host.open_websocket(token, websocket)
+        try:
+            websocket.serve()
+        finally:
+            host.close_websocket(token, websocket)
+
+    def _send(self, status: int, body: Dict):
+        data = json.dumps(body).encode()
+        self.server.host.count('bytes_sent', len(data))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class SimulatedWebSocket(object):
+
+    def __init__(self, connection: ssl.SSLSocket):
+        """Server side of a websocket on the connection of an upgraded request. An SSL socket must not be used by two
+           threads at once, so pushed messages are queued and written by the thread of the request.
+        """
+        self.__connection = connection
+        self.__outgoing = queue.Queue()
+
+    def push(self, message: Dict):
+        self.__outgoing.put((OP_TEXT, json.dumps(message).encode()))
+
+    def close(self):
+        """Sends a close frame and closes the connection"""
+        self.__outgoing.put((OP_CLOSE, b''))
+
+    def serve(self):
+        """Writes the queued messages and answers pings until the websocket is closed by either side"""
+        try:
+            while True:
+                while not self.__outgoing.empty():
+                    opcode, payload = self.__outgoing.get()
+                    self._write(opcode, payload)
+                    if opcode == OP_CLOSE:
+                        return
+                if self.__connection.pending() == 0 and \
+                        not select.select([self.__connection], [], [], WEBSOCKET_POLL_SECONDS)[0]:
+                    continue
+                opcode, payload = self._read_frame()
+                if opcode == OP_PING:
+                    self._write(OP_PONG, payload)
+                elif opcode == OP_CLOSE:
+                    self._write(OP_CLOSE, payload[:2])
+                    return
+        except (ConnectionError, OSError):
+            return
+
+    def _read_frame(self) -> tuple:
+        head = self._recv(2)
+        opcode, masked, length = head[0] & 0x0f, head[1] & 0x80, head[1] & 0x7f
+        if length == 126:
+            length = int.from_bytes(self._recv(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(self._recv(8), 'big')
+        mask = self._recv(4) if masked else bytes(4)
+        payload = self._recv(length)
+        return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def _recv(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.__connection.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('websocket closed by the client')
+            data += chunk
+        return data
+
+    def _write(self, opcode: int, payload: bytes):
+        if len(payload) < 126:
+            header = bytes([0x80 | opcode, len(payload)])
+        elif len(payload) < 1 << 16:
+            header = bytes([0x80 | opcode, 126]) + len(payload).to_bytes(2, 'big')
+        else:
+            header = bytes([0x80 | opcode, 127]) + len(payload).to_bytes(8, 'big')
+        self.__connection.sendall(header + payload)
+
+
+def error_response(code: int, text: str) -> Dict:
+    return {'totalCount': '1', 'imdata': [{'error': {'attributes': {'code': str(code), 'text': text}}}]}
+
+
+def login_response(token: str) -> Dict:
+    attributes = {'token': token, 'refreshTimeoutSeconds': str(TOKEN_LIFETIME_SECONDS)}
+    return {'totalCount': '1', 'imdata': [{'aaaLogin': {'attributes': attributes}}]}
+
+
+class SimulatedHost(object):
+
+    def __init__(self, fabric: SyntheticFabric, injection: injection_tuple = NO_INJECTION):
+        """An APIC host of the simulated cluster, counting the requests and bytes it serves"""
+        self.fabric = fabric
+        self.injection = injection
+        self.address = None
+        # refuse websocket connections, e.g. to keep a subscriber disconnected
+        self.accept_websockets = True
+        self.__lock = threading.Lock()
+        self.__stats: Dict[str, int] = {}
+        self.__server = None
+        self.__websockets: Dict[str, SimulatedWebSocket] = {}
+        # subscription id to the token, class and filter of the subscribed query
+        self.__subscriptions: Dict[str, tuple] = {}
+        self.__subscription_ids = itertools.count(72057594037927937)
+        fabric.add_listener(self.notify)
+
+    def count(self, name: str, value: int = 1):
+        with self.__lock:
+            self.__stats[name] = self.__stats.get(name, 0) + value
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return dict(self.__stats)
+
+    def open_websocket(self, token: str, websocket: SimulatedWebSocket):
+        with self.__lock:
+            self.__websockets[token] = websocket
+        self.count('websockets')
+
+    def close_websocket(self, token: str, websocket: SimulatedWebSocket):
+        """Forgets the websocket and, like the APIC, the subscriptions of its token"""
+        with self.__lock:
+            if self.__websockets.get(token) is websocket:
+                del self.__websockets[token]
+                self.__subscriptions = {k: v for k, v in self.__subscriptions.items() if v[0] != token}
+
+    def drop_websockets(self):
+        """Closes all websockets, their subscriptions end"""
+        with self.__lock:
+            websockets = list(self.__websockets.values())
+        for websocket in websockets:
+            websocket.close()
+
+    def subscriptions(self) -> List[str]:
+        with self.__lock:
+            return list(self.__subscriptions.keys())
+
+    def subscribe(self, token: str, path: str, params: Dict[str, str]) -> str:
+        """Subscribes the class query for the websocket of the token and returns the subscription id"""
+        match = re.match(r'^/api/(?:node/)?class/(\w+)\.json$', path)
+        if match is None:
+            raise QueryError(f'subscriptions are only simulated for class queries, not {path}')
+        predicate = parse_filter(params['query-target-filter']) if 'query-target-filter' in params else None
+        with self.__lock:
+            if token not in self.__websockets:
+                raise QueryError('subscription requires an open websocket')
+            subscription_id = str(next(self.__subscription_ids))
+            self.__subscriptions[subscription_id] = (token, match.group(1), predicate)
+        return subscription_id
+
+    def refresh_subscription(self, subscription_id: str) -> bool:
+        with self.__lock:
+            return subscription_id in self.__subscriptions
+
+    def notify(self, cls: str, old: Dict, new: Dict, status: str):
+        """Pushes a change of the fabric to the websockets of the subscriptions whose query matched the object
+           before or after the change. Modified objects carry only the changed attributes, like on the APIC.
+        """
+        if status == 'created':
+            attrs = {**new, 'status': status}
+        elif status == 'modified':
+            attrs = {k: v for k, v in new.items() if old.get(k) != v}
+            attrs.update({'dn': new['dn'], 'status': status})
+        else:
+            attrs = {'dn': old['dn'], 'status': status}
+
+        by_token: Dict[str, List[str]] = {}
+        with self.__lock:
+            for subscription_id, (token, subscribed_cls, predicate) in self.__subscriptions.items():
+                if subscribed_cls != cls:
+                    continue
+                if predicate is None or any(o is not None and predicate(cls, o) for o in (old, new)):
+                    by_token.setdefault(token, []).append(subscription_id)
+            websockets = {token: self.__websockets.get(token) for token in by_token}
+        for token, subscription_ids in by_token.items():
+            if websockets[token] is not None:
+                websockets[token].push({'subscriptionId': subscription_ids, 'imdata': [{cls: {'attributes': attrs}}]})
+                self.count('events')
+
+    def start(self, context: ssl.SSLContext, port: int = 0, addr: str = '127.0.0.1'):
+        self.__server = ThreadingHTTPServer((addr, port), SimulatedHostHandler)
+        self.__server.daemon_threads = True
+        self.__server.socket = context.wrap_socket(self.__server.socket, server_side=True)
+        self.__server.host = self
+        self.address = f'{addr}:{self.__server.server_address[1]}'
+        threading.Thread(target=self.__server.serve_forever, name=f'apic-simulator-{self.address}', daemon=True).start()
+
+    def stop(self):
+        self.drop_websockets()
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+class ApicSimulator(object):
+
+    def __init__(self, fabric: SyntheticFabric, hosts: int = 3, injection: injection_tuple = NO_INJECTION):
+        """Serves the fabric on hosts HTTPS servers sharing the fabric and the issued tokens"""
+        self.fabric = fabric
+        self.hosts = [SimulatedHost(fabric, injection) for _ in range(hosts)]
+        self.__directory = None
+
+    def start(self, port: int = 0, addr: str = '127.0.0.1', cert: str = None, key: str = None) -> List[str]:
+        """Starts the hosts on consecutive ports from port, or on free ports for port 0. Without cert and key a
+           self-signed certificate is generated with openssl. Returns the addresses of the hosts.
+        """
+        if cert is None:
+            self.__directory = tempfile.TemporaryDirectory()
+            cert, key = os.path.join(self.__directory.name, 'cert.pem'), os.path.join(self.__directory.name, 'key.pem')
+            subprocess.run([
+                'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=apic-simulator',
+                '-keyout', key, '-out', cert
+            ],
+                           check=True,
+                           capture_output=True)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        for i, host in enumerate(self.hosts):
+            host.start(context, port + i if port else 0, addr)
+        self.fabric.set_controller_addresses([host.address for host in self.hosts])
+        return [host.address for host in self.hosts]
+
+    def stop(self):
+        for host in self.hosts:
+            host.stop()
+        if self.__directory is not None:
+            self.__directory.cleanup()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the sum of the counters of all hosts"""
+        total = {}
+        for host in self.hosts:
+            for name, value in host.stats().items():
+                total[name] = total.get(name, 0) + value
+        return total
+
+
+def fabric_options(command):
+    """Adds the options sizing the synthetic fabric and injecting latency and errors to a click command"""
+    options = [
+        click.option('--pods', default=1, help='number of pods'),
+        click.option('--spines', default=4, help='number of spine switches'),
+        click.option('--leaves', default=40, help='number of leaf switches'),
+        click.option('--controllers', default=3, help='number of APIC controllers in the fabric inventory'),
+        click.option('--interfaces', default=48, help='physical interfaces per switch'),
+        click.option('--faults', default=5000, help='number of raised faults'),
+        click.option('--endpoints', default=10000, help='number of endpoints (fvIp and coopEpRec)'),
+        click.option('--duplicate-ips', default=20, help='number of endpoints reported as duplicate IP'),
+        click.option('--seed', default=0, help='seed of the generated fabric'),
+        click.option('--latency', default=0.0, help='seconds added to every query'),
+        click.option('--jitter', default=0.0, help='random seconds up to jitter added to every query'),
+        click.option('--latency-per-object', default=0.0, help='seconds added per returned object'),
+        click.option('--error-rate', default=0.0, help='share of queries answered with a 500 error'),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def create_simulator(hosts: int, pods: int, spines: int, leaves: int, controllers: int, interfaces: int, faults: int,
+                     endpoints: int, duplicate_ips: int, seed: int, latency: float, jitter: float,
+                     latency_per_object: float, error_rate: float) -> ApicSimulator:
+    size = fabric_size(pods, spines, leaves, controllers, interfaces, faults, endpoints, duplicate_ips)
+    injection = injection_tuple(latency, jitter, latency_per_object, error_rate)
+    return ApicSimulator(SyntheticFabric(size, seed), hosts, injection)
+
+
+@click.command()
+@click.option('--hosts', default=3, help='number of simulated APIC hosts')
+@click.option('--port', default=8443, help='port of the first host, the other hosts use the following ports')
+@click.option('--addr', default='127.0.0.1', help='address to listen on')
+@click.option('--cert', default=None, help='certificate of the hosts, generated if not given')
+@click.option('--key', default=None, help='private key of the certificate')
+@fabric_options
+def main(hosts, port, addr, cert, key, **options):
+    started = time.time()
+    simulator = create_simulator(hosts, **options)
+    print(f'generated fabric in {time.time() - started:.1f} sec')
+    addresses = simulator.start(port, addr, cert, key)
+    print(f'serving simulated apic hosts: {",".join(addresses)}')
+    while True:
+        time.sleep(60)
+        print(f'served {simulator.stats()}')
+
+
+if __name__ == '__main__':
+    main()
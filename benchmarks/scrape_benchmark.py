@@ -0,0 +1,192 @@
+"""Benchmarks the collectors against a simulated APIC cluster.
+
+Each collector is scraped repeatedly in its own process against the hosts of benchmarks/apic_simulator.py. For every
+collector the cold (first) and warm scrape latency, the APIC requests and bytes per scrape as counted by the simulated
+hosts and the peak RSS of the process are reported.
+
+    python benchmarks/scrape_benchmark.py --leaves 200 --faults 50000 --output results.json
+    python benchmarks/scrape_benchmark.py --leaves 200 --faults 50000 --baseline results.json
+
+With --baseline the results are compared with a previous --output file and the command fails if a collector got
+slower, sent more requests or bytes or used more memory than the tolerance allows. The command fails without writing
+--output if a collector returned no samples or sent no requests, as its numbers do not measure a working scrape.
+"""
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import click
+import yaml
+
+from apic_simulator import create_simulator, fabric_options
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOLERANCE = 0.2
+# latency differences below this are treated as noise
+MIN_LATENCY_DELTA_SECONDS = 0.05
+COMPARED_RESULTS = ('warm_seconds', 'requests', 'bytes', 'peak_rss_kb')
+# a CA bundle of the environment overrides verify=False of the connections to the self-signed simulator
+CA_BUNDLE_VARIABLES = ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE')
+
+
+def max_rss_kb() -> int:
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def get_default_collectors():
+    directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'collectors')
+    return sorted(name[:-3] for name in os.listdir(directory) if name.endswith('.py') and name != '__init__.py')
+
+
+def measure(name: str, hosts: str, scrapes: int, config_file: str):
+    """Scrapes the collector and prints the scrape durations, the number of samples and the peak RSS"""
+    from exporter import initialize_collector_by_name
+    from modules.Connection import collection_cycle
+
+    config = {}
+    if config_file:
+        with open(config_file) as f:
+            config = yaml.load(f, Loader=yaml.Loader).get('aci', {})
+    config = {**config, 'apic_hosts': hosts, 'apic_user': 'benchmark', 'apic_password': 'benchmark'}
+    collector = initialize_collector_by_name(name, config)
+    if collector is None:
+        sys.exit(1)
+
+    baseline = max_rss_kb()
+    durations, samples = [], 0
+    for _ in range(scrapes):
+        started = time.time()
+        with collection_cycle([collector]):
+            samples = sum(len(metric.samples) for metric in collector.collect())
+        durations.append(time.time() - started)
+    print(
+        json.dumps({
+            'durations': durations,
+            'samples': samples,
+            'peak_rss_kb': max_rss_kb(),
+            'rss_growth_kb': max_rss_kb() - baseline
+        }))
+
+
+def run_collector(name: str, simulator, hosts: list, scrapes: int, config_file: str) -> dict:
+    """Runs the collector in its own process and combines its measurements with the counters of the simulator"""
+    before = simulator.stats()
+    args = [
+        sys.executable, __file__, '--measure-collector', name, '--measure-hosts', ','.join(hosts), '--scrapes',
+        str(scrapes)
+    ]
+    if config_file:
+        args += ['--config', config_file]
+    env = {key: value for key, value in os.environ.items() if key not in CA_BUNDLE_VARIABLES}
+    proc = subprocess.run(args, capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise click.ClickException(f'benchmark of {name} failed:\n{proc.stderr}')
+    measured = json.loads(proc.stdout.strip().splitlines()[-1])
+    after = simulator.stats()
+
+    durations = measured['durations']
+    return {
+        'cold_seconds': durations[0],
+        'warm_seconds': statistics.median(durations[1:] or durations),
+        'max_seconds': max(durations),
+        'requests': (after.get('requests', 0) - before.get('requests', 0)) / scrapes,
+        'logins': after.get('logins', 0) - before.get('logins', 0),
+        'bytes': (after.get('bytes_sent', 0) - before.get('bytes_sent', 0)) / scrapes,
+        'samples': measured['samples'],
+        'peak_rss_kb': measured['peak_rss_kb'],
+        'rss_growth_kb': measured['rss_growth_kb']
+    }
+
+
+def check(results: dict) -> list:
+    """Returns the collectors whose results do not measure a working scrape"""
+    problems = []
+    for name, result in results.items():
+        if result['samples'] == 0:
+            problems.append(f'{name} returned no samples')
+        if result['requests'] == 0:
+            problems.append(f'{name} sent no requests to the simulator')
+    return problems
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns the regressions of the results compared with the baseline"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in COMPARED_RESULTS:
+            old, new = baseline[name][key], result[key]
+            if new <= old * (1 + tolerance):
+                continue
+            if key == 'warm_seconds' and new - old < MIN_LATENCY_DELTA_SECONDS:
+                continue
+            regressions.append(f'{name} {key}: {old:.3f} -> {new:.3f}')
+    return regressions
+
+
+def print_results(results: dict):
+    print(f'{"collector":<30} {"cold s":>8} {"warm s":>8} {"max s":>8} {"requests":>9} {"KB":>10} {"samples":>8} '
+          f'{"RSS MB":>8}')
+    for name, r in results.items():
+        print(f'{name:<30} {r["cold_seconds"]:>8.3f} {r["warm_seconds"]:>8.3f} {r["max_seconds"]:>8.3f} '
+              f'{r["requests"]:>9.1f} {r["bytes"] / 1024:>10.1f} {r["samples"]:>8} {r["peak_rss_kb"] / 1024:>8.1f}')
+
+
+@click.command()
+@click.option('--collector', 'collectors', multiple=True, help='collector to benchmark, all collectors by default')
+@click.option('--scrapes', default=5, help='scrapes per collector, the first one is reported as cold scrape')
+@click.option('--hosts', default=3, help='number of simulated APIC hosts')
+@click.option('--config', 'config_file', default=None, help='exporter config whose aci section is used')
+@click.option('--output', default=None, help='file to write the results to')
+@click.option('--baseline', default=None, help='results of a previous run to compare with')
+@click.option('--tolerance', default=TOLERANCE, help='allowed relative increase compared with the baseline')
+@click.option('--measure-collector', hidden=True)
+@click.option('--measure-hosts', hidden=True)
+@fabric_options
+def main(collectors, scrapes, hosts, config_file, output, baseline, tolerance, measure_collector, measure_hosts,
+         **options):
+    if measure_collector:
+        measure(measure_collector, measure_hosts, scrapes, config_file)
+        return
+
+    simulator = create_simulator(hosts, **options)
+    addresses = simulator.start()
+    print(f'simulated fabric: {dict(simulator.fabric.size._asdict())}')
+
+    results = {}
+    for name in collectors or get_default_collectors():
+        results[name] = run_collector(name, simulator, addresses, scrapes, config_file)
+    simulator.stop()
+    print_results(results)
+
+    problems = check(results)
+    for problem in problems:
+        print(f'invalid result: {problem}')
+    if problems:
+        raise click.ClickException(f'{len(problems)} invalid results, check the log of the collectors')
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'fabric': simulator.fabric.size._asdict(), 'results': results}, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            previous = json.load(f)
+        if previous['fabric'] != simulator.fabric.size._asdict():
+            raise click.ClickException(f'baseline was measured on a different fabric: {previous["fabric"]}')
+        regressions = compare(results, previous['results'], tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions compared with {baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Compares the peak RSS of decoding a large APIC response at once with the streaming decoder.
+
+A synthetic faultInst response is served by a local HTTP server. Each decode mode runs in its own process, which
+reports the growth of its peak RSS while fetching and aggregating the response.
+
+    python benchmarks/streaming_memory.py --objects 100000
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import click
+
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def write_payload(path: str, objects: int):
+    """Writes a faultInst class query response with the given number of objects"""
+    with open(path, 'w') as f:
+        f.write(f'{{"totalCount":"{objects}","imdata":[')
+        for i in range(objects):
+            if i > 0:
+                f.write(',')
+            code = f'F{1000 + i % 500}'
+            attributes = {
+                'ack': 'no',
+                'cause': 'threshold-crossed',
+                'code': code,
+                'descr': f'TCA: synthetic fault {i} of the streaming benchmark',
+                'dn': f'topology/pod-1/node-{101 + i % 200}/sys/phys-[eth1/{i % 48}]/fault-{code}',
+                'domain': 'infra',
+                'lc': 'raised',
+                'modTs': '2024-01-01T00:00:00.000+00:00',
+                'severity': 'warning',
+                'type': 'operational'
+            }
+            json.dump({'faultInst': {'attributes': attributes}}, f)
+        f.write(']}')
+
+
+def max_rss_kb() -> int:
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(url: str, mode: str):
+    """Fetches url, counts the faults by code and prints the peak RSS growth in KB"""
+    import requests
+    from modules.JsonStream import ImdataStream
+
+    baseline = max_rss_kb()
+    counts = {}
+    if mode == 'full':
+        resp = requests.get(url)
+        res = json.loads(resp.text)
+        objects = res['imdata']
+    else:
+        resp = requests.get(url, stream=True)
+        objects = ImdataStream(resp.iter_content(chunk_size=64 * 1024)).objects()
+    for fault in objects:
+        code = fault['faultInst']['attributes']['code']
+        counts[code] = counts.get(code, 0) + 1
+    print(json.dumps({'mode': mode, 'objects': sum(counts.values()), 'peak_rss_kb': max_rss_kb() - baseline}))
+
+
+@click.command()
+@click.option("--objects", metavar="<objects>", default=100000, help="number of faultInst objects in the payload")
+@click.option("--measure-url", hidden=True)
+@click.option("--measure-mode", hidden=True)
+def main(objects, measure_url, measure_mode):
+    if measure_url:
+        measure(measure_url, measure_mode)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_payload(os.path.join(directory, 'faultInst.json'), objects)
+        size = os.path.getsize(os.path.join(directory, 'faultInst.json'))
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/faultInst.json'
+
+        print(f'payload: {objects} objects, {size / 1024 / 1024:.1f} MB')
+        for mode in ('full', 'stream'):
+            out = subprocess.run([sys.executable, __file__, '--measure-url', url, '--measure-mode', mode],
+                                 check=True,
+                                 capture_output=True,
+                                 text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f'{mode:>6}: {result["objects"]} objects, peak RSS +{result["peak_rss_kb"] / 1024:.1f} MB')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,8 @@ class ApicCoopDbCollector(Collector):
         yield GaugeMetricFamily('network_apic_coop_records_total', 'APIC COOP DB entries')
 
     def get_query(self) -> str:
-        return '/api/node/class/fabricNode.json?query-target-filter=eq(fabricNode.role,"spine")'
+        # the spines are taken from the shared fabric topology
+        return None
 
     def get_metrics(self, host: str, data: Dict) -> List[GaugeMetricFamily]:
         """Collect the number of entries in the coop db for all spines"""
@@ -23,16 +24,27 @@ class ApicCoopDbCollector(Collector):
                                       'APIC COOP DB entries',
                                       labels=['apicHost', 'spineDn'])
 
-        for spine in data['imdata']:
-            spine_attributes = spine['fabricNode']['attributes']
-            query_coop_count = '/api/node/mo/' + \
-                               spine_attributes['dn'] + \
-                               '/sys/coop/inst/dom-overlay-1.json' + \
-                               '?query-target=subtree&target-subtree-class=coopEpRec&rsp-subtree-include=count'
-            fetched_data = self.query_host(host, query_coop_count)
-            if fetched_data is None:
-                return None
-            fetched_count = fetched_data['imdata'][0]['moCount']['attributes']['count']
-            g_coop_db.add_metric(labels=[host, spine_attributes['dn']], value=fetched_count)
+        queries = {}
+        for spine in self.topology.get_nodes('spine'):
+            spine_dn = spine.dn
+            queries[spine_dn] = '/api/node/mo/' + \
+                                spine_dn + \
+                                '/sys/coop/inst/dom-overlay-1.json' + \
+                                '?query-target=subtree&target-subtree-class=coopEpRec&rsp-subtree-include=count'
+
+        if len(queries) == 0:
+            return None
+
+        results = self.query_host_batch(host, queries)
+        if len(results) == 0:
+            return None
+
+        for spine_dn, fetched_data in results.items():
+            try:
+                fetched_count = fetched_data['imdata'][0]['moCount']['attributes']['count']
+            except (KeyError, IndexError) as e:
+                LOG.error(f'apic host {host} spine {spine_dn} returned no coop count: {e}')
+                continue
+            g_coop_db.add_metric(labels=[host, spine_dn], value=fetched_count)
 
         return [g_coop_db]
@@ -11,6 +11,9 @@ LOG = logging.getLogger('apic_exporter.exporter')
 
 class ApicEquipmentCollector(Collector):
 
+    # the full subtree of the flash devices can be large, get_metrics reads the objects as they are fetched
+    paginated = True
+
     def __init__(self, config: Dict):
         super().__init__('apic_equipment', config)
 
@@ -1,23 +1,55 @@
 from Collector import Collector
 import logging
+from time import time
+from datetime import datetime, timezone
+from urllib.parse import quote
 from prometheus_client.core import GaugeMetricFamily
-from typing import List, Dict
+from typing import Dict, Iterator, List
 from modules.Helper import Unpack
+from modules.FaultIndex import FAULT_QUERY
+from modules.Connection import PaginationError
 
 LOG = logging.getLogger('apic_exporter.exporter')
+FAULT_RESYNC_SECONDS = 600
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parses an APIC timestamp like 2024-01-31T12:00:00.123+01:00 to an aware datetime, so timestamps of APICs with
+       different offsets compare correctly. A timestamp without offset is taken as UTC. Returns None if invalid.
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def format_timestamp(value: datetime) -> str:
+    """Formats the timestamp in UTC with the millisecond precision of the APIC, e.g. 2024-01-31T11:00:00.123+00:00"""
+    return value.astimezone(timezone.utc).isoformat(timespec='milliseconds')
 
 
 class ApicFaultsCollector(Collector):
 
+    paginated = True
+    uses_fault_index = True
+
     def __init__(self, config: Dict):
         super().__init__('apic_faults', config)
+        self.__resync_seconds = int(config.get('fault_resync_seconds', FAULT_RESYNC_SECONDS))
+        self.__resync_at = 0
+        self.__watermark = None
 
     def describe(self):
         yield GaugeMetricFamily('network_apic_faults', 'APIC faults')
 
     def get_query(self) -> str:
-        return '/api/node/class/faultInst.json?' + \
-               'query-target-filter=or(eq(faultInst.lc,"raised"),eq(faultInst.lc,"soaking"))'
+        # the fault index already holds the faults or is synced by get_metrics
+        if self.fault_index is not None and (self.fault_source == 'delta' or self.fault_index.is_synced()):
+            return None
+        return FAULT_QUERY
 
     def get_metrics(self, host: str, data: Dict) -> List[GaugeMetricFamily]:
         """Collects APIC faults by multiple categories"""
@@ -25,6 +57,13 @@ class ApicFaultsCollector(Collector):
                                           'APIC faults by severity, type, domain, code, cause, openstack and ack',
                                           labels=['severity', 'type', 'domain', 'code', 'cause', 'openstack', 'ack'])
 
+        if data is None:
+            if self.fault_source == 'delta' and not self.sync_fault_index(host):
+                return None
+            for k, v in self.fault_index.get_counts().items():
+                g_apic_faults.add_metric(labels=k, value=v)
+            return [g_apic_faults]
+
         faults = {}
         for fault_object in data['imdata']:
             try:
@@ -40,3 +79,68 @@ class ApicFaultsCollector(Collector):
         for k, v in faults.items():
             g_apic_faults.add_metric(labels=k, value=v)
         return [g_apic_faults]
+
+    def sync_fault_index(self, host: str) -> bool:
+        """Loads all raised and soaking faults into the fault index on the first run and every fault_resync_seconds.
+           In between only the faults modified since the last sync and the deletion records created since then are
+           fetched. Returns False if the sync failed, the next sync is a full load then.
+        """
+        try:
+            if not self.fault_index.is_synced() or self.__watermark is None or time() >= self.__resync_at:
+                return self._load_faults(host)
+            return self._load_fault_changes(host)
+        except PaginationError as e:
+            LOG.warning(f'fault sync with apic host {host} failed: {e}')
+            self.fault_index.set_synced(False)
+            return False
+
+    def _load_faults(self, host: str) -> bool:
+        started = time()
+        fetched_data = self.query_host_paged(host, FAULT_QUERY)
+        if fetched_data is None:
+            return False
+        watermark = [self.__watermark]
+        self.fault_index.replace(self._track_watermark(fetched_data['imdata'], watermark), host)
+        self.__watermark = watermark[0]
+        self.__resync_at = started + self.__resync_seconds
+        return True
+
+    def _load_fault_changes(self, host: str) -> bool:
+        # the APIC timestamp contains a '+' of the timezone offset
+        since = quote(format_timestamp(self.__watermark))
+        query = f'/api/node/class/faultInst.json?query-target-filter=ge(faultInst.modTs,"{since}")'
+        fetched_data = self.query_host_paged(host, query)
+        if fetched_data is None:
+            return False
+        watermark = [self.__watermark]
+        changed = 0
+        for fault_object in self._track_watermark(fetched_data['imdata'], watermark):
+            self.fault_index.apply(fault_object)
+            changed += 1
+
+        # deleted faults do not show up as modified faultInst, only as deletion records of the fault history
+        query = '/api/node/class/faultRecord.json?query-target-filter=' + \
+                f'and(eq(faultRecord.ind,"deletion"),ge(faultRecord.created,"{since}"))'
+        fetched_data = self.query_host_paged(host, query)
+        if fetched_data is None:
+            return False
+        deleted = 0
+        for record in fetched_data['imdata']:
+            attrs = record.get('faultRecord', {}).get('attributes', {})
+            if 'affected' in attrs and 'code' in attrs:
+                dn = f'{attrs["affected"]}/fault-{attrs["code"]}'
+                self.fault_index.apply({'faultInst': {'attributes': {'dn': dn, 'status': 'deleted'}}})
+                deleted += 1
+
+        LOG.debug(f'apic host {host}, synced {changed} modified and {deleted} deleted faults since '
+                  f'{format_timestamp(self.__watermark)}')
+        self.__watermark = watermark[0]
+        return True
+
+    def _track_watermark(self, fault_objects: Iterator[Dict], watermark: List[datetime]) -> Iterator[Dict]:
+        """Yields the fault objects and keeps the latest modTs in watermark[0]"""
+        for fault_object in fault_objects:
+            mod_ts = parse_timestamp(fault_object.get('faultInst', {}).get('attributes', {}).get('modTs'))
+            if mod_ts is not None and (watermark[0] is None or mod_ts > watermark[0]):
+                watermark[0] = mod_ts
+            yield fault_object
@@ -69,8 +69,6 @@ class ApicHealthCollector(BaseCollector.BaseCollector):
     def collect(self):
         LOG.debug('collecting apic health metrics ...')
 
-        self.reset_unavailable_hosts()
-
         self.__metric_counter = 0
 
         metrics: List[GaugeMetricFamily] = []
@@ -10,6 +10,8 @@ LOG = logging.getLogger('apic_exporter.exporter')
 
 class ApicInterfacesCollector(Collector):
 
+    paginated = True
+
     def __init__(self, config: Dict):
         super().__init__('apic_interfaces', config)
 
@@ -10,8 +10,6 @@ class ApicLeafCapacityCollector(Collector):
 
     def __init__(self, config: Dict):
         super().__init__('apic_leaf_capacity', config)
-        self.leaf_ids = {}
-        self.gen1_leaves = {}
 
     def describe(self):
         yield GaugeMetricFamily('network_apic_leaf_capacity', 'ACI Leaf capacity')
@@ -28,19 +26,17 @@ class ApicLeafCapacityCollector(Collector):
         g_leaf_cap_tcam = GaugeMetricFamily('network_apic_leaf_capacity_tcam',
                                             'ACI Leaf IPv4 EndPoint TCAM capacity available',
                                             labels=['aciLeaf', 'usage', 'layer'])
-        if not self.leaf_ids:
-            self.leaf_ids = self._get_leaf_ids(host)
-        if not self.gen1_leaves:
-            self.gen1_leaves = self._get_gen1_leaves(host)
+        # map the leaves by the rn of their dn (node-101), which is also used as label
+        leaves = {node.dn.split('/')[2]: node for node in self.topology.get_nodes('leaf')}
         for leaf in data['imdata']:
             if 'eqptcapacityEntity' in leaf and 'children' in leaf['eqptcapacityEntity']:
                 """Ignore spine switches without children data"""
                 leaf_data = leaf['eqptcapacityEntity']['children']
                 leaf_dn = leaf['eqptcapacityEntity']['attributes']['dn'].split('/')
                 leaf_id = leaf_dn[2]
-                if not self.leaf_ids.get(leaf_id, False):
+                if leaf_id not in leaves:
                     continue
-                if not self.gen1_leaves.get(leaf_id, False):
+                if not self.topology.is_gen1(leaves[leaf_id]):
                     for data_object in leaf_data:
                         if 'eqptcapacityL3TotalUsageCap5min' in data_object:
                             l3_max = data_object['eqptcapacityL3TotalUsageCap5min']['attributes']['v4TotalEpCapMax']
@@ -91,23 +87,3 @@ class ApicLeafCapacityCollector(Collector):
                     g_leaf_cap_tcam.add_metric(labels=[leaf_id, 'total', 'l3'], value=l3_total)
                     g_leaf_cap_tcam.add_metric(labels=[leaf_id, 'total', 'l2'], value=l2_total)
         return [g_leaf_cap_tcam]
-
-    def _get_leaf_ids(self, host: str) -> Dict:
-        '''_get_leaf_ids queries the apic for all fabricNodes with role="leaf" and returns a map containing leaf ids'''
-        result = self.query_host(host, '/api/node/class/fabricNode.json?query-target-filter=eq(fabricNode.role,"leaf")')
-        leaf_ids = {}
-        for leaf in result['imdata']:
-            leaf_id = leaf['fabricNode']['attributes']['dn'].split('/')[2]
-            leaf_ids[leaf_id] = True
-        return leaf_ids
-
-    def _get_gen1_leaves(self, host: str) -> Dict:
-        '''filter for generation 1 leaf models'''
-        result = self.query_host(
-            host, '/api/node/class/fabricNode.json' + '?query-target-filter=and(' +
-            'or(wcard(fabricNode.model,"PQ"),wcard(fabricNode.model,"PX"))' + ',eq(fabricNode.role,"leaf"))')
-        gen1_leaves = {}
-        for leaf in result['imdata']:
-            leaf_id = leaf['fabricNode']['attributes']['dn'].split('/')[2]
-            gen1_leaves[leaf_id] = True
-        return gen1_leaves
@@ -2,13 +2,17 @@ import logging
 
 from prometheus_client.core import CounterMetricFamily, Summary
 import BaseCollector
+from modules.Connection import PaginationError
 
 LOG = logging.getLogger('apic_exporter.exporter')
 REQUEST_TIME = Summary('apic_mcp_faults_processing_seconds', 'Time spent processing request')
+MCP_FAULT_CODES = ('F2533', 'F2534')
 
 
 class ApicMCPCollector(BaseCollector.BaseCollector):
 
+    uses_fault_index = True
+
     def describe(self):
         yield CounterMetricFamily('network_apic_mcp_fault_counter', 'Counter for MCP Faults')
 
@@ -20,35 +24,59 @@ class ApicMCPCollector(BaseCollector.BaseCollector):
                                            'Counter for MCP Faults',
                                            labels=['apicHost', 'fault_summary', 'fault_desc', 'fault_lifecyle'])
 
+        if self.fault_index is not None and self.fault_index.is_synced():
+            yield self.collect_from_index(c_mcp_faults)
+            return
+
         metric_counter = 0
         query = "/api/node/class/faultInst.json" + \
                 "?query-target-filter=or(eq(faultInst.code,\"F2533\"),eq(faultInst.code,\"F2534\"))"
-        for host in self.hosts:
-            fetched_data = self.query_host(host, query)
+        for host in self.ranked_hosts():
+            fetched_data = self.query_host_paged(host, query)
             if fetched_data is None:
                 LOG.warning(f'skipping apic host {host}, {query} did not return anything')
                 continue
 
-            if len(fetched_data['imdata']) == 0:
+            host_faults = []
+            object_count = 0
+            try:
+                for fault in fetched_data['imdata']:
+                    object_count += 1
+                    if (fault['faultInst']['attributes']['lc'] == 'raised' or
+                            fault['faultInst']['attributes']['lc'] == 'soaking'):
+                        fault_lifecyle = fault['faultInst']['attributes']['lc']
+                        fault_summary = fault['faultInst']['attributes']['dn']
+                        fault_desc = fault['faultInst']['attributes']['descr']
+
+                        LOG.debug(f'host: {host}, fault: {fault_lifecyle}, {fault_summary}, {fault_desc}')
+                        host_faults.append([host, fault_summary, fault_desc, fault_lifecyle])
+            except PaginationError as e:
+                LOG.warning(f'skipping apic host {host}: {e}')
+                continue
+
+            if object_count == 0:
                 # Add Empty Counter to have the metric show up in Prometheus.
                 # Otherwise they only show when something is wrong and we dont know if it is actually working
                 c_mcp_faults.add_metric(labels=[host, '', '', ''], value=0)
                 metric_counter += 1
                 break  # Each host produces the same metrics.
-            count = int(fetched_data['totalCount'])
-            for x in range(0, int(count)):
-                if (fetched_data['imdata'][x]['faultInst']['attributes']['lc'] == 'raised' or
-                        fetched_data['imdata'][x]['faultInst']['attributes']['lc'] == 'soaking'):
-                    fault_lifecyle = fetched_data['imdata'][x]['faultInst']['attributes']['lc']
-                    fault_summary = fetched_data['imdata'][x]['faultInst']['attributes']['dn']
-                    fault_desc = fetched_data['imdata'][x]['faultInst']['attributes']['descr']
-
-                    LOG.debug(f'host: {host}, fault: {fault_lifecyle}, {fault_summary}, {fault_desc}')
-                    metric_counter += 1
-
-                    c_mcp_faults.add_metric(labels=[host, fault_summary, fault_desc, fault_lifecyle], value=1)
+
+            for labels in host_faults:
+                c_mcp_faults.add_metric(labels=labels, value=1)
+            metric_counter += len(host_faults)
             break  # Each host produces the same metrics.
 
         yield c_mcp_faults
 
         LOG.info(f'collected {metric_counter} apic mcp fault metrics')
+
+    def collect_from_index(self, c_mcp_faults: CounterMetricFamily) -> CounterMetricFamily:
+        """Adds the raised and soaking MCP faults of the fault index"""
+        host = self.fault_index.host
+        faults = self.fault_index.get_faults(MCP_FAULT_CODES)
+        if len(faults) == 0:
+            c_mcp_faults.add_metric(labels=[host, '', '', ''], value=0)
+        for attrs in faults:
+            c_mcp_faults.add_metric(labels=[host, attrs.get('dn'), attrs.get('descr'), attrs.get('lc')], value=1)
+        LOG.info(f'collected {max(len(faults), 1)} apic mcp fault metrics from the fault index')
+        return c_mcp_faults
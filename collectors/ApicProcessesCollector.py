@@ -22,7 +22,10 @@ class ApicProcessesCollector(Collector):
         yield GaugeMetricFamily('network_apic_process_memory_used_avg_kb', 'Average memory used by process')
 
     def get_query(self) -> str:
-        return '/api/node/class/fabricNode.json?'
+        # fetch the nfm processes of all nodes including their memory consumption
+        return '/api/node/class/procProc.json?query-target-filter=eq(procProc.name,"nfm")' + \
+               '&rsp-subtree-include=stats&rsp-subtree-class=procProcMemHist5min' + \
+               '&rsp-subtree-filter=eq(procProcMemHist5min.index,"0")'
 
     def get_metrics(self, host: str, data: Dict) -> List[GaugeMetricFamily]:
         LOG.debug('collecting apic processes metrics ...')
@@ -39,48 +42,38 @@ class ApicProcessesCollector(Collector):
                                       'Average memory used by process',
                                       labels=['apicHost', 'procName', 'nodeId', 'nodeRole'])
 
-        # fetch nfm process id from each node
-        for node in data['imdata']:
-            node_dn = node['fabricNode']['attributes']['dn']
-            node_role = node['fabricNode']['attributes']['role']
-            LOG.debug(f'fetching process data for node {node_dn} {node_role}')
-
-            proc_query = f'/api/node/class/{node_dn}/procProc.json?query-target-filter=eq(procProc.name,"nfm")'
-            proc_data = self.query_host(host, proc_query)
-            if proc_data is None:
-                LOG.info(f'apic host {host} node {node_dn} has no nfm process')
+        for proc in data['imdata']:
+            proc_dn = proc['procProc']['attributes']['dn']
+            proc_name = proc['procProc']['attributes']['name']
+            node_dn = proc_dn.split('/sys/')[0]
+            node = self.topology.get_node_by_dn(node_dn)
+            if node is None:
+                continue
+            node_role = node.role
+
+            mem_stats = [
+                c['procProcMemHist5min']['attributes']
+                for c in proc['procProc'].get('children', [])
+                if 'procProcMemHist5min' in c
+            ]
+            if len(mem_stats) == 0:
+                LOG.info(f'apic host {host} node {node_dn} process {proc_dn} has no memory data')
                 continue
+            mem_attributes = mem_stats[0]
+            node_id = self._parseNodeIdInProcDN(proc_dn)
+
+            LOG.debug("procName: %s, nodeId: %s, role: %s, MemUsedMin: %s, MemUsedMax: %s, MemUsedAvg: %s", proc_name,
+                      node_id, node_role, mem_attributes['usedMin'], mem_attributes['usedMax'],
+                      mem_attributes['usedAvg'])
+
+            # Min memory used
+            g_mem_min.add_metric(labels=[host, proc_name, node_id, node_role], value=mem_attributes['usedMin'])
+
+            # Max memory used
+            g_mem_max.add_metric(labels=[host, proc_name, node_id, node_role], value=mem_attributes['usedMax'])
 
-            # fetch nfm process memory consumption per node
-            if int(proc_data['totalCount']) > 0:
-                proc_dn = proc_data['imdata'][0]['procProc']['attributes']['dn']
-                proc_name = proc_data['imdata'][0]['procProc']['attributes']['name']
-                mem_query = f'/api/node/mo/{proc_dn}/HDprocProcMem5min-0.json'
-                mem_data = self.query_host(host, mem_query)
-                if mem_data is None:
-                    LOG.info(f'apic host {host} node {node_dn} process {proc_dn} has no memory data')
-                    continue
-
-                if int(mem_data['totalCount']) > 0:
-                    node_id = self._parseNodeIdInProcDN(proc_dn)
-
-                    LOG.debug("procName: %s, nodeId: %s, role: %s, MemUsedMin: %s, MemUsedMax: %s, MemUsedAvg: %s",
-                              proc_name, node_id, node_role,
-                              mem_data['imdata'][0]['procProcMemHist5min']['attributes']['usedMin'],
-                              mem_data['imdata'][0]['procProcMemHist5min']['attributes']['usedMax'],
-                              mem_data['imdata'][0]['procProcMemHist5min']['attributes']['usedAvg'])
-
-                    # Min memory used
-                    g_mem_min.add_metric(labels=[host, proc_name, node_id, node_role],
-                                         value=mem_data['imdata'][0]['procProcMemHist5min']['attributes']['usedMin'])
-
-                    # Max memory used
-                    g_mem_max.add_metric(labels=[host, proc_name, node_id, node_role],
-                                         value=mem_data['imdata'][0]['procProcMemHist5min']['attributes']['usedMax'])
-
-                    # Avg memory used
-                    g_mem_avg.add_metric(labels=[host, proc_name, node_id, node_role],
-                                         value=mem_data['imdata'][0]['procProcMemHist5min']['attributes']['usedAvg'])
+            # Avg memory used
+            g_mem_avg.add_metric(labels=[host, proc_name, node_id, node_role], value=mem_attributes['usedAvg'])
         return [g_mem_min, g_mem_max, g_mem_avg]
 
     def _parseNodeIdInProcDN(self, procDn):
@@ -1,15 +1,18 @@
 import logging
 from Collector import Collector
+from modules.Topology import fabric_node
 from prometheus_client.core import GaugeMetricFamily
 from typing import Dict, List
 
 LOG = logging.getLogger('apic_exporter.exporter')
+QUERY_MODE = 'fabric'
 
 
 class ApicSpinePortsCollector(Collector):
 
     def __init__(self, config: Dict):
         super().__init__('apic_spine_ports', config)
+        self.__query_mode = config.get('spine_ports_query_mode', QUERY_MODE)
 
     def describe(self):
         yield GaugeMetricFamily('network_apic_free_port_count', 'Total available free ports')
@@ -19,8 +22,8 @@ class ApicSpinePortsCollector(Collector):
         yield GaugeMetricFamily('network_apic_down_port_count', 'In-use but down ports')
 
     def get_query(self) -> str:
-        return '/api/node/class/fabricNode.json?' + \
-               '&query-target-filter=eq(fabricNode.role,"spine")&order-by=fabricNode.id|asc'
+        # the spines are taken from the shared fabric topology
+        return None
 
     def get_metrics(self, host: str, data: Dict) -> List[GaugeMetricFamily]:
 
@@ -36,48 +39,95 @@ class ApicSpinePortsCollector(Collector):
                                         'In-use but down ports',
                                         labels=['apicHost', 'Spine_id', 'pod_id'])
 
-        count = data['totalCount']
-        spine_dn_list = []
-        for x in range(0, int(count)):
-            dn = str(data['imdata'][x]['fabricNode']['attributes']['dn'])
-            spine_dn_list.append(str(dn))
+        spines = self.topology.get_nodes('spine')
+        if len(spines) == 0:
+            return None
 
-        # fetch physcal port from each spine
-        for dn in spine_dn_list:
-            query_url = f'/api/node/mo/{dn}/sys.json?rsp-subtree=full&rsp-subtree-class=ethpmPhysIf'
-            free_port = []
-            used_port = []
-            down_port = []
-
-            output = self.query_host(host, query_url)
-            if output is None:
-                continue
-
-            for x in output['imdata']:
-                pod_id = x['topSystem']['attributes']['podId']
-                spine_id = x['topSystem']['attributes']['id']
-                for port_dict in x['topSystem']['children']:
-                    if (port_dict['l1PhysIf']['attributes']['adminSt'] == 'up' and
-                            port_dict['l1PhysIf']['children'][0]['ethpmPhysIf']['attributes']['operSt'] == 'down'):
-                        port_number = port_dict['l1PhysIf']['attributes']['id']
-                        free_port.append(str(port_number))
-
-                    elif (port_dict['l1PhysIf']['attributes']['adminSt'] == 'up' and
-                          port_dict['l1PhysIf']['children'][0]['ethpmPhysIf']['attributes']['operSt'] == 'up'):
-                        port_number = port_dict['l1PhysIf']['attributes']['id']
-                        used_port.append(str(port_number))
-
-                    elif port_dict['l1PhysIf']['attributes']['adminSt'] == 'down':
-                        port_number = port_dict['l1PhysIf']['attributes']['id']
-                        down_port.append(str(port_number))
+        if self.__query_mode == 'fabric':
+            port_counts = self._count_ports_fabric(host, spines)
+        else:
+            port_counts = self._count_ports_per_spine(host, spines)
+        if port_counts is None:
+            return None
 
+        for counts in port_counts.values():
             # Free Ports
-            g_free_port.add_metric(labels=[host, spine_id, pod_id], value=len(free_port))
+            g_free_port.add_metric(labels=[host, counts['spine_id'], counts['pod_id']], value=counts['free'])
 
             # Used Ports
-            g_used_port.add_metric(labels=[host, spine_id, pod_id], value=len(used_port))
+            g_used_port.add_metric(labels=[host, counts['spine_id'], counts['pod_id']], value=counts['used'])
 
             # Down ports
-            g_down_port.add_metric(labels=[host, spine_id, pod_id], value=len(down_port))
+            g_down_port.add_metric(labels=[host, counts['spine_id'], counts['pod_id']], value=counts['down'])
 
         return [g_free_port, g_used_port, g_down_port]
+
+    def _count_ports_fabric(self, host: str, spines: List[fabric_node]) -> Dict:
+        """Count the port states of all spines with a single l1PhysIf class query"""
+        port_counts = {}
+        filters = []
+        for spine in spines:
+            spine_dn = spine.dn
+            port_counts[spine_dn] = {'spine_id': spine.id, 'pod_id': spine.pod, 'free': 0, 'used': 0, 'down': 0}
+            filters.append(f'wcard(l1PhysIf.dn,"{spine_dn}/")')
+        if len(filters) == 0:
+            return port_counts
+
+        query_filter = filters[0] if len(filters) == 1 else 'or(' + ','.join(filters) + ')'
+        query_url = '/api/node/class/l1PhysIf.json?rsp-subtree=children&rsp-subtree-class=ethpmPhysIf' + \
+                    f'&query-target-filter={query_filter}'
+        output = self.query_host(host, query_url)
+        if output is None:
+            return None
+
+        for port_dict in output['imdata']:
+            spine_dn = port_dict['l1PhysIf']['attributes']['dn'].split('/sys/')[0]
+            if spine_dn not in port_counts:
+                continue
+            state = self._port_state(port_dict)
+            if state is not None:
+                port_counts[spine_dn][state] += 1
+        return port_counts
+
+    def _count_ports_per_spine(self, host: str, spines: List[fabric_node]) -> Dict:
+        """Count the port states with one query per spine"""
+        spine_dn_list = [spine.dn for spine in spines]
+
+        # fetch physcal port from each spine
+        queries = {
+            dn: f'/api/node/mo/{dn}/sys.json?rsp-subtree=full&rsp-subtree-class=ethpmPhysIf' for dn in spine_dn_list
+        }
+        results = self.query_host_batch(host, queries)
+
+        port_counts = {}
+        for dn in spine_dn_list:
+            output = results.get(dn)
+            if output is None:
+                continue
+
+            for x in output['imdata']:
+                counts = {
+                    'spine_id': x['topSystem']['attributes']['id'],
+                    'pod_id': x['topSystem']['attributes']['podId'],
+                    'free': 0,
+                    'used': 0,
+                    'down': 0
+                }
+                for port_dict in x['topSystem']['children']:
+                    state = self._port_state(port_dict)
+                    if state is not None:
+                        counts[state] += 1
+                port_counts[dn] = counts
+        return port_counts
+
+    def _port_state(self, port_dict: Dict) -> str:
+        """Classifies a l1PhysIf with its ethpmPhysIf child as free, used or down port"""
+        if (port_dict['l1PhysIf']['attributes']['adminSt'] == 'up' and
+                port_dict['l1PhysIf']['children'][0]['ethpmPhysIf']['attributes']['operSt'] == 'down'):
+            return 'free'
+        elif (port_dict['l1PhysIf']['attributes']['adminSt'] == 'up' and
+              port_dict['l1PhysIf']['children'][0]['ethpmPhysIf']['attributes']['operSt'] == 'up'):
+            return 'used'
+        elif port_dict['l1PhysIf']['attributes']['adminSt'] == 'down':
+            return 'down'
+        return None
@@ -7,16 +7,89 @@ import click
 import importlib
 import pkgutil
 
-from prometheus_client.core import REGISTRY
-from prometheus_client import start_http_server
+from prometheus_client.core import REGISTRY, CollectorRegistry
+from prometheus_client import make_wsgi_app
+from modules.Server import start_server, make_probe_app, make_debug_app
+from modules.Exposition import make_cached_app
+from modules.Scheduler import RefreshScheduler, REFRESH_INTERVAL_SECONDS
+from modules.CollectorPool import CollectorPool, COLLECTOR_WORKERS
+from modules.SnapshotStore import SnapshotStore, SNAPSHOT_INTERVAL_SECONDS
 
 LOG = logging.getLogger('apic_exporter.exporter')
 
 
-def run_prometheus_server(port, collectors):
-    start_http_server(int(port))
-    for c in collectors:
-        REGISTRY.register(c)
+def create_snapshot_store(exporter_config):
+    """Returns the snapshot store if a snapshot file is configured"""
+    if 'snapshot_file' not in exporter_config:
+        return None
+    if not exporter_config.get('background_refresh', False):
+        LOG.warning('snapshot_file requires background_refresh, metric snapshots are not persisted')
+        return None
+    interval = int(exporter_config.get('snapshot_interval_seconds', SNAPSHOT_INTERVAL_SECONDS))
+    return SnapshotStore(exporter_config['snapshot_file'], interval)
+
+
+def create_runner(collectors, exporter_config, store=None, fabric='default'):
+    """Returns the prometheus collector running the collectors on a scrape or in the background. The snapshots of
+    the background refresh are restored from and saved to the store."""
+    workers = int(exporter_config.get('collector_workers', COLLECTOR_WORKERS))
+    pool = CollectorPool(collectors, workers)
+    if exporter_config.get('background_refresh', False):
+        interval = int(exporter_config.get('refresh_interval_seconds', REFRESH_INTERVAL_SECONDS))
+        LOG.info(f'serving metrics from snapshots refreshed every {interval} sec')
+        scheduler = RefreshScheduler(collectors, interval, pool)
+        if store is not None and len(collectors) > 0:
+            store.register(fabric, scheduler, getattr(collectors[0], 'topology', None))
+        scheduler.start()
+        return scheduler
+    LOG.info(f'running collectors with {workers} workers')
+    return pool
+
+
+def create_app(registry, runner, exporter_config):
+    """Returns the WSGI app serving the registry. With exposition_cache the metrics are rendered once per background
+    refresh, and at least once per refresh interval."""
+    if not exporter_config.get('exposition_cache', False):
+        return make_wsgi_app(registry)
+    if not isinstance(runner, RefreshScheduler):
+        LOG.warning('exposition_cache requires background_refresh, metrics are rendered on every scrape')
+        return make_wsgi_app(registry)
+    interval = int(exporter_config.get('refresh_interval_seconds', REFRESH_INTERVAL_SECONDS))
+    return make_cached_app(registry, lambda: runner.generation, interval)
+
+
+def with_debug(app, fabric_collectors, exporter_config):
+    """Adds the profiling endpoint to app if debug_profile is enabled"""
+    if not exporter_config.get('debug_profile', False):
+        return app
+    LOG.warning('profiling endpoint /debug/profile is enabled')
+    return make_debug_app(app, fabric_collectors)
+
+
+def run_prometheus_server(port, collectors, exporter_config):
+    store = create_snapshot_store(exporter_config)
+    runner = create_runner(collectors, exporter_config, store)
+    REGISTRY.register(runner)
+    if store is not None:
+        store.start()
+    app = create_app(REGISTRY, runner, exporter_config)
+    start_server(int(port), with_debug(app, {'default': collectors}, exporter_config))
+    while True:
+        time.sleep(1)
+
+
+def run_probe_server(port, fabric_collectors, exporter_config):
+    """Serves the collectors of each fabric on /probe?target=<fabric>"""
+    apps = {}
+    store = create_snapshot_store(exporter_config)
+    for fabric, collectors in fabric_collectors.items():
+        registry = CollectorRegistry()
+        runner = create_runner(collectors, exporter_config, store, fabric)
+        registry.register(runner)
+        apps[fabric] = create_app(registry, runner, exporter_config)
+    if store is not None:
+        store.start()
+    start_server(int(port), with_debug(make_probe_app(apps), fabric_collectors, exporter_config))
     while True:
         time.sleep(1)
 
@@ -36,6 +109,10 @@ def get_config(config_file):
         elif len(config['collectors']) == 0:
             LOG.error("Empty list of collectors")
             exit(1)
+        for entry in config['collectors']:
+            if isinstance(entry, dict) and 'name' not in entry:
+                LOG.error(f"collector {entry} is missing the 'name' of the collector")
+                exit(1)
 
         # load apic password from environment
         pw = os.getenv('APIC_PASSWORD')
@@ -44,6 +121,8 @@ def get_config(config_file):
             exit(1)
         if 'aci' in config:
             config['aci']['apic_password'] = pw
+        elif 'fabrics' in config:
+            config['aci'] = {'apic_password': pw}
         else:
             LOG.error("section 'aci' missing in config")
             exit(1)
@@ -54,6 +133,20 @@ def get_config(config_file):
         exit(1)
 
 
+def get_fabric_configs(config):
+    """Returns the config of each fabric. Settings of the 'aci' section apply to all fabrics."""
+    fabrics = {}
+    for fabric, fabric_config in config['fabrics'].items():
+        fabrics[fabric] = {**config['aci'], **fabric_config}
+        if 'apic_password_env' in fabric_config:
+            pw = os.getenv(fabric_config['apic_password_env'])
+            if pw is None:
+                LOG.error(f"envvar '{fabric_config['apic_password_env']}' of fabric {fabric} not set")
+                exit(1)
+            fabrics[fabric]['apic_password'] = pw
+    return fabrics
+
+
 def get_default_collectors():
     return [name for _, name, _ in pkgutil.iter_modules(['collectors'])]
 
@@ -72,6 +165,21 @@ def initialize_collector_by_name(class_name, config):
         return None
 
 
+def initialize_collectors(entries, config):
+    """Initializes the collectors. An entry is either the name of a collector or a dict of its name and options,
+    which override the config for this collector."""
+    collectors = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            options = {k: v for k, v in entry.items() if k != 'name'}
+            collector = initialize_collector_by_name(entry['name'], {**config, **options})
+        else:
+            collector = initialize_collector_by_name(entry, config)
+        if collector is not None:
+            collectors.append(collector)
+    return collectors
+
+
 @click.command()
 @click.option("-p", "--port", metavar="<port>", default=9102, help="specify exporter serving port")
 @click.option("-c", "--config", metavar="<config>", help="path to rest config")
@@ -86,8 +194,6 @@ def main(port, config):
     exporter_config = config_obj['exporter']
     apic_config = config_obj['aci']
 
-    collectors = list(map(lambda c: initialize_collector_by_name(c, apic_config), config_obj['collectors']))
-
     level = logging.getLevelName("INFO")
     if exporter_config['log_level']:
         level = logging.getLevelName(exporter_config['log_level'].upper())
@@ -96,9 +202,16 @@ def main(port, config):
     logging.basicConfig(stream=sys.stdout, format=format, level=level)
 
     LOG.info(f'starting apic Exporter on port={port} config={config}')
-    LOG.info(f'apic exporter connects to apic hosts: {apic_config["apic_hosts"]}')
 
-    run_prometheus_server(port, collectors)
+    if 'fabrics' in config_obj:
+        fabric_collectors = {}
+        for fabric, fabric_config in get_fabric_configs(config_obj).items():
+            LOG.info(f'apic exporter connects to fabric {fabric} apic hosts: {fabric_config["apic_hosts"]}')
+            fabric_collectors[fabric] = initialize_collectors(config_obj['collectors'], fabric_config)
+        run_probe_server(port, fabric_collectors, exporter_config)
+    else:
+        LOG.info(f'apic exporter connects to apic hosts: {apic_config["apic_hosts"]}')
+        run_prometheus_server(port, initialize_collectors(config_obj['collectors'], apic_config), exporter_config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,195 @@
+import asyncio
+import atexit
+import json
+import logging
+import threading
+
+import aiohttp
+from singleton_decorator import singleton
+
+from time import time
+from typing import Dict, Hashable, List
+
+from modules.Helper import fabric_singleton
+from modules.HostStats import HostStats
+from modules.Connection import SessionPool, RequestCache, TIMEOUT, QUERY_DURATION, QUERY_RESPONSES, QUERY_FAILURES, \
+    RESPONSE_BYTES, RESPONSE_OBJECTS, mo_class
+
+LOG = logging.getLogger('apic_exporter.exporter')
+MAX_PARALLEL_QUERIES = 8
+SHUTDOWN_TIMEOUT_SECONDS = 5
+
+
+@singleton
+class EventLoopThread(object):
+
+    def __init__(self):
+        """Runs a single asyncio event loop on a background thread for all asynchronous APIC requests"""
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name='apic-event-loop', daemon=True)
+        self.__thread.start()
+
+    def run(self, coroutine):
+        """Runs the coroutine on the event loop and blocks until it is done"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result()
+
+    def submit(self, coroutine):
+        """Schedules the coroutine on the event loop and returns its future without waiting"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop)
+
+
+@fabric_singleton
+class AsyncConnection(object):
+
+    def __init__(self, hosts: List[str], user: str, password: str, max_parallel_queries: int = MAX_PARALLEL_QUERIES):
+        """asyncio based alternative to Connection. Many queries can be awaited at once on a single thread. The
+           tokens, circuit breakers and request cache are shared with the SessionPool and Connection of the fabric,
+           so tokens are refreshed in the background and identical queries of both engines are coalesced.
+        """
+        self.__pool = SessionPool(hosts, user, password)
+        self.__cache = RequestCache(hosts)
+        self.__stats = HostStats(hosts)
+        self.__max_parallel_queries = max_parallel_queries
+        self.__sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.__semaphores: Dict[str, asyncio.Semaphore] = {}
+        atexit.register(self._shutdown)
+
+    def run(self, coroutine):
+        """Runs a coroutine of this connection from synchronous code"""
+        return EventLoopThread().run(coroutine)
+
+    def _getSession(self, host: str) -> aiohttp.ClientSession:
+        """Returns the session of the host. Sessions are bound to the running event loop and created on first use."""
+        if host not in self.__sessions:
+            connector = aiohttp.TCPConnector(ssl=False, limit_per_host=self.__max_parallel_queries)
+            self.__sessions[host] = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+            self.__semaphores[host] = asyncio.Semaphore(self.__max_parallel_queries)
+        return self.__sessions[host]
+
+    async def login(self, host: str, expired_token: str = None) -> str:
+        """Returns a token of the host other than expired_token. The login is done by the SessionPool on a thread of
+           the default executor, so it does not block the event loop.
+        """
+        session = await asyncio.get_running_loop().run_in_executor(None, self.__pool.refreshCookie, host, expired_token)
+        return self.__pool.getToken(session)
+
+    async def getRequest(self, host: str, query: str, timeout: int = TIMEOUT, collector: str = '') -> Dict:
+        """Perform a GET request against host for the query. Identical requests share the result. The collector
+           labels the query metrics. The returned data may be shared with other callers and must not be modified.
+        """
+        return await self.__cache.get_async(host, query, lambda: self._getRequest(host, query, timeout, collector))
+
+    async def _getRequest(self, host: str, query: str, timeout: int, collector: str) -> Dict:
+        """Perform a GET request against host for the query. Retries if token is invalid."""
+        pool_session, available = self.__pool.getSession(host)
+        if not available:
+            LOG.info(f'skipped unavailable host {host} query {query}')
+            return None
+
+        # the first login has not completed yet
+        token = self.__pool.getToken(pool_session)
+        if token is None:
+            token = await self.login(host)
+            if token is None:
+                return None
+
+        session = self._getSession(host)
+        url = "https://" + host + query
+        labels = (collector, host, mo_class(query))
+        async with self.__semaphores[host]:
+            try:
+                LOG.debug(f'submitting request {url}')
+                status, text, res = await self._get(session, host, url, token, timeout, labels)
+
+                # token is invalid, request a new token
+                if status == 403 and ("Token was invalid" in text or "token" in text):
+                    token = await self.login(host, expired_token=token)
+                    if token is None:
+                        return None
+                    status, text, res = await self._get(session, host, url, token, timeout, labels)
+            except asyncio.TimeoutError:
+                LOG.error(f'connection with host {host} timed out after {timeout} sec')
+                QUERY_FAILURES.labels(*labels, 'timeout').inc()
+                self.__pool.set_session_unavailable(host)
+                return None
+            except (aiohttp.ClientError, OSError) as e:
+                LOG.error(f'cannot connect to {url}: {e}')
+                QUERY_FAILURES.labels(*labels, 'connection').inc()
+                self.__pool.set_session_unavailable(host)
+                return None
+
+        # server errors are not a sign of a healthy host
+        if status < 500:
+            self.__pool.set_session_available(host)
+        if status == 200:
+            return res
+        LOG.error(f'url {url} responding with {status}')
+        return None
+
+    async def _get(self, session: aiohttp.ClientSession, host: str, url: str, token: str, timeout: int,
+                   labels: tuple) -> tuple:
+        """GET the url and record the response time of the host and the query metrics"""
+        headers = {'Cookie': f'APIC-cookie={token}'}
+        started = time()
+        try:
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if resp.status == 200:
+                    body = await resp.read()
+                    result = resp.status, None, json.loads(body)
+                    RESPONSE_BYTES.labels(*labels).inc(len(body))
+                    if isinstance(result[2], dict) and isinstance(result[2].get('imdata'), list):
+                        RESPONSE_OBJECTS.labels(*labels).inc(len(result[2]['imdata']))
+                else:
+                    result = resp.status, await resp.text(), None
+        except (asyncio.TimeoutError, aiohttp.ClientError, OSError):
+            self.__stats.record(host, time() - started, False)
+            raise
+        # client errors like an invalid token or query are not the fault of the host
+        self.__stats.record(host, time() - started, result[0] < 500)
+        QUERY_DURATION.labels(*labels).observe(time() - started)
+        QUERY_RESPONSES.labels(*labels, str(result[0])).inc()
+        return result
+
+    async def getRequests(self,
+                          host: str,
+                          queries: Dict[Hashable, str],
+                          timeout: int = TIMEOUT,
+                          collector: str = '') -> Dict[Hashable, Dict]:
+        """Performs all queries concurrently against host. Returns the valid results by key of the query."""
+        keys = list(queries.keys())
+        fetched = await asyncio.gather(*[self.getRequest(host, queries[k], timeout, collector) for k in keys],
+                                       return_exceptions=True)
+        results = {}
+        for key, fetched_data in zip(keys, fetched):
+            if isinstance(fetched_data, Exception):
+                LOG.error(f'apic host {host}, {queries[key]} failed: {fetched_data}')
+                continue
+            if self.isDataValid(fetched_data):
+                results[key] = fetched_data
+        return results
+
+    def get_unresponsive_hosts(self) -> List[str]:
+        """Returns a list of hosts whose circuit is not closed."""
+        return self.__pool.get_unavailable_sessions()
+
+    async def close(self):
+        sessions, self.__sessions = self.__sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+    def _shutdown(self):
+        """Closes the sessions on the event loop when the interpreter exits"""
+        if len(self.__sessions) == 0:
+            return
+        try:
+            EventLoopThread().submit(self.close()).result(SHUTDOWN_TIMEOUT_SECONDS)
+        except Exception as e:
+            LOG.warning(f'closing the asyncio sessions failed: {e}')
+
+    def isDataValid(self, data: Dict):
+        """Checks if the data is a dict that contains 'imdata'."""
+        if data is None:
+            return False
+        if isinstance(data, dict) and isinstance(data.get('imdata'), list):
+            return True
+        return False
@@ -0,0 +1,100 @@
+import logging
+import random
+import threading
+
+from time import time
+from typing import Dict, List
+
+from prometheus_client.core import Enum
+from modules.Helper import fabric_singleton
+
+LOG = logging.getLogger('apic_exporter.exporter')
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+# consecutive failures opening the circuit, a single slow query does not eject a healthy host
+FAILURE_THRESHOLD = 3
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 300
+CIRCUIT_STATE = Enum('apic_exporter_host_circuit_state',
+                     'State of the circuit breaker of the host. Requests are only sent to hosts with a closed circuit',
+                     ['apicHost'],
+                     states=[CLOSED, OPEN, HALF_OPEN])
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, host: str):
+        """Stops requests to a failing host. An open circuit is probed in the background after an exponential
+           backoff with jitter and closes again once a probe succeeds.
+        """
+        self.__host = host
+        self.__lock = threading.Lock()
+        self.__state = CLOSED
+        self.__failures = 0
+        self.__failed_probes = 0
+        self.__retry_at = 0
+        CIRCUIT_STATE.labels(host).state(CLOSED)
+
+    @property
+    def state(self) -> str:
+        return self.__state
+
+    def allow_request(self) -> bool:
+        """Requests are only sent while the circuit is closed, a half open circuit is left to the recovery probe"""
+        return self.__state == CLOSED
+
+    def record_success(self):
+        with self.__lock:
+            if self.__state != CLOSED:
+                LOG.info(f'apic host {self.__host} recovered, closing circuit')
+            self._set_state(CLOSED)
+            self.__failures = 0
+            self.__failed_probes = 0
+
+    def record_failure(self):
+        """Only a failed probe grows the backoff. Failures of requests that were still in flight when the circuit
+           opened are ignored.
+        """
+        with self.__lock:
+            if self.__state == OPEN:
+                return
+            if self.__state == CLOSED:
+                self.__failures += 1
+                if self.__failures < FAILURE_THRESHOLD:
+                    return
+            else:
+                self.__failed_probes += 1
+            backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**self.__failed_probes)
+            backoff *= random.uniform(0.5, 1)
+            self.__retry_at = time() + backoff
+            if self.__state == CLOSED:
+                LOG.warning(f'apic host {self.__host} failed, opening circuit for {backoff:.0f} sec')
+            self._set_state(OPEN)
+
+    def probe_due(self) -> bool:
+        """Returns True and moves the circuit to half open if the backoff of an open circuit has passed"""
+        with self.__lock:
+            if self.__state != OPEN or time() < self.__retry_at:
+                return False
+            self._set_state(HALF_OPEN)
+            return True
+
+    def _set_state(self, state: str):
+        self.__state = state
+        CIRCUIT_STATE.labels(self.__host).state(state)
+
+
+@fabric_singleton
+class CircuitBreakers(object):
+
+    def __init__(self, hosts: List[str]):
+        """The circuit breakers of the APIC hosts of a fabric, shared by all connections to the fabric"""
+        self.__breakers: Dict[str, CircuitBreaker] = {host: CircuitBreaker(host) for host in hosts}
+
+    def get(self, host: str) -> CircuitBreaker:
+        return self.__breakers[host]
+
+    def get_open_hosts(self) -> List[str]:
+        """Returns the hosts that currently do not accept requests"""
+        return [host for host, breaker in self.__breakers.items() if not breaker.allow_request()]
@@ -0,0 +1,72 @@
+import logging
+
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+from prometheus_client.core import GaugeMetricFamily
+from modules.Connection import collection_cycle
+from BaseCollector import run_result
+
+LOG = logging.getLogger('apic_exporter.exporter')
+COLLECTOR_WORKERS = 1
+
+
+class CollectorPool(object):
+
+    def __init__(self, collectors: List, workers: int = COLLECTOR_WORKERS):
+        """Runs the collectors concurrently on a bounded pool of worker threads"""
+        self.__collectors = collectors
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='apic-collector')
+
+    def map(self, func: Callable) -> List:
+        """Applies func to every collector concurrently. Results are returned in the order of the collectors."""
+        futures = [self.__executor.submit(func, c) for c in self.__collectors]
+        return [f.result() for f in futures]
+
+    def run(self) -> List[run_result]:
+        """Runs all collectors and returns the result of each collector in the order of the collectors"""
+        with collection_cycle(self.__collectors):
+            return self.map(run_collector)
+
+    def describe(self):
+        for collector in self.__collectors:
+            yield from collector.describe()
+        yield from run_metrics([], [])
+
+    def collect(self):
+        results = self.run()
+        for result in results:
+            for metric in result.metrics:
+                yield metric
+        yield from run_metrics(self.__collectors, results)
+
+
+def run_collector(collector) -> run_result:
+    """Runs the collector within its time budget. A failed collector returns no metrics."""
+    started = time()
+    try:
+        return collector.run()
+    except Exception as e:
+        LOG.error(f'collector {type(collector).__name__} failed: {e}')
+        return run_result([], time() - started, False, False)
+
+
+def run_metrics(collectors: List, results: List[run_result]) -> List[GaugeMetricFamily]:
+    """Returns the duration and time budget metrics of the last run of each collector"""
+    g_duration = GaugeMetricFamily('apic_exporter_collector_duration_seconds',
+                                   'Duration of the last run of the collector',
+                                   labels=['collector'])
+    g_timed_out = GaugeMetricFamily('apic_exporter_collector_timed_out',
+                                    'Whether the last run of the collector exceeded its time budget',
+                                    labels=['collector'])
+    g_cached = GaugeMetricFamily('apic_exporter_collector_cached',
+                                 'Whether the metrics of the collector were served from its last run, as its refresh '
+                                 'interval has not passed yet',
+                                 labels=['collector'])
+    for collector, result in zip(collectors, results):
+        if result is None:
+            continue
+        g_duration.add_metric(labels=[type(collector).__name__], value=result.duration)
+        g_timed_out.add_metric(labels=[type(collector).__name__], value=1 if result.timed_out else 0)
+        g_cached.add_metric(labels=[type(collector).__name__], value=1 if result.cached else 0)
+    return [g_duration, g_timed_out, g_cached]
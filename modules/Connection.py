@@ -1,109 +1,253 @@
+import asyncio
 import requests
-from requests import cookies
 import logging
 import json
+import re
+import threading
 
 from urllib3 import disable_warnings
 from urllib3 import exceptions
-from singleton_decorator import singleton
-
-from time import time
-from typing import List, Dict
+from modules.JsonStream import ImdataStream
+from modules.Helper import fabric_singleton
+from modules.HostStats import HostStats
+from modules.CircuitBreaker import CircuitBreakers
+from modules.HttpAdapter import InstrumentedHTTPAdapter, POOL_SIZE
+from prometheus_client.core import Counter, Histogram
+
+from time import time, sleep
+from typing import Dict, Iterator, List
 from collections import namedtuple
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 LOG = logging.getLogger('apic_exporter.exporter')
 TIMEOUT = 10
 COOKIE_TIMEOUT = 5
-RESET_TIMEOUT_SECONDS = 30
+RECOVERY_CHECK_INTERVAL_SECONDS = 1
+TOKEN_LIFETIME_SECONDS = 600
+TOKEN_REFRESH_MARGIN_SECONDS = 120
+TOKEN_CHECK_INTERVAL_SECONDS = 15
+PAGE_SIZE = 5000
+STREAM_CHUNK_SIZE = 64 * 1024
+HEDGE_DELAY_SECONDS = 1
+HEDGE_QUANTILE = 0.95
+HEDGE_WORKERS = 32
 session_tuple = namedtuple('session_tuple', 'session available')
-
-
-@singleton
+CACHE_HITS = Counter('apic_exporter_request_cache_hits_total',
+                     'APIC requests answered without a call to the APIC, by memoized or coalesced (in-flight) result',
+                     ['kind'])
+CACHE_MISSES = Counter('apic_exporter_request_cache_misses_total', 'APIC requests sent to the APIC')
+HEDGED_REQUESTS = Counter('apic_exporter_hedged_requests_total',
+                          'APIC requests sent to a further host because the previous host was slow or failed')
+QUERY_LABELS = ['collector', 'apicHost', 'moClass']
+QUERY_DURATION = Histogram('apic_exporter_query_duration_seconds',
+                           'Response time of APIC queries, until the headers are received for streamed responses',
+                           QUERY_LABELS,
+                           buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+QUERY_RESPONSES = Counter('apic_exporter_query_responses_total', 'Responses to APIC queries by HTTP status',
+                          QUERY_LABELS + ['status'])
+QUERY_FAILURES = Counter('apic_exporter_query_failures_total',
+                         'APIC queries without a response by reason (timeout, connection)', QUERY_LABELS + ['reason'])
+RESPONSE_BYTES = Counter('apic_exporter_query_response_bytes_total', 'Bytes of successful APIC query responses',
+                         QUERY_LABELS)
+RESPONSE_OBJECTS = Counter('apic_exporter_query_response_objects_total',
+                           'Objects in imdata of successful APIC query responses', QUERY_LABELS)
+LOGINS = Counter('apic_exporter_logins_total', 'Logins (login) and token refreshes (refresh) by result',
+                 ['apicHost', 'kind', 'result'])
+# hedged requests are waited for on these threads, a request that lost the race runs on until it completes
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='apic-hedge')
+
+
+def mo_class(query: str) -> str:
+    """Returns the queried class of a class query. For a MO query this is the subtree class, as the dn would
+       make the label unbounded.
+    """
+    match = re.search(r'/class/(\w+)\.json', query)
+    if match:
+        return match.group(1)
+    match = re.search(r'[?&](?:target-subtree-class|rsp-subtree-class)=(\w+)', query)
+    if match:
+        return match.group(1)
+    return 'mo'
+
+
+def paged_query(query: str) -> tuple:
+    """Returns the query ordered by dn for paging, unless it is ordered already, and the separator of further
+       parameters. A stable order is required to not skip or repeat objects between pages.
+    """
+    separator = '&' if '?' in query else '?'
+    match = re.search(r'/class/(\w+)\.json', query)
+    if match and 'order-by=' not in query:
+        query += f'{separator}order-by={match.group(1)}.dn'
+        separator = '&'
+    return query, separator
+
+
+@fabric_singleton
 class SessionPool(object):
 
-    def __init__(self, hosts, user, password):
-        """Initializes the Session Pool. Sessions contains the session to a host and an Availability flag"""
-        self.__sessions = {}
+    def __init__(self, hosts, user, password, pool_size: int = POOL_SIZE):
+        """Initializes the Session Pool. Sessions contains the session to a host, the availability of a host is
+           tracked by its circuit breaker. The pool is shared by all collectors and safe for concurrent use.
+        """
+        self.__sessions: Dict[str, requests.Session] = {}
         self.__user = user
         self.__password = password
-        self.__unavailable_sessions = 0
-        self.__last_reset = 0
+        self.__pool_size = pool_size
+        self.__token_expiry: Dict[str, float] = {}
+        self.__breakers = CircuitBreakers(hosts)
+        # logins of a host are serialized by its login lock
+        self.__login_locks = {host: threading.Lock() for host in hosts}
 
         for host in hosts:
             self.__sessions[host] = self.createSession(host)
 
+        # requests before the login completed wait for it on the login lock of the host
+        self.__login_thread = threading.Thread(target=self._login, name='apic-login', daemon=True)
+        self.__login_thread.start()
+        self.__token_thread = threading.Thread(target=self._maintainTokens, name='apic-token-refresh', daemon=True)
+        self.__token_thread.start()
+        self.__recovery_thread = threading.Thread(target=self._recoverHosts, name='apic-recovery', daemon=True)
+        self.__recovery_thread.start()
+
+    def _login(self):
+        """Logs in to all hosts in the background, so creating the pool does not wait for the APICs"""
+        for host in list(self.__sessions.keys()):
+            try:
+                self.refreshCookie(host)
+            except Exception as e:
+                LOG.error(f'login to {host} failed: {e}')
+
+    def _maintainTokens(self):
+        """Renews tokens in the background before they expire, so requests do not pay for a login"""
+        while True:
+            sleep(TOKEN_CHECK_INTERVAL_SECONDS)
+            for host in list(self.__sessions.keys()):
+                expiry = self.__token_expiry.get(host)
+                if expiry is None or (expiry - time()) > TOKEN_REFRESH_MARGIN_SECONDS:
+                    continue
+                # hosts with an open circuit get a new token from the recovery probe
+                if not self.__breakers.get(host).allow_request():
+                    continue
+                try:
+                    if not self.refreshToken(host):
+                        LOG.info(f'token refresh for {host} failed, requesting a new token')
+                        self.refreshCookie(host, expired_token=self.getToken(self.__sessions[host]))
+                except Exception as e:
+                    LOG.error(f'renewing token for {host} failed: {e}')
+
+    def _recoverHosts(self):
+        """Probes hosts with an open circuit in the background once their backoff has passed. The probe is a login,
+           which closes the circuit if it succeeds and reopens it with a longer backoff otherwise.
+        """
+        while True:
+            sleep(RECOVERY_CHECK_INTERVAL_SECONDS)
+            for host, session in list(self.__sessions.items()):
+                breaker = self.__breakers.get(host)
+                if not breaker.probe_due():
+                    continue
+                LOG.debug(f'probing apic host {host}')
+                try:
+                    with self.__login_locks[host]:
+                        cookie = self.requestCookie(host, session)
+                        if cookie is not None:
+                            self._setToken(session, cookie)
+                except Exception as e:
+                    LOG.error(f'probing apic host {host} failed: {e}')
+                    cookie = None
+                if cookie is not None:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+
+    def refreshToken(self, host: str) -> bool:
+        """Extends the token of the host via aaaRefresh. Returns False if the token could not be refreshed."""
+        disable_warnings(exceptions.InsecureRequestWarning)
+        session = self.__sessions[host]
+        with self.__login_locks[host]:
+            if self.getToken(session) is None:
+                return False
+
+            LOG.debug(f'refresh token for {host}')
+            url = f'https://{host}/api/aaaRefresh.json'
+            try:
+                resp = session.get(url, timeout=COOKIE_TIMEOUT)
+            except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, TimeoutError):
+                LOG.error(f'connection with host {host} timed out after {COOKIE_TIMEOUT} sec')
+                LOGINS.labels(host, 'refresh', 'failure').inc()
+                return False
+            except (requests.exceptions.ConnectionError, ConnectionError) as e:
+                LOG.error(f'cannot connect to {url}: {e}')
+                LOGINS.labels(host, 'refresh', 'failure').inc()
+                return False
+
+            if resp.status_code != 200:
+                LOG.warning(f'url {url} responds with {resp.status_code}')
+                resp.close()
+                LOGINS.labels(host, 'refresh', 'failure').inc()
+                return False
+            res = json.loads(resp.text)
+            resp.close()
+            self._setToken(session, self._readToken(host, res))
+            LOGINS.labels(host, 'refresh', 'success').inc()
+            return True
+
+    def _readToken(self, host: str, res: Dict) -> str:
+        """Returns the token of an aaaLogin or aaaRefresh response and records when it expires"""
+        attributes = res['imdata'][0]['aaaLogin']['attributes']
+        lifetime = int(attributes.get('refreshTimeoutSeconds', TOKEN_LIFETIME_SECONDS))
+        self.__token_expiry[host] = time() + lifetime
+        return attributes['token']
+
+    def getToken(self, session: requests.Session) -> str:
+        """Returns the token the session currently sends, None if it has none"""
+        return session.cookies.get('APIC-cookie')
+
+    def _setToken(self, session: requests.Session, token: str):
+        # the cookie jar locks itself, requests in flight keep sending either the old or the new token
+        session.cookies.set('APIC-cookie', token)
+
     def getSession(self, host: str) -> session_tuple:
         """Returns the session and availability"""
-        if self.__unavailable_sessions == len(self.__sessions):
-            self.reset_unavailable_hosts()
-        return self.__sessions[host]
+        return session_tuple(self.__sessions[host], self.__breakers.get(host).allow_request())
 
-    def createSession(self, host: str) -> session_tuple:
-        """Creates the session and requests the cookie."""
+    def createSession(self, host: str) -> requests.Session:
+        """Creates the session. The cookie is requested by the first login."""
         session = requests.Session()
         session.proxies = {'https': '', 'http': '', 'no': '*'}
         session.verify = False
-
-        cookie = self.requestCookie(host, session)
-        if cookie is not None:
-            session.cookies = cookies.cookiejar_from_dict(cookie_dict={"APIC-cookie": cookie})
-
-        available = True if session is not None and cookie is not None else False
-        if not available:
-            self.__unavailable_sessions += 1
-        return session_tuple(session, available)
-
-    def reset_unavailable_hosts(self):
-        """Reset availability of all sessions and try to repair unavailable sessions."""
-        if (time() - self.__last_reset) < RESET_TIMEOUT_SECONDS:
-            return
-        unavailable = 0
-        for host, value in self.__sessions.items():
-            if value.session is None:
-                self.__sessions[host] = self.createSession(host)
-                continue
-
-            if len(value.session.cookies) == 0:
-                cookie = self.requestCookie(host, value.session)
-                if cookie is not None:
-                    value.session.cookies = cookies.cookiejar_from_dict(cookie_dict={"APIC-cookie": cookie})
-                    self.__sessions[host] = session_tuple(value.session, True)
-                else:
-                    self.__sessions[host] = session_tuple(value.session, False)
-                    unavailable += 1
-            else:
-                self.__sessions[host] = session_tuple(value.session, True)
-        self.__last_reset = time()
-        self.__unavailable_sessions = unavailable
+        session.mount('https://', InstrumentedHTTPAdapter(self.__pool_size))
+        return session
 
     def get_unavailable_sessions(self) -> List[str]:
-        return [k for k, v in self.__sessions.items() if not v.available]
+        return self.__breakers.get_open_hosts()
 
     def set_session_unavailable(self, host: str):
-        """Set a given host to be unavailable. Resets hosts, if all are unavailable"""
+        """Set a given host to be unavailable. The host is probed in the background until it recovers."""
         if host in self.__sessions:
             LOG.debug(f'flag host {host} as unavailable')
-            session, _ = self.__sessions[host]
-            self.__sessions[host] = session_tuple(session, False)
-            self.__unavailable_sessions += 1
-        if self.__unavailable_sessions == len(self.__sessions):
-            self.reset_unavailable_hosts()
-
-    def refreshCookie(self, host: str) -> requests.Session:
-        """Clears old cookie and requests a fresh one"""
-        session, available = self.__sessions[host]
-
-        cookie = self.requestCookie(host, session)
-
-        if cookie is not None:
-            session.cookies.clear_session_cookies()
-            session.cookies = cookies.cookiejar_from_dict(cookie_dict={"APIC-cookie": cookie},
-                                                          cookiejar=session.cookies)
-            available = True
-        else:
-            available = False
+            self.__breakers.get(host).record_failure()
 
-        self.__sessions[host] = session_tuple(session, available)
+    def set_session_available(self, host: str):
+        """Records a successful request to the host"""
+        if host in self.__sessions:
+            self.__breakers.get(host).record_success()
+
+    def refreshCookie(self, host: str, expired_token: str = None) -> requests.Session:
+        """Clears old cookie and requests a fresh one. If the session has a token other than expired_token,
+           another thread already renewed it and the session is returned without a new login.
+        """
+        session = self.__sessions[host]
+        with self.__login_locks[host]:
+            token = self.getToken(session)
+            if token is not None and token != expired_token:
+                return session
+
+            cookie = self.requestCookie(host, session)
+            if cookie is not None:
+                self._setToken(session, cookie)
+            else:
+                self.__breakers.get(host).record_failure()
         return session
 
     def requestCookie(self, host: str, session: requests.Session) -> str:
@@ -118,83 +262,388 @@ class SessionPool(object):
             resp = session.post(url, json=payload, timeout=COOKIE_TIMEOUT)
         except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, TimeoutError):
             LOG.error(f'connection with host {host} timed out after {COOKIE_TIMEOUT} sec')
+            LOGINS.labels(host, 'login', 'failure').inc()
             return None
         except (requests.exceptions.ConnectionError, ConnectionError) as e:
             LOG.error(f'cannot connect to {url}: {e}')
+            LOGINS.labels(host, 'login', 'failure').inc()
             return None
 
         cookie = None
         if resp.status_code == 200:
             res = json.loads(resp.text)
             resp.close()
-            cookie = res['imdata'][0]['aaaLogin']['attributes']['token']
+            cookie = self._readToken(host, res)
+            LOGINS.labels(host, 'login', 'success').inc()
         else:
             LOG.error(f'url {url} responds with {resp.status_code}')
+            LOGINS.labels(host, 'login', 'failure').inc()
 
         return cookie
 
 
+class PaginationError(Exception):
+    """Raised while iterating a paged response if a subsequent page cannot be fetched"""
+    pass
+
+
+class StreamError(PaginationError):
+    """Raised while iterating a streamed response if the response cannot be read or decoded"""
+    pass
+
+
+class _Flight(object):
+
+    def __init__(self, generation: int = 0):
+        # resolved with the result once the request landed, waited for by threads and event loops alike
+        self.done = Future()
+        self.result = None
+        self.generation = generation
+
+
+@fabric_singleton
+class RequestCache(object):
+
+    def __init__(self, hosts: List[str]):
+        """Coalesces identical concurrent requests to a fabric and memoizes their results for the current collection
+           cycle of the fabric
+        """
+        self.__lock = threading.Lock()
+        self.__in_flight: Dict[tuple, _Flight] = {}
+        self.__results: Dict[tuple, Dict] = {}
+        self.__active_cycles = 0
+        self.__generation = 0
+
+    @contextmanager
+    def cycle(self):
+        """Results are memoized while at least one collection cycle is active and dropped when the last one ends.
+           A cycle starts a new generation: results and requests in flight from before it are not reused, so a cycle
+           overlapping a previous one still gets fresh data.
+        """
+        with self.__lock:
+            self.__generation += 1
+            self.__results = {}
+            self.__active_cycles += 1
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__active_cycles -= 1
+                if self.__active_cycles == 0:
+                    self.__results = {}
+
+    def get(self, host: str, query: str, fetch) -> Dict:
+        """Returns the memoized or in-flight result for host and query. Otherwise fetch is called."""
+        key = (host, query)
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.done.result()
+
+        CACHE_MISSES.inc()
+        try:
+            flight.result = fetch()
+        finally:
+            self._land(key, flight)
+        return flight.result
+
+    async def get_async(self, host: str, query: str, fetch) -> Dict:
+        """Like get for the asyncio engine, fetch returns the coroutine fetching the result. Waiting for a request in
+           flight on another thread neither blocks the event loop nor an executor thread.
+        """
+        key = (host, query)
+        flight, leader = self._join(key)
+        if not leader:
+            # a cancelled waiter must not cancel the flight shared with the other waiters
+            return await asyncio.shield(asyncio.wrap_future(flight.done))
+
+        CACHE_MISSES.inc()
+        try:
+            flight.result = await fetch()
+        finally:
+            self._land(key, flight)
+        return flight.result
+
+    def _join(self, key: tuple) -> tuple:
+        """Returns the flight of the key and whether the caller leads it and has to fetch the result. A memoized
+           result is returned as a landed flight.
+        """
+        with self.__lock:
+            if key in self.__results:
+                CACHE_HITS.labels('memoized').inc()
+                flight = _Flight()
+                flight.result = self.__results[key]
+                flight.done.set_result(flight.result)
+                return flight, False
+            flight = self.__in_flight.get(key)
+            if flight is not None and flight.generation == self.__generation:
+                CACHE_HITS.labels('coalesced').inc()
+                return flight, False
+            flight = _Flight(self.__generation)
+            self.__in_flight[key] = flight
+            return flight, True
+
+    def _land(self, key: tuple, flight: _Flight):
+        with self.__lock:
+            # a request of a later generation for the same key may have replaced the flight
+            if self.__in_flight.get(key) is flight:
+                del self.__in_flight[key]
+            if flight.result is not None and self.__active_cycles > 0 and flight.generation == self.__generation:
+                self.__results[key] = flight.result
+        flight.done.set_result(flight.result)
+
+
+@contextmanager
+def collection_cycle(collectors: List):
+    """Context of a collection cycle of the collectors. Identical requests within the cycle are sent to the APIC
+       only once. Each fabric of the collectors has its own cycle.
+    """
+    with ExitStack() as stack:
+        for hosts in {tuple(c.hosts) for c in collectors}:
+            stack.enter_context(RequestCache(hosts).cycle())
+        yield
+
+
 class Connection():
 
-    def __init__(self, hosts: List[str], user: str, password: str):
-        self.__pool = SessionPool(hosts, user, password)
+    def __init__(self, hosts: List[str], user: str, password: str, pool_size: int = POOL_SIZE, collector: str = ''):
+        """The collector labels the query metrics of this connection"""
+        self.__pool = SessionPool(hosts, user, password, pool_size)
+        self.__collector = collector
+        self.__cache = RequestCache(hosts)
+        self.__stats = HostStats(hosts)
 
     def getRequest(self, host: str, query: str, timeout: int = TIMEOUT) -> Dict:
+        """Perform a GET request against host for the query. Identical requests share the result.
+           The returned data may be shared with other callers and must not be modified.
+        """
+        return self.__cache.get(host, query, lambda: self._getRequest(host, query, timeout))
+
+    def getHedgedRequest(self, hosts: List[str], query: str, timeout: int = TIMEOUT, delay: float = None) -> tuple:
+        """Perform the query against the first host. If it did not answer after delay seconds or failed, the query
+           is sent to the next host as well, and so on. The delay defaults to the p95 response time of the first host.
+           Returns the host and data of the first valid answer, (None, None) if no host answered.
+        """
+        if delay is None and len(hosts) > 0:
+            delay = self.__stats.percentile(hosts[0], HEDGE_QUANTILE)
+        if delay is None:
+            delay = HEDGE_DELAY_SECONDS
+
+        remaining = list(hosts)
+        pending = {}
+        while len(remaining) > 0 or len(pending) > 0:
+            if len(remaining) > 0:
+                host = remaining.pop(0)
+                if len(pending) > 0:
+                    LOG.debug(f'hedging {query} to apic host {host} after {delay:.2f} sec')
+                    HEDGED_REQUESTS.inc()
+                pending[_hedge_executor.submit(self.getRequest, host, query, timeout)] = host
+
+            done, _ = wait(pending, timeout=delay if len(remaining) > 0 else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                host = pending.pop(future)
+                try:
+                    fetched_data = future.result()
+                except Exception as e:
+                    LOG.error(f'apic host {host}, {query} failed: {e}')
+                    continue
+                if self.isDataValid(fetched_data):
+                    return host, fetched_data
+        return None, None
+
+    def _getRequest(self, host: str, query: str, timeout: int = TIMEOUT) -> Dict:
         """Perform a GET request against host for the query. Retries if token is invalid."""
+        resp = self._sendRequest(host, query, timeout)
+        if resp is None:
+            return None
+        res = json.loads(resp.text)
+        resp.close()
+        labels = (self.__collector, host, mo_class(query))
+        RESPONSE_BYTES.labels(*labels).inc(len(resp.content))
+        if isinstance(res, dict) and isinstance(res.get('imdata'), list):
+            RESPONSE_OBJECTS.labels(*labels).inc(len(res['imdata']))
+        return res
+
+    def _getStreamedRequest(self, host: str, query: str, timeout: int = TIMEOUT) -> Dict:
+        """Perform a GET request against host for the query and decode the response while it is read from the socket.
+           Returns None if the request fails. Otherwise 'imdata' is a generator yielding the decoded objects one by
+           one, which raises a StreamError if the response cannot be read or decoded.
+        """
+        resp = self._sendRequest(host, query, timeout, stream=True)
+        if resp is None:
+            return None
+        labels = (self.__collector, host, mo_class(query))
+        stream = ImdataStream(self._countBytes(resp.iter_content(chunk_size=STREAM_CHUNK_SIZE), labels))
+        try:
+            header = stream.read_header()
+        except (json.JSONDecodeError, requests.exceptions.RequestException) as e:
+            LOG.error(f'apic host {host}, {query} returned an invalid response: {e}')
+            resp.close()
+            return None
+        return {'totalCount': header.get('totalCount'), 'imdata': self._iterStream(host, query, resp, stream, labels)}
+
+    def _iterStream(self, host: str, query: str, resp: requests.Response, stream: ImdataStream,
+                    labels: tuple) -> Iterator[Dict]:
+        count = 0
+        try:
+            for obj in stream.objects():
+                count += 1
+                yield obj
+        except (json.JSONDecodeError, requests.exceptions.RequestException) as e:
+            raise StreamError(f'apic host {host}, {query} failed to read response: {e}')
+        finally:
+            resp.close()
+            RESPONSE_OBJECTS.labels(*labels).inc(count)
+
+    def _countBytes(self, chunks: Iterator[bytes], labels: tuple) -> Iterator[bytes]:
+        for chunk in chunks:
+            RESPONSE_BYTES.labels(*labels).inc(len(chunk))
+            yield chunk
+
+    def _sendRequest(self, host: str, query: str, timeout: int, stream: bool = False) -> requests.Response:
+        """Perform a GET request against host for the query. Retries if token is invalid.
+           Returns the response if the request succeeded, otherwise None.
+        """
         disable_warnings(exceptions.InsecureRequestWarning)
 
         url = "https://" + host + query
 
         session, available = self.__pool.getSession(host)
+        token = self.__pool.getToken(session)
 
         if not available:
             LOG.info(f'skipped unavailable host {host} query {query}')
             return None
 
-        try:
-            LOG.debug(f'submitting request {url}')
-            resp = session.get(url, timeout=timeout)
-        except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, TimeoutError):
-            LOG.error(f'connection with host {host} timed out after {timeout} sec')
-            self.__pool.set_session_unavailable(host)
-            return None
-        except (requests.exceptions.ConnectionError, ConnectionError) as e:
-            LOG.error(f'cannot connect to {url}: {e}')
-            self.__pool.set_session_unavailable(host)
+        # the first login has not completed yet
+        if token is None:
+            session = self.__pool.refreshCookie(host)
+            token = self.__pool.getToken(session)
+            if token is None:
+                return None
+
+        # the timeout covers the retry after a new login as well
+        deadline = time() + timeout
+        # a shorter timeout, like the rest of the time budget of a collector, does not show that the host failed
+        counts_failure = timeout >= TIMEOUT
+        resp = self._timedGet(session, host, url, timeout, stream, counts_failure)
+        if resp is None:
             return None
 
         # token is invalid, request a new token
         if resp.status_code == 403 and ("Token was invalid" in resp.text or "token" in resp.text):
 
-            session = self.__pool.refreshCookie(host)
+            resp.close()
+            session = self.__pool.refreshCookie(host, expired_token=token)
 
-            try:
-                resp = session.get(url, timeout=timeout)
-            except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, TimeoutError):
-                LOG.error(f'connection with host {host} timed out after {timeout} sec')
-                self.__pool.set_session_unavailable(host)
+            remaining = deadline - time()
+            if remaining <= 0:
+                LOG.error(f'url {url} not retried after the login, timeout of {timeout} sec exceeded')
                 return None
-            except (requests.exceptions.ConnectionError, ConnectionError) as e:
-                LOG.error(f'cannot connect to {url}: {e}')
-                self.__pool.set_session_unavailable(host)
+            resp = self._timedGet(session, host, url, remaining, stream, counts_failure)
+            if resp is None:
                 return None
 
         if resp.status_code == 200:
-            res = json.loads(resp.text)
-            resp.close()
-            return res
+            return resp
         else:
             LOG.error(f'url {url} responding with {resp.status_code}')
+            resp.close()
+            return None
+
+    def _timedGet(self,
+                  session: requests.Session,
+                  host: str,
+                  url: str,
+                  timeout: float,
+                  stream: bool,
+                  counts_failure: bool = True) -> requests.Response:
+        """GET the url and record the response time of the host. Returns None if the host cannot be reached.
+           A timeout only counts as failure of the host if counts_failure is set.
+        """
+        labels = (self.__collector, host, mo_class(url))
+        started = time()
+        try:
+            LOG.debug(f'submitting request {url}')
+            resp = session.get(url, timeout=timeout, stream=stream)
+        except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, TimeoutError):
+            QUERY_FAILURES.labels(*labels, 'timeout').inc()
+            if not counts_failure:
+                LOG.warning(f'request {url} cancelled after {timeout:.1f} sec')
+                return None
+            LOG.error(f'connection with host {host} timed out after {timeout} sec')
+            self.__stats.record(host, time() - started, False)
+            self.__pool.set_session_unavailable(host)
+            return None
+        except (requests.exceptions.ConnectionError, ConnectionError) as e:
+            LOG.error(f'cannot connect to {url}: {e}')
+            self.__stats.record(host, time() - started, False)
+            QUERY_FAILURES.labels(*labels, 'connection').inc()
+            self.__pool.set_session_unavailable(host)
             return None
 
+        # client errors like an invalid token or query are not the fault of the host
+        self.__stats.record(host, time() - started, resp.status_code < 500)
+        QUERY_DURATION.labels(*labels).observe(time() - started)
+        QUERY_RESPONSES.labels(*labels, str(resp.status_code)).inc()
+        if resp.status_code < 500:
+            self.__pool.set_session_available(host)
+        return resp
+
+    def getPagedRequest(self,
+                        host: str,
+                        query: str,
+                        page_size: int = PAGE_SIZE,
+                        timeout: int = TIMEOUT,
+                        stream: bool = False) -> Dict:
+        """Perform the query page by page using the APIC page and page-size parameters. A page size of 0 fetches
+           the query at once. With stream each page is decoded while it is read from the socket.
+           Returns None if the first page cannot be fetched. Otherwise 'imdata' is a generator which fetches the
+           remaining pages while it is iterated and raises a PaginationError if a page cannot be fetched.
+           Paged responses are neither shared nor memoized.
+        """
+        fetch = self._getStreamedRequest if stream else self._getRequest
+        if page_size <= 0:
+            return fetch(host, query, timeout) if stream else self.getRequest(host, query, timeout)
+
+        query, separator = paged_query(query)
+
+        first_page = fetch(host, f'{query}{separator}page=0&page-size={page_size}', timeout)
+        if first_page is None or 'imdata' not in first_page:
+            return None
+        total_count = first_page.get('totalCount')
+        return {
+            'totalCount': total_count,
+            'imdata': self._iterPages(fetch, host, query, separator, page_size, timeout, first_page, total_count)
+        }
+
+    def _iterPages(self, fetch, host: str, query: str, separator: str, page_size: int, timeout: int, first_page: Dict,
+                   total_count: str) -> Iterator[Dict]:
+        page, page_data, fetched = 0, first_page, 0
+        while True:
+            # release the page before requesting the next one to keep at most one page in memory
+            objects, page_data = page_data['imdata'], None
+            count = 0
+            for obj in objects:
+                count += 1
+                yield obj
+            del objects
+            fetched += count
+            if count < page_size or (total_count is not None and fetched >= int(total_count)):
+                return
+
+            page += 1
+            page_data = fetch(host, f'{query}{separator}page={page}&page-size={page_size}', timeout)
+            if page_data is None or 'imdata' not in page_data:
+                raise PaginationError(f'apic host {host}, {query} failed to fetch page {page}')
+
+    def get_ranked_hosts(self, hosts: List[str]) -> List[str]:
+        """Returns the hosts ordered by their recent response time and error rate, unresponsive hosts last"""
+        return self.__stats.ranked(hosts, self.get_unresponsive_hosts())
+
     def get_unresponsive_hosts(self) -> List[str]:
-        """Returns a list of hosts that were not responding since the last reset."""
+        """Returns a list of hosts that are not responding, their circuit is open until they recovered."""
         return self.__pool.get_unavailable_sessions()
 
-    def reset_unavailable_hosts(self):
-        """Unavailable hosts are repaired and the flags are reset"""
-        self.__pool.reset_unavailable_hosts()
-
     def isDataValid(self, data: Dict):
         """Checks if the data is a dict that contains 'imdata'."""
         if data is None:
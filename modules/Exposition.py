@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import logging
+import threading
+
+from time import time
+from typing import Callable, Dict
+from urllib.parse import parse_qs
+from collections import namedtuple
+
+from prometheus_client import make_wsgi_app
+from prometheus_client.core import CollectorRegistry
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+
+LOG = logging.getLogger('apic_exporter.exporter')
+GZIP_LEVEL = 6
+rendered_tuple = namedtuple('rendered_tuple', 'body gzipped etag')
+
+
+class ExpositionCache(object):
+
+    def __init__(self, registry: CollectorRegistry, generation: Callable[[], int], max_age: float = None):
+        """Renders the metrics of the registry once per generation and format and keeps a gzipped copy, so
+           scrapes in between are served without collecting or serializing the metrics again. generation returns
+           a number that changes whenever the metrics changed, e.g. after a background refresh. The metrics are
+           rendered again after max_age seconds even if the generation did not change, so the snapshot age and
+           the self-metrics keep moving while the refresh stalls.
+        """
+        self.__registry = registry
+        self.__generation = generation
+        self.__max_age = max_age
+        self.__lock = threading.Lock()
+        self.__rendered_generation = None
+        self.__rendered_at = 0
+        self.__rendered: Dict[str, rendered_tuple] = {}
+
+    def get(self, accept_header: str) -> tuple:
+        """Returns the content type negotiated for the Accept header and its rendered exposition"""
+        encoder, content_type = choose_encoder(accept_header)
+        generation = self.__generation()
+        # concurrent scrapes wait for a single rendering
+        with self.__lock:
+            expired = self.__max_age is not None and time() - self.__rendered_at >= self.__max_age
+            if generation != self.__rendered_generation or expired:
+                self.__rendered = {}
+                self.__rendered_generation = generation
+                self.__rendered_at = time()
+            if content_type not in self.__rendered:
+                body = encoder(self.__registry)
+                self.__rendered[content_type] = rendered_tuple(body, gzip.compress(body, GZIP_LEVEL),
+                                                               hashlib.sha256(body).hexdigest()[:32])
+                LOG.debug(f'rendered {len(body)} bytes of {content_type} for generation {generation}')
+            return content_type, self.__rendered[content_type]
+
+
+def make_cached_app(registry: CollectorRegistry, generation: Callable[[], int], max_age: float = None):
+    """Returns a WSGI app serving the metrics of the registry from an ExpositionCache. Responses carry an ETag, a
+       request with a matching If-None-Match is answered with 304. Requests filtering by name[] are rendered live.
+    """
+    cache = ExpositionCache(registry, generation, max_age)
+    live_app = make_wsgi_app(registry)
+
+    def app(environ, start_response):
+        if 'name[]' in parse_qs(environ.get('QUERY_STRING', '')):
+            return live_app(environ, start_response)
+
+        content_type, rendered = cache.get(environ.get('HTTP_ACCEPT'))
+        compressed = gzip_accepted(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        # the gzipped representation needs its own entity tag
+        etag = f'"{rendered.etag}-gzip"' if compressed else f'"{rendered.etag}"'
+        headers = [('Content-Type', content_type), ('ETag', etag), ('Vary', 'Accept, Accept-Encoding')]
+
+        if etag in [tag.strip() for tag in environ.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            start_response('304 Not Modified', headers)
+            return [b'']
+
+        body = rendered.gzipped if compressed else rendered.body
+        if compressed:
+            headers.append(('Content-Encoding', 'gzip'))
+        start_response('200 OK', headers + [('Content-Length', str(len(body)))])
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return [b'']
+        return [body]
+
+    return app
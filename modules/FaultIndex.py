@@ -0,0 +1,97 @@
+import threading
+
+from typing import Dict, Iterable, List
+
+from modules.Helper import fabric_singleton
+
+FAULT_QUERY = '/api/node/class/faultInst.json?' + \
+              'query-target-filter=or(eq(faultInst.lc,"raised"),eq(faultInst.lc,"soaking"))'
+ACTIVE_LIFECYCLES = ('raised', 'soaking')
+
+
+def fault_key(attrs: Dict) -> tuple:
+    """Returns the labels severity, type, domain, code, cause, openstack and ack of a fault"""
+    dn = attrs.get('dn')
+    # only interested in the presence of the keyword `openstack` within the DN
+    openstack = '1' if dn is not None and 'openstack' in dn else '0'
+    return (attrs.get('severity'), attrs.get('type'), attrs.get('domain'), attrs.get('code'), attrs.get('cause'),
+            openstack, attrs.get('ack'))
+
+
+@fabric_singleton
+class FaultIndex(object):
+
+    def __init__(self, hosts: List[str]):
+        """In-memory index of the raised and soaking faults of a fabric. The counts by fault key are maintained
+           incrementally, so reading them does not depend on the number of faults.
+        """
+        self.__lock = threading.Lock()
+        self.__faults: Dict[str, Dict] = {}
+        self.__counts: Dict[tuple, int] = {}
+        self.__by_code: Dict[str, Dict[str, Dict]] = {}
+        self.__synced = False
+        self.host = None
+
+    def replace(self, objects: Iterable[Dict], host: str):
+        """Replaces the index with the faultInst objects of a full query of host. The index is left unchanged if
+           iterating the objects fails.
+        """
+        active = []
+        for obj in objects:
+            attrs = obj.get('faultInst', {}).get('attributes')
+            if attrs is not None and attrs.get('lc') in ACTIVE_LIFECYCLES:
+                active.append(attrs)
+        with self.__lock:
+            self.__faults, self.__counts, self.__by_code = {}, {}, {}
+            for attrs in active:
+                self._add(attrs)
+            self.__synced = True
+            self.host = host
+
+    def apply(self, obj: Dict):
+        """Applies a changed faultInst object. Created and modified objects are merged into the indexed fault,
+           deleted objects and faults that are not raised or soaking anymore are removed.
+        """
+        attrs = obj.get('faultInst', {}).get('attributes')
+        if attrs is None or attrs.get('dn') is None:
+            return
+        with self.__lock:
+            fault = self.__faults.get(attrs['dn'])
+            if fault is not None:
+                self._remove(fault)
+            if attrs.get('status') == 'deleted':
+                return
+            fault = {**(fault or {}), **attrs}
+            if fault.get('lc') in ACTIVE_LIFECYCLES:
+                self._add(fault)
+
+    def _add(self, attrs: Dict):
+        key = fault_key(attrs)
+        self.__faults[attrs['dn']] = attrs
+        self.__counts[key] = self.__counts.get(key, 0) + 1
+        self.__by_code.setdefault(attrs.get('code'), {})[attrs['dn']] = attrs
+
+    def _remove(self, attrs: Dict):
+        key = fault_key(attrs)
+        del self.__faults[attrs['dn']]
+        self.__counts[key] -= 1
+        if self.__counts[key] == 0:
+            del self.__counts[key]
+        del self.__by_code[attrs.get('code')][attrs['dn']]
+
+    def get_counts(self) -> Dict[tuple, int]:
+        """Returns the number of faults by fault key"""
+        with self.__lock:
+            return dict(self.__counts)
+
+    def get_faults(self, codes: Iterable[str]) -> List[Dict]:
+        """Returns the attributes of the faults with one of the codes"""
+        with self.__lock:
+            return [attrs for code in codes for attrs in self.__by_code.get(code, {}).values()]
+
+    def set_synced(self, synced: bool):
+        self.__synced = synced
+
+    def is_synced(self) -> bool:
+        """Returns True while the index follows the pushed changes of a successful full query"""
+        return self.__synced
@@ -1,3 +1,7 @@
+import functools
+import threading
+
+
 def Unpack(data, *keys):
     """unpack ensures the value behind the keys exists
     if the value does not exists an ValueError is raised"""
@@ -7,3 +11,20 @@ def Unpack(data, *keys):
         else:
             return ValueError(f"{keys} not found in data")
     return data
+
+
+def fabric_singleton(cls):
+    """class decorator that creates one instance per fabric. A fabric is identified by
+    its list of APIC hosts, which is the first argument of the constructor."""
+    instances = {}
+    lock = threading.Lock()
+
+    @functools.wraps(cls, updated=())
+    def get_instance(hosts, *args, **kwargs):
+        key = tuple(hosts)
+        with lock:
+            if key not in instances:
+                instances[key] = cls(hosts, *args, **kwargs)
+            return instances[key]
+
+    return get_instance
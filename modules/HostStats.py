@@ -0,0 +1,68 @@
+import threading
+
+from time import time
+from typing import Dict, List
+from collections import namedtuple, deque
+
+from prometheus_client.core import Gauge
+from modules.Helper import fabric_singleton
+
+EWMA_ALPHA = 0.3
+ERROR_PENALTY = 10
+STATS_MAX_AGE_SECONDS = 300
+LATENCY_SAMPLES = 100
+MIN_LATENCY_SAMPLES = 10
+host_stats = namedtuple('host_stats', 'latency error_rate updated')
+LATENCY = Gauge('apic_exporter_host_latency_ewma_seconds', 'Exponentially weighted moving average of the response time',
+                ['apicHost'])
+ERROR_RATE = Gauge('apic_exporter_host_error_rate',
+                   'Exponentially weighted moving average of the share of failed requests', ['apicHost'])
+
+
+@fabric_singleton
+class HostStats(object):
+
+    def __init__(self, hosts: List[str]):
+        """Tracks the response time and error rate of the APIC hosts of a fabric to route queries to the best host"""
+        self.__lock = threading.Lock()
+        self.__stats: Dict[str, host_stats] = {}
+        self.__latencies: Dict[str, deque] = {}
+
+    def record(self, host: str, seconds: float, ok: bool):
+        """Records the response time of a request and whether it failed"""
+        with self.__lock:
+            stats = self.__stats.get(host)
+            if stats is None:
+                stats = host_stats(seconds, 0.0 if ok else 1.0, time())
+            else:
+                stats = host_stats(stats.latency + EWMA_ALPHA * (seconds - stats.latency),
+                                   stats.error_rate + EWMA_ALPHA * ((0.0 if ok else 1.0) - stats.error_rate), time())
+            self.__stats[host] = stats
+            if ok:
+                self.__latencies.setdefault(host, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+        LATENCY.labels(host).set(stats.latency)
+        ERROR_RATE.labels(host).set(stats.error_rate)
+
+    def percentile(self, host: str, quantile: float) -> float:
+        """Returns the quantile of the recent response times of successful requests to the host,
+           None if there are too few samples
+        """
+        with self.__lock:
+            latencies = sorted(self.__latencies.get(host, []))
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+
+    def score(self, host: str) -> float:
+        """Returns the expected cost of a request to the host, lower is better. Hosts without recent requests score
+           0, so they are tried and measured again.
+        """
+        stats = self.__stats.get(host)
+        if stats is None or (time() - stats.updated) > STATS_MAX_AGE_SECONDS:
+            return 0.0
+        return stats.latency * (1 + ERROR_PENALTY * stats.error_rate)
+
+    def ranked(self, hosts: List[str], unavailable: List[str] = None) -> List[str]:
+        """Returns the hosts ordered from best to worst. Unavailable hosts are moved to the end."""
+        unavailable = unavailable or []
+        return sorted(hosts, key=lambda host: (host in unavailable, self.score(host)))
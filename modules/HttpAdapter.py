@@ -0,0 +1,46 @@
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from prometheus_client.core import Counter
+
+POOL_SIZE = 10
+CONNECTIONS = Counter('apic_exporter_http_connections',
+                      'HTTP connections to the APIC hosts by event (opened, reused, discarded)', ['apicHost', 'event'])
+
+
+class InstrumentedHTTPSConnectionPool(HTTPSConnectionPool):
+    """Keep-alive connection pool of a host that counts opened, reused and discarded connections"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__opening = threading.local()
+
+    def _new_conn(self):
+        self.__opening.opened = True
+        CONNECTIONS.labels(self.host, 'opened').inc()
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        self.__opening.opened = False
+        conn = super()._get_conn(timeout)
+        if not self.__opening.opened:
+            CONNECTIONS.labels(self.host, 'reused').inc()
+        return conn
+
+    def _put_conn(self, conn):
+        # a full pool closes the connection instead of keeping it alive
+        if conn is not None and self.pool is not None and self.pool.full():
+            CONNECTIONS.labels(self.host, 'discarded').inc()
+        super()._put_conn(conn)
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+
+    def __init__(self, pool_size: int = POOL_SIZE):
+        """Adapter keeping up to pool_size keep-alive connections per host"""
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': HTTPConnectionPool, 'https': InstrumentedHTTPSConnectionPool}
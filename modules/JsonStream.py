@@ -0,0 +1,112 @@
+import codecs
+import json
+
+from typing import Dict, Iterator
+
+WHITESPACE = ' \t\n\r'
+
+
+class ImdataStream(object):
+
+    def __init__(self, chunks: Iterator[bytes]):
+        """Incrementally decodes an APIC response of the form {"totalCount": "N", "imdata": [...]} from chunks of
+           bytes. The objects of imdata are decoded one by one, the full document is never materialized.
+        """
+        self.__chunks = iter(chunks)
+        self.__utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ''
+        self.__pos = 0
+        self.__eof = False
+        self.__state = 'start'
+        self.attributes: Dict = {}
+
+    def read_header(self) -> Dict:
+        """Decodes the document up to the first imdata object. Returns the top level attributes read so far,
+           which contains totalCount as the APIC sends it before imdata.
+        """
+        if self.__state == 'start':
+            self._expect('{')
+            self.__state = 'keys'
+        if self.__state == 'keys':
+            self._read_keys()
+        return self.attributes
+
+    def objects(self) -> Iterator[Dict]:
+        """Yields the objects of imdata one by one and decodes the remainder of the document afterwards"""
+        self.read_header()
+        while self.__state == 'imdata':
+            self._skip(WHITESPACE + ',')
+            if self._peek() == ']':
+                self.__pos += 1
+                self.__state = 'keys'
+                self._read_keys()
+                break
+            yield self._decode_value()
+
+    def _read_keys(self):
+        """Reads top level key-value pairs until imdata starts or the document ends"""
+        while True:
+            self._skip(WHITESPACE + ',')
+            if self._peek() == '}':
+                self.__pos += 1
+                self.__state = 'end'
+                return
+            key = self._decode_value()
+            self._expect(':')
+            if key == 'imdata':
+                self._expect('[')
+                self.__state = 'imdata'
+                return
+            self.attributes[key] = self._decode_value()
+
+    def _decode_value(self):
+        self._skip(WHITESPACE)
+        # an incomplete value is decoded again from its start, retrying only once the buffered part of it doubled
+        # keeps the decoding of a value spanning many chunks linear in its size
+        required = 0
+        while True:
+            if len(self.__buffer) - self.__pos >= required or self.__eof:
+                try:
+                    value, end = self.__decoder.raw_decode(self.__buffer, self.__pos)
+                    # a number at the end of the buffer might continue in the next chunk
+                    if end < len(self.__buffer) or self.__eof or not isinstance(value, (int, float)):
+                        self.__pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if self.__eof:
+                        raise
+                    required = 2 * (len(self.__buffer) - self.__pos)
+            self._read_chunk()
+
+    def _expect(self, char: str):
+        self._skip(WHITESPACE)
+        if self._peek() != char:
+            raise json.JSONDecodeError(f'expected {char!r}', self.__buffer, self.__pos)
+        self.__pos += 1
+
+    def _skip(self, chars: str):
+        while True:
+            while self.__pos < len(self.__buffer) and self.__buffer[self.__pos] in chars:
+                self.__pos += 1
+            if self.__pos < len(self.__buffer) or self.__eof:
+                return
+            self._read_chunk()
+
+    def _peek(self) -> str:
+        while self.__pos >= len(self.__buffer):
+            if self.__eof:
+                raise json.JSONDecodeError('unexpected end of document', self.__buffer, self.__pos)
+            self._read_chunk()
+        return self.__buffer[self.__pos]
+
+    def _read_chunk(self):
+        # drop the consumed part of the buffer to keep the memory bounded by the largest object
+        self.__buffer = self.__buffer[self.__pos:]
+        self.__pos = 0
+        chunk = next(self.__chunks, None)
+        if chunk is None:
+            self.__eof = True
+            self.__buffer += self.__utf8.decode(b'', final=True)
+            return
+        self.__buffer += self.__utf8.decode(chunk)
@@ -0,0 +1,90 @@
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import threading
+import tracemalloc
+
+from time import time
+from typing import List
+from collections import namedtuple
+
+from modules.Connection import collection_cycle
+
+LOG = logging.getLogger('apic_exporter.exporter')
+PROFILE_TOP = 30
+TRACEMALLOC_FRAMES = 10
+# allocations of tracemalloc itself and of imports are left out of the report
+TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+]
+profile_result = namedtuple('profile_result', 'collectors profile allocations peak duration')
+# cProfile and tracemalloc are process wide, so only one profile runs at a time
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Raised if a profile is requested while another one is running"""
+    pass
+
+
+def profile_cycle(collectors: List) -> profile_result:
+    """Runs one collection cycle of the collectors under cProfile and tracemalloc. The collectors run one after
+       another on the calling thread, each once its current run completed. Time spent on other threads, like batch
+       queries, shows up as waiting time.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError('another profile is running')
+    try:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+        profile = cProfile.Profile()
+        started = time()
+        try:
+            # the metrics are kept until the snapshot, so their allocations show up
+            metrics = []
+            with collection_cycle(collectors):
+                for collector in collectors:
+                    # a running scrape or background refresh of the collector is waited for before profiling
+                    with collector.exclusive():
+                        profile.enable()
+                        try:
+                            metrics.extend(collector.collect())
+                        except Exception as e:
+                            LOG.error(f'profiled collector {type(collector).__name__} failed: {e}')
+                        finally:
+                            profile.disable()
+            duration = time() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+            allocations = snapshot.compare_to(before, 'lineno')
+            del metrics
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+        return profile_result([type(c).__name__ for c in collectors], profile, allocations, peak, duration)
+    finally:
+        _profile_lock.release()
+
+
+def format_text(result: profile_result, top: int = PROFILE_TOP, sort: str = 'cumulative') -> str:
+    """Returns the top functions and allocation sites of the profile as text report"""
+    out = io.StringIO()
+    out.write(f'collection cycle of {", ".join(result.collectors)} took {result.duration:.2f} sec, '
+              f'peak traced memory {result.peak / 1024 / 1024:.1f} MB\n\n')
+    out.write(f'top {top} functions by {sort} time\n')
+    pstats.Stats(result.profile, stream=out).sort_stats(sort).print_stats(top)
+    out.write(f'top {top} allocation sites by size held at the end of the cycle\n')
+    for stat in result.allocations[:top]:
+        out.write(f'{stat}\n')
+    return out.getvalue()
+
+
+def format_pstats(result: profile_result) -> bytes:
+    """Returns the CPU profile in the pstats format, readable by python -m pstats or snakeviz"""
+    return marshal.dumps(pstats.Stats(result.profile).stats)
@@ -0,0 +1,153 @@
+import logging
+import threading
+
+from time import time, sleep
+from typing import Dict, List
+from collections import namedtuple
+
+from prometheus_client.core import GaugeMetricFamily
+from modules.CollectorPool import CollectorPool, run_collector, run_metrics
+from modules.Connection import collection_cycle
+from modules.SnapshotStore import dump_metrics, load_metrics
+from BaseCollector import run_result
+
+LOG = logging.getLogger('apic_exporter.exporter')
+REFRESH_INTERVAL_SECONDS = 60
+snapshot_tuple = namedtuple('snapshot_tuple', 'metrics timestamp restored')
+
+
+class RefreshScheduler(object):
+
+    def __init__(self, collectors: List, interval: int = REFRESH_INTERVAL_SECONDS, pool: CollectorPool = None):
+        """Refreshes the metrics of all collectors in the background. A scrape is served from the latest snapshot."""
+        self.__collectors = collectors
+        self.__interval = interval
+        self.__pool = pool
+        self.__snapshots: Dict[str, snapshot_tuple] = {}
+        self.__results: Dict[str, run_result] = {}
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__generation = 0
+
+    @property
+    def generation(self) -> int:
+        """Number of completed refreshes and restores, changes whenever the served snapshots may have changed"""
+        return self.__generation
+
+    def start(self):
+        """Starts the background refresh loop"""
+        if self.__thread is not None:
+            return
+        self.__thread = threading.Thread(target=self._run, name='apic-refresh-scheduler', daemon=True)
+        self.__thread.start()
+
+    def _run(self):
+        while True:
+            started = time()
+            self.refresh()
+            elapsed = time() - started
+            if elapsed > self.__interval:
+                LOG.warning(f'refresh took {elapsed:.1f} sec, longer than the interval of {self.__interval} sec')
+            sleep(max(0, self.__interval - elapsed))
+
+    def refresh(self):
+        """Runs every collector once and replaces its snapshot"""
+        with collection_cycle(self.__collectors):
+            if self.__pool is not None:
+                self.__pool.map(self.refresh_collector)
+            else:
+                for collector in self.__collectors:
+                    self.refresh_collector(collector)
+        self.__generation += 1
+
+    def refresh_collector(self, collector):
+        """Runs a single collector. The previous snapshot is kept if the collector fails, exceeds its time budget or
+           returns nothing.
+        """
+        name = type(collector).__name__
+        result = run_collector(collector)
+        with self.__lock:
+            self.__results[name] = result
+        # the snapshot of a collector that is not due yet is still current
+        if result.timed_out or result.cached:
+            return
+        if len(result.metrics) == 0:
+            LOG.warning(f'refresh of {name} did not return any metrics, keeping previous snapshot')
+            return
+        with self.__lock:
+            self.__snapshots[name] = snapshot_tuple(result.metrics, time(), False)
+
+    def export(self) -> Dict[str, Dict]:
+        """Returns the snapshots of the collectors as JSON serializable dicts"""
+        with self.__lock:
+            snapshots = dict(self.__snapshots)
+        return {
+            name: {
+                'timestamp': snapshot.timestamp,
+                'metrics': dump_metrics(snapshot.metrics)
+            } for name, snapshot in snapshots.items()
+        }
+
+    def restore(self, data: Dict[str, Dict]):
+        """Restores the snapshots returned by export. They keep their timestamp, so their age shows how stale they
+           are, and are served until the collector refreshes them.
+        """
+        names = [type(c).__name__ for c in self.__collectors]
+        restored = {
+            name: snapshot_tuple(load_metrics(data[name]['metrics']), data[name]['timestamp'], True)
+            for name in names
+            if name in data
+        }
+        with self.__lock:
+            for name, snapshot in restored.items():
+                self.__snapshots.setdefault(name, snapshot)
+        self.__generation += 1
+        if len(restored) > 0:
+            LOG.info(f'restored snapshots of {len(restored)} collectors')
+
+    def describe(self):
+        for collector in self.__collectors:
+            yield from collector.describe()
+
+        yield GaugeMetricFamily('apic_exporter_collector_last_success_timestamp_seconds',
+                                'Unix time of the last successful refresh of the collector')
+
+        yield GaugeMetricFamily('apic_exporter_collector_snapshot_age_seconds',
+                                'Age of the metrics snapshot served for the collector')
+
+        yield GaugeMetricFamily('apic_exporter_collector_snapshot_restored',
+                                'Whether the snapshot served for the collector was restored from the snapshot file')
+
+        yield from run_metrics([], [])
+
+    def collect(self):
+        """Yields the latest snapshot of every collector together with its staleness"""
+        with self.__lock:
+            snapshots = [(type(c).__name__, self.__snapshots.get(type(c).__name__)) for c in self.__collectors]
+            results = [self.__results.get(type(c).__name__) for c in self.__collectors]
+
+        g_last_success = GaugeMetricFamily('apic_exporter_collector_last_success_timestamp_seconds',
+                                           'Unix time of the last successful refresh of the collector',
+                                           labels=['collector'])
+        g_age = GaugeMetricFamily('apic_exporter_collector_snapshot_age_seconds',
+                                  'Age of the metrics snapshot served for the collector',
+                                  labels=['collector'])
+        g_restored = GaugeMetricFamily(
+            'apic_exporter_collector_snapshot_restored',
+            'Whether the snapshot served for the collector was restored from the snapshot file',
+            labels=['collector'])
+
+        now = time()
+        for name, snapshot in snapshots:
+            if snapshot is None:
+                continue
+            for metric in snapshot.metrics:
+                yield metric
+            g_last_success.add_metric(labels=[name], value=snapshot.timestamp)
+            g_age.add_metric(labels=[name], value=now - snapshot.timestamp)
+            g_restored.add_metric(labels=[name], value=1 if snapshot.restored else 0)
+
+        yield g_last_success
+        yield g_age
+        yield g_restored
+        yield from run_metrics(self.__collectors, results)
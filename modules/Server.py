@@ -0,0 +1,110 @@
+import logging
+import threading
+
+from time import strftime
+from typing import Callable, Dict, List
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+from prometheus_client import make_wsgi_app
+from prometheus_client.core import REGISTRY
+from prometheus_client.exposition import ThreadingWSGIServer
+from modules.Profiler import profile_cycle, format_text, format_pstats, ProfilerBusyError, PROFILE_TOP
+
+LOG = logging.getLogger('apic_exporter.exporter')
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_probe_app(probe_apps: Dict[str, Callable]):
+    """Returns a WSGI app serving the metrics of the exporter process on /metrics and the metrics of a single fabric
+       on /probe?target=<fabric> by the app of the fabric
+    """
+    metrics_app = make_wsgi_app(REGISTRY)
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] != '/probe':
+            return metrics_app(environ, start_response)
+
+        target = parse_qs(environ.get('QUERY_STRING', '')).get('target', [''])[0]
+        if target == '':
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return [b'target parameter is missing\n']
+        if target not in probe_apps:
+            LOG.warning(f'probe for unknown fabric {target}')
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [f'unknown fabric {target}\n'.encode()]
+        return probe_apps[target](environ, start_response)
+
+    return app
+
+
+def make_debug_app(app, fabric_collectors: Dict[str, List]):
+    """Adds /debug/profile?[fabric=<fabric>&][collector=<name>&][top=30&][sort=cumulative&][format=text|pstats]
+       to app. It runs one collection cycle of the collectors of the fabric, or of the named collector only, under a
+       CPU profiler and allocation tracer and returns a text report or the CPU profile in the pstats format.
+    """
+
+    def error(start_response, status: str, message: str):
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [f'{message}\n'.encode()]
+
+    def debug_app(environ, start_response):
+        if environ['PATH_INFO'] != '/debug/profile':
+            return app(environ, start_response)
+
+        params = parse_qs(environ.get('QUERY_STRING', ''))
+        fabric = params.get('fabric', [''])[0]
+        if fabric == '' and len(fabric_collectors) == 1:
+            fabric = next(iter(fabric_collectors))
+        if fabric not in fabric_collectors:
+            return error(start_response, '404 Not Found', f'unknown fabric {fabric}')
+        collectors = fabric_collectors[fabric]
+        name = params.get('collector', [''])[0]
+        if name != '':
+            collectors = [c for c in collectors if type(c).__name__ == name]
+            if len(collectors) == 0:
+                return error(start_response, '404 Not Found', f'unknown collector {name}')
+        sort = params.get('sort', ['cumulative'])[0]
+        output = params.get('format', ['text'])[0]
+        try:
+            top = int(params.get('top', [PROFILE_TOP])[0])
+        except ValueError:
+            return error(start_response, '400 Bad Request', 'top must be a number')
+        if sort not in PROFILE_SORT_KEYS:
+            return error(start_response, '400 Bad Request', f'sort must be one of {", ".join(PROFILE_SORT_KEYS)}')
+        if output not in ('text', 'pstats'):
+            return error(start_response, '400 Bad Request', 'format must be text or pstats')
+
+        LOG.info(f'profiling a collection cycle of fabric {fabric} {name}')
+        try:
+            result = profile_cycle(collectors)
+        except ProfilerBusyError as e:
+            return error(start_response, '409 Conflict', str(e))
+
+        filename = f'apic-exporter-{fabric}-{name or "all"}-{strftime("%Y%m%d-%H%M%S")}'
+        if output == 'pstats':
+            body = format_pstats(result)
+            headers = [('Content-Type', 'application/octet-stream'),
+                       ('Content-Disposition', f'attachment; filename="{filename}.prof"')]
+        else:
+            body = format_text(result, top, sort).encode()
+            headers = [('Content-Type', 'text/plain; charset=utf-8'),
+                       ('Content-Disposition', f'attachment; filename="{filename}.txt"')]
+        start_response('200 OK', headers + [('Content-Length', str(len(body)))])
+        return [body]
+
+    return debug_app
+
+
+def start_server(port: int, app, addr: str = '0.0.0.0', name: str = 'apic-http-server'):
+    """Starts a threaded HTTP server for the WSGI app in a daemon thread"""
+    httpd = make_server(addr, port, app, ThreadingWSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=httpd.serve_forever, name=name, daemon=True)
+    thread.start()
+    return httpd
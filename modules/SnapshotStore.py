@@ -0,0 +1,126 @@
+import gzip
+import json
+import logging
+import os
+import threading
+
+from time import time, sleep
+from typing import Dict, List
+
+from prometheus_client.metrics_core import Metric
+
+LOG = logging.getLogger('apic_exporter.exporter')
+SNAPSHOT_INTERVAL_SECONDS = 60
+SNAPSHOT_VERSION = 1
+
+
+def dump_metrics(metrics: List[Metric]) -> List[Dict]:
+    """Returns the metric families as JSON serializable dicts"""
+    return [{
+        'name': m.name,
+        'documentation': m.documentation,
+        'type': m.type,
+        'unit': m.unit,
+        'samples': [[s.name, s.labels, s.value] for s in m.samples]
+    } for m in metrics]
+
+
+def load_metrics(data: List[Dict]) -> List[Metric]:
+    """Rebuilds the metric families returned by dump_metrics"""
+    metrics = []
+    for family in data:
+        metric = Metric(family['name'], family['documentation'], family['type'], family.get('unit', ''))
+        for name, labels, value in family['samples']:
+            metric.add_sample(name, labels, value)
+        metrics.append(metric)
+    return metrics
+
+
+class SnapshotStore(object):
+
+    def __init__(self, path: str, interval: int = SNAPSHOT_INTERVAL_SECONDS):
+        """Persists the metric snapshots and the topology of each fabric to a gzipped JSON file every interval
+           seconds, so a restarted exporter serves the last known metrics until the first refresh completes.
+        """
+        self.__path = path
+        self.__interval = interval
+        self.__lock = threading.Lock()
+        self.__sources: Dict[str, tuple] = {}
+        self.__loaded = self._read()
+        self.__thread = None
+
+    def _read(self) -> Dict:
+        if not os.path.exists(self.__path):
+            LOG.info(f'no snapshot file {self.__path}, starting cold')
+            return {}
+        try:
+            with gzip.open(self.__path, 'rt') as f:
+                data = json.load(f)
+        except (OSError, EOFError, ValueError) as e:
+            LOG.warning(f'unable to read snapshot file {self.__path}: {e}')
+            return {}
+        if not isinstance(data, dict):
+            LOG.warning(f'ignoring snapshot file {self.__path}, not a snapshot')
+            return {}
+        if data.get('version') != SNAPSHOT_VERSION:
+            LOG.warning(f'ignoring snapshot file {self.__path} of version {data.get("version")}')
+            return {}
+        fabrics = data.get('fabrics')
+        if not isinstance(fabrics, dict):
+            LOG.warning(f'ignoring snapshot file {self.__path} without fabrics')
+            return {}
+        saved = data.get('saved')
+        if isinstance(saved, (int, float)):
+            LOG.info(f'loaded snapshot file {self.__path} saved {time() - saved:.0f} sec ago')
+        else:
+            LOG.info(f'loaded snapshot file {self.__path}')
+        return fabrics
+
+    def register(self, fabric: str, scheduler, topology=None):
+        """Restores the scheduler and topology of the fabric from the loaded file and saves them from now on.
+           Must be called before the scheduler is started.
+        """
+        data = self.__loaded.get(fabric)
+        if not isinstance(data, dict):
+            data = {}
+        try:
+            scheduler.restore(data.get('collectors', {}))
+            if topology is not None and data.get('topology'):
+                topology.restore(data['topology'])
+        except (KeyError, TypeError, ValueError) as e:
+            LOG.warning(f'unable to restore snapshot of fabric {fabric}: {e}')
+        with self.__lock:
+            self.__sources[fabric] = (scheduler, topology)
+
+    def start(self):
+        """Starts saving the snapshots in the background"""
+        if self.__thread is not None:
+            return
+        self.__thread = threading.Thread(target=self._run, name='apic-snapshot-store', daemon=True)
+        self.__thread.start()
+
+    def _run(self):
+        while True:
+            sleep(self.__interval)
+            try:
+                self.save()
+            except (OSError, TypeError, ValueError) as e:
+                LOG.warning(f'unable to save snapshot file {self.__path}: {e}')
+
+    def save(self):
+        """Writes the snapshots to a temporary file that replaces the snapshot file, so a crash while writing does
+           not leave a truncated file behind
+        """
+        with self.__lock:
+            sources = dict(self.__sources)
+        fabrics = {}
+        for fabric, (scheduler, topology) in sources.items():
+            fabrics[fabric] = {
+                'collectors': scheduler.export(),
+                'topology': topology.export() if topology is not None else []
+            }
+        tmp_path = f'{self.__path}.tmp'
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'saved': time(), 'fabrics': fabrics}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.__path)
+        LOG.debug(f'saved snapshot file {self.__path}')
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+
+import aiohttp
+
+from time import time
+from typing import Dict, List
+
+from prometheus_client.core import Counter, Gauge
+from modules.Helper import fabric_singleton
+from modules.HostStats import HostStats
+from modules.CircuitBreaker import CircuitBreakers
+from modules.AsyncConnection import EventLoopThread
+from modules.Connection import TIMEOUT, COOKIE_TIMEOUT, TOKEN_LIFETIME_SECONDS, PAGE_SIZE, LOGINS, paged_query
+
+LOG = logging.getLogger('apic_exporter.exporter')
+SUBSCRIPTION_REFRESH_SECONDS = 30
+SUBSCRIPTION_EXPIRY_SECONDS = 90
+RESYNC_INTERVAL_SECONDS = 600
+# the delay before reconnecting doubles with every failed connection up to the maximum, randomized by up to half
+RECONNECT_SECONDS = 10
+RECONNECT_MAX_SECONDS = 300
+EVENTS = Counter('apic_exporter_subscription_events', 'Objects pushed by APIC query subscriptions', ['apicHost'])
+CONNECTED = Gauge('apic_exporter_subscription_connected', 'Whether the subscription websocket to the host is connected',
+                  ['apicHost'])
+
+
+class SubscriptionError(Exception):
+    """Raised if a subscription cannot be established or refreshed"""
+    pass
+
+
+@fabric_singleton
+class SubscriptionEngine(object):
+
+    def __init__(self, hosts: List[str], user: str, password: str):
+        """Keeps indexes of APIC objects up to date from query subscriptions (subscription=yes), whose changes are
+           pushed over a websocket. The subscribed queries are fully queried again every RESYNC_INTERVAL_SECONDS.
+           An index provides replace(objects, host), apply(object) and set_synced(synced).
+        """
+        self.__hosts = hosts
+        self.__user = user
+        self.__password = password
+        self.__lock = threading.Lock()
+        self.__subscriptions: Dict[str, object] = {}
+        # subscription id to index and the time the id expires, replaced ids are followed until they expire
+        self.__ids: Dict[str, tuple] = {}
+        # objects pushed during a resync for subscription ids it has not registered yet
+        self.__pending: Dict[str, List[Dict]] = {}
+        self.__resyncing = False
+        self.__resync_requested = False
+        self.__failures = 0
+        self.__future = None
+
+    def subscribe(self, query: str, index):
+        """Follows the query into the index. The engine is started on the first subscription."""
+        with self.__lock:
+            if query in self.__subscriptions:
+                return
+            self.__subscriptions[query] = index
+            self.__resync_requested = True
+            if self.__future is None:
+                self.__future = EventLoopThread().submit(self._run())
+
+    def stop(self):
+        """Stops following the subscriptions. The indexes are not synced anymore."""
+        with self.__lock:
+            future, self.__future = self.__future, None
+        if future is not None:
+            future.cancel()
+        for index in list(self.__subscriptions.values()):
+            index.set_synced(False)
+
+    async def _run(self):
+        while True:
+            open_hosts = CircuitBreakers(self.__hosts).get_open_hosts()
+            for host in HostStats(self.__hosts).ranked(self.__hosts, open_hosts):
+                try:
+                    await self._follow(host)
+                except (SubscriptionError, aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                    LOG.warning(f'subscriptions to apic host {host} failed: {e}')
+                except Exception as e:
+                    LOG.error(f'subscriptions to apic host {host} failed: {e}')
+                CONNECTED.labels(host).set(0)
+                for index in list(self.__subscriptions.values()):
+                    index.set_synced(False)
+                self.__failures += 1
+                delay = min(RECONNECT_MAX_SECONDS, RECONNECT_SECONDS * 2**(self.__failures - 1))
+                delay *= random.uniform(0.5, 1)
+                LOG.info(f'reconnecting subscriptions in {delay:.1f} sec')
+                await asyncio.sleep(delay)
+
+    async def _follow(self, host: str):
+        """Subscribes the queries on host and applies the pushed changes until the connection fails"""
+        connector = aiohttp.TCPConnector(ssl=False)
+        async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar()) as session:
+            token, lifetime = await self._login(session, host)
+            async with session.ws_connect(f'wss://{host}/socket{token}', heartbeat=SUBSCRIPTION_REFRESH_SECONDS) as ws:
+                LOG.info(f'subscription websocket to apic host {host} connected')
+                CONNECTED.labels(host).set(1)
+                self.__ids = {}
+                self.__pending = {}
+                self.__resync_requested = True
+                reader = asyncio.ensure_future(self._read(host, ws))
+                try:
+                    await self._maintain(session, host, token, lifetime, reader)
+                finally:
+                    reader.cancel()
+
+    async def _maintain(self, session: aiohttp.ClientSession, host: str, token: str, lifetime: int, reader):
+        """Resyncs the queries, refreshes the subscriptions and the token while the websocket is read"""
+        resync_at = 0
+        refresh_at = time() + SUBSCRIPTION_REFRESH_SECONDS
+        token_refresh_at = time() + lifetime / 2
+        while not reader.done():
+            now = time()
+            if self.__resync_requested or now >= resync_at:
+                self.__resync_requested = False
+                await self._resync(session, host, token)
+                self.__failures = 0
+                resync_at = now + RESYNC_INTERVAL_SECONDS
+                refresh_at = now + SUBSCRIPTION_REFRESH_SECONDS
+            elif now >= refresh_at:
+                for subscription_id, (_, expires) in list(self.__ids.items()):
+                    if expires is None:
+                        await self._get(session, host, token, f'/api/subscriptionRefresh.json?id={subscription_id}')
+                refresh_at = now + SUBSCRIPTION_REFRESH_SECONDS
+            if now >= token_refresh_at:
+                token, lifetime = await self._refreshToken(session, host, token)
+                token_refresh_at = now + lifetime / 2
+            await asyncio.wait([reader], timeout=1)
+        # raises the error of the reader
+        reader.result()
+
+    async def _resync(self, session: aiohttp.ClientSession, host: str, token: str):
+        """Queries the subscribed queries in full and replaces the indexes. The subscriptions of the previous sync are
+           followed until they expire, so no change is missed in between. Changes pushed before the last page of a
+           query arrived are applied after its objects.
+        """
+        for subscription_id, (index, expires) in list(self.__ids.items()):
+            if expires is None:
+                self.__ids[subscription_id] = (index, time() + SUBSCRIPTION_EXPIRY_SECONDS)
+            elif expires < time():
+                del self.__ids[subscription_id]
+
+        self.__resyncing = True
+        try:
+            for query, index in list(self.__subscriptions.items()):
+                subscription_id, objects = await self._query(session, host, token, query)
+                self.__ids[subscription_id] = (index, None)
+                index.replace(objects, host)
+                pending = self.__pending.pop(subscription_id, [])
+                for obj in pending:
+                    index.apply(obj)
+                LOG.debug(f'apic host {host}, {query} synced {len(objects)} objects and {len(pending)} changes')
+        finally:
+            # changes of unknown subscriptions, e.g. of expired ones, are not applied
+            self.__resyncing = False
+            self.__pending = {}
+
+    async def _query(self, session: aiohttp.ClientSession, host: str, token: str, query: str) -> tuple:
+        """Queries page by page, so each request completes within its timeout even if the class is large, e.g.
+           during a fault storm. The first page subscribes the query, the changes of objects on later pages are
+           pushed to its subscription. Returns the subscription id and the objects.
+        """
+        query, separator = paged_query(query)
+        subscription_id, objects, page = None, [], 0
+        while True:
+            page_query = f'{query}{separator}page={page}&page-size={PAGE_SIZE}'
+            if page == 0:
+                res = await self._get(session, host, token, f'{page_query}&subscription=yes')
+                if 'subscriptionId' not in res:
+                    raise SubscriptionError(f'{query} did not return a subscription id')
+                subscription_id = res['subscriptionId']
+            else:
+                res = await self._get(session, host, token, page_query)
+            objects.extend(res['imdata'])
+            total_count = res.get('totalCount')
+            if len(res['imdata']) < PAGE_SIZE or (total_count is not None and len(objects) >= int(total_count)):
+                return subscription_id, objects
+            page += 1
+
+    async def _read(self, host: str, ws: aiohttp.ClientWebSocketResponse):
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                self._dispatch(host, json.loads(msg.data))
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                raise SubscriptionError(f'websocket failed: {ws.exception()}')
+        raise SubscriptionError('websocket closed')
+
+    def _dispatch(self, host: str, event: Dict):
+        """Applies the objects of a pushed event to the indexes of its subscription ids. During a resync, objects of
+           ids that are not registered yet are kept until the resync registers them.
+        """
+        indexes, pending = {}, []
+        for subscription_id in event.get('subscriptionId', []):
+            if subscription_id in self.__ids:
+                index = self.__ids[subscription_id][0]
+                indexes[id(index)] = index
+            elif self.__resyncing:
+                pending.append(self.__pending.setdefault(subscription_id, []))
+        for obj in event.get('imdata', []):
+            EVENTS.labels(host).inc()
+            for index in indexes.values():
+                index.apply(obj)
+            for objects in pending:
+                objects.append(obj)
+
+    async def _get(self, session: aiohttp.ClientSession, host: str, token: str, query: str) -> Dict:
+        headers = {'Cookie': f'APIC-cookie={token}'}
+        url = f'https://{host}{query}'
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as resp:
+            if resp.status != 200:
+                raise SubscriptionError(f'url {url} responds with {resp.status}')
+            return await resp.json(content_type=None)
+
+    async def _login(self, session: aiohttp.ClientSession, host: str) -> tuple:
+        url = f'https://{host}/api/aaaLogin.json?'
+        payload = {"aaaUser": {"attributes": {"name": self.__user, "pwd": self.__password}}}
+        async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=COOKIE_TIMEOUT)) as resp:
+            if resp.status != 200:
+                LOGINS.labels(host, 'login', 'failure').inc()
+                raise SubscriptionError(f'url {url} responds with {resp.status}')
+            LOGINS.labels(host, 'login', 'success').inc()
+            return self._readToken(await resp.json(content_type=None))
+
+    async def _refreshToken(self, session: aiohttp.ClientSession, host: str, token: str) -> tuple:
+        res = await self._get(session, host, token, '/api/aaaRefresh.json')
+        LOGINS.labels(host, 'refresh', 'success').inc()
+        return self._readToken(res)
+
+    def _readToken(self, res: Dict) -> tuple:
+        attributes = res['imdata'][0]['aaaLogin']['attributes']
+        return attributes['token'], int(attributes.get('refreshTimeoutSeconds', TOKEN_LIFETIME_SECONDS))
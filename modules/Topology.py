@@ -0,0 +1,114 @@
+import logging
+import threading
+
+from modules.Helper import fabric_singleton
+
+from time import time
+from typing import Dict, List
+from collections import namedtuple
+
+LOG = logging.getLogger('apic_exporter.exporter')
+TOPOLOGY_TTL_SECONDS = 300
+TOPOLOGY_RETRY_SECONDS = 30
+GEN1_MODEL_PATTERNS = ('PQ', 'PX')
+fabric_node = namedtuple('fabric_node', 'id dn role pod model')
+
+
+@fabric_singleton
+class Topology(object):
+
+    def __init__(self, hosts: List[str], connection, ttl: int = TOPOLOGY_TTL_SECONDS):
+        """Caches the fabricNode inventory shared by all collectors of the fabric. The inventory is refreshed after
+           ttl seconds.
+        """
+        self.__hosts = hosts
+        self.__connection = connection
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__next_refresh = 0
+        self.__nodes: List[fabric_node] = []
+        self.__nodes_by_id: Dict[str, fabric_node] = {}
+        self.__nodes_by_dn: Dict[str, fabric_node] = {}
+        self.__nodes_by_role: Dict[str, List[fabric_node]] = {}
+
+    def get_nodes(self, role: str = None) -> List[fabric_node]:
+        """Returns all nodes ordered by node id, optionally restricted to a role (leaf, spine, controller)"""
+        self._refresh_if_expired()
+        if role is None:
+            return self.__nodes
+        return self.__nodes_by_role.get(role, [])
+
+    def get_gen1_nodes(self, role: str = None) -> List[fabric_node]:
+        """Returns the first generation nodes (models PQ or PX), optionally restricted to a role"""
+        return [n for n in self.get_nodes(role) if self.is_gen1(n)]
+
+    def get_node(self, node_id: str) -> fabric_node:
+        """Returns the node for the node id or None if unknown"""
+        self._refresh_if_expired()
+        return self.__nodes_by_id.get(node_id)
+
+    def get_node_by_dn(self, dn: str) -> fabric_node:
+        """Returns the node for the node dn (topology/pod-1/node-101) or None if unknown"""
+        self._refresh_if_expired()
+        return self.__nodes_by_dn.get(dn)
+
+    def is_gen1(self, node: fabric_node) -> bool:
+        return any(pattern in node.model for pattern in GEN1_MODEL_PATTERNS)
+
+    def _refresh_if_expired(self):
+        # the lock makes concurrent collectors wait for a single refresh
+        with self.__lock:
+            if time() < self.__next_refresh:
+                return
+            self.refresh()
+
+    def refresh(self):
+        """Fetches the fabricNode inventory. Keeps the previous inventory if no host returns valid data."""
+        query = '/api/node/class/fabricNode.json?order-by=fabricNode.id|asc'
+        for host in self.__connection.get_ranked_hosts(self.__hosts):
+            fetched_data = self.__connection.getRequest(host, query)
+            if not self.__connection.isDataValid(fetched_data):
+                LOG.warning(f'apic host {host}, {query} did not return anything')
+                continue
+            self._index([n['fabricNode']['attributes'] for n in fetched_data['imdata']])
+            self.__next_refresh = time() + self.__ttl
+            LOG.info(f'refreshed fabric topology with {len(self.__nodes)} nodes from apic host {host}')
+            return
+        LOG.error(f'unable to refresh fabric topology, retrying in {TOPOLOGY_RETRY_SECONDS} sec')
+        self.__next_refresh = time() + TOPOLOGY_RETRY_SECONDS
+
+    def export(self) -> List[Dict]:
+        """Returns the attributes of the cached nodes"""
+        return [{'id': n.id, 'dn': n.dn, 'role': n.role, 'model': n.model} for n in self.__nodes]
+
+    def restore(self, attributes: List[Dict]):
+        """Restores the nodes returned by export if nothing was fetched yet. The restored inventory is refreshed
+           after TOPOLOGY_RETRY_SECONDS.
+        """
+        with self.__lock:
+            if self.__next_refresh > 0:
+                return
+            self._index(attributes)
+            self.__next_refresh = time() + TOPOLOGY_RETRY_SECONDS
+            LOG.info(f'restored fabric topology with {len(self.__nodes)} nodes')
+
+    def _index(self, attributes: List[Dict]):
+        nodes = []
+        for attrs in attributes:
+            dn = attrs['dn']
+            nodes.append(
+                fabric_node(id=attrs['id'],
+                            dn=dn,
+                            role=attrs['role'],
+                            pod=dn.split('/')[1].replace('pod-', ''),
+                            model=attrs['model']))
+        nodes.sort(key=lambda n: int(n.id))
+
+        nodes_by_role = {}
+        for node in nodes:
+            nodes_by_role.setdefault(node.role, []).append(node)
+
+        self.__nodes = nodes
+        self.__nodes_by_id = {n.id: n for n in nodes}
+        self.__nodes_by_dn = {n.dn: n for n in nodes}
+        self.__nodes_by_role = nodes_by_role
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import time
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from apic_simulator import ApicSimulator, SyntheticFabric, fabric_size  # noqa: E402
+
+# pods, spines, leaves, controllers, interfaces, faults, endpoints and duplicate ips small enough to generate
+# the fabric for every test
+SMALL_FABRIC = fabric_size(1, 2, 4, 3, 4, 40, 20, 2)
+
+
+@pytest.fixture(scope='session')
+def certificate(tmp_path_factory) -> tuple:
+    """Self-signed certificate shared by the simulated hosts of all tests"""
+    directory = tmp_path_factory.mktemp('cert')
+    cert, key = str(directory / 'cert.pem'), str(directory / 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=apic-simulator',
+        '-keyout', key, '-out', cert
+    ],
+                   check=True,
+                   capture_output=True)
+    return cert, key
+
+
+@pytest.fixture
+def simulator(certificate, monkeypatch) -> ApicSimulator:
+    """A simulated APIC cluster of three hosts. Every test gets new ports, so the per fabric singletons of the
+       exporter are not shared between tests.
+    """
+    # requests must not verify the self-signed certificate against a bundle from the environment
+    monkeypatch.delenv('REQUESTS_CA_BUNDLE', raising=False)
+    monkeypatch.delenv('CURL_CA_BUNDLE', raising=False)
+    simulator = ApicSimulator(SyntheticFabric(SMALL_FABRIC), hosts=3)
+    simulator.start(cert=certificate[0], key=certificate[1])
+    yield simulator
+    simulator.stop()
+
+
+def wait_for(condition, timeout: float = 10, interval: float = 0.05) -> bool:
+    """Polls condition until it returns True or the timeout passed"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
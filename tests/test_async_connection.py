@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+from apic_simulator import injection_tuple
+from modules.AsyncConnection import AsyncConnection
+from modules.CircuitBreaker import FAILURE_THRESHOLD
+from modules.Connection import Connection, SessionPool, collection_cycle
+
+NODE_QUERY = '/api/node/class/fabricNode.json'
+QUERIES = {
+    'nodes': NODE_QUERY,
+    'systems': '/api/node/class/topSystem.json',
+    'interfaces': '/api/node/class/l1PhysIf.json',
+}
+
+
+def connect(simulator) -> AsyncConnection:
+    return AsyncConnection([host.address for host in simulator.hosts], 'user', 'password')
+
+
+def test_batch_returns_the_results_by_key(simulator):
+    connection = connect(simulator)
+    host = simulator.hosts[0].address
+
+    results = connection.run(connection.getRequests(host, QUERIES, collector='test'))
+
+    assert sorted(results.keys()) == sorted(QUERIES.keys())
+    assert len(results['nodes']['imdata']) == len(simulator.fabric.query(NODE_QUERY, {})['imdata'])
+
+
+def test_uses_the_token_of_the_session_pool(simulator):
+    connection = connect(simulator)
+    host = simulator.hosts[0]
+
+    connection.run(connection.getRequests(host.address, QUERIES))
+
+    # the background login of the pool is the only login
+    assert host.stats()['logins'] == 1
+    pool = SessionPool([h.address for h in simulator.hosts], 'user', 'password')
+    assert pool.getToken(pool.getSession(host.address).session) is not None
+
+
+def test_logs_in_once_after_the_token_was_invalidated(simulator):
+    connection = connect(simulator)
+    host = simulator.hosts[0]
+    connection.run(connection.getRequest(host.address, NODE_QUERY))
+    simulator.fabric.expire_tokens()
+
+    results = connection.run(connection.getRequests(host.address, QUERIES))
+
+    assert len(results) == len(QUERIES)
+    # concurrent queries rejected with 403 share a single login
+    assert host.stats()['logins'] == 2
+
+
+def test_coalesces_queries_with_the_threaded_engine(simulator):
+    hosts = [host.address for host in simulator.hosts]
+    connection = connect(simulator)
+    threaded = Connection(hosts, 'user', 'password')
+    host = simulator.hosts[0]
+
+    with collection_cycle([SimpleNamespace(hosts=hosts)]):
+        results = connection.run(connection.getRequests(host.address, {1: NODE_QUERY, 2: NODE_QUERY}))
+        requests = host.stats()['requests']
+        memoized = threaded.getRequest(host.address, NODE_QUERY)
+
+    assert results[1] is results[2]
+    assert memoized is results[1]
+    assert requests == 1
+    assert host.stats()['requests'] == 1
+
+
+def test_skips_unavailable_hosts(simulator):
+    connection = connect(simulator)
+    host = simulator.hosts[0]
+    pool = SessionPool([h.address for h in simulator.hosts], 'user', 'password')
+    connection.run(connection.getRequest(host.address, NODE_QUERY))
+    for _ in range(FAILURE_THRESHOLD):
+        pool.set_session_unavailable(host.address)
+
+    assert connection.run(connection.getRequest(host.address, '/api/node/class/topSystem.json')) is None
+    assert host.stats()['requests'] == 1
+    assert connection.get_unresponsive_hosts() == [host.address]
+
+
+def test_timeouts_open_the_circuit(simulator):
+    connection = connect(simulator)
+    host = simulator.hosts[0]
+    host.injection = injection_tuple(1.0, 0.0, 0.0, 0.0)
+
+    for i in range(FAILURE_THRESHOLD):
+        assert connection.run(connection.getRequest(host.address, f'{NODE_QUERY}?attempt={i}', timeout=0.2)) is None
+
+    assert connection.get_unresponsive_hosts() == [host.address]
+
+
+def test_sessions_are_closed_on_shutdown(simulator):
+    connection = connect(simulator)
+    connection.run(connection.getRequest(simulator.hosts[0].address, NODE_QUERY))
+    sessions = list(connection._AsyncConnection__sessions.values())
+
+    connection._shutdown()
+
+    assert len(sessions) == 1
+    assert sessions[0].closed
@@ -0,0 +1,157 @@
+import pytest
+import threading
+
+from apic_simulator import injection_tuple
+from modules import CircuitBreaker as circuit_breaker
+from modules import HostStats as host_stats
+from modules.CircuitBreaker import CircuitBreaker, CircuitBreakers, FAILURE_THRESHOLD, CLOSED, OPEN, HALF_OPEN
+from modules.Connection import Connection
+from modules.HostStats import HostStats, STATS_MAX_AGE_SECONDS
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', clock)
+    monkeypatch.setattr(host_stats, 'time', clock)
+    # the backoff is randomized between half and the full backoff
+    monkeypatch.setattr(circuit_breaker.random, 'uniform', lambda a, b: b)
+    return clock
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('breaker-opens')
+
+    for _ in range(FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+
+def test_success_resets_the_failures(clock):
+    breaker = CircuitBreaker('breaker-resets')
+
+    for _ in range(FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CLOSED
+
+
+def test_probe_after_backoff_closes_or_reopens(clock):
+    breaker = CircuitBreaker('breaker-probe')
+    for _ in range(FAILURE_THRESHOLD):
+        breaker.record_failure()
+
+    clock.now += circuit_breaker.BACKOFF_BASE_SECONDS - 0.1
+    assert not breaker.probe_due()
+    clock.now += 0.2
+    assert breaker.probe_due()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+    # a failed probe doubles the backoff
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += circuit_breaker.BACKOFF_BASE_SECONDS + 0.1
+    assert not breaker.probe_due()
+    clock.now += circuit_breaker.BACKOFF_BASE_SECONDS
+    assert breaker.probe_due()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_backoff_is_capped(clock):
+    breaker = CircuitBreaker('breaker-capped')
+    for _ in range(FAILURE_THRESHOLD):
+        breaker.record_failure()
+    for _ in range(20):
+        clock.now += circuit_breaker.BACKOFF_MAX_SECONDS + 0.1
+        assert breaker.probe_due()
+        breaker.record_failure()
+
+    clock.now += circuit_breaker.BACKOFF_MAX_SECONDS + 0.1
+
+    assert breaker.probe_due()
+
+
+def test_failures_of_an_open_circuit_do_not_grow_the_backoff(clock):
+    breaker = CircuitBreaker('breaker-concurrent')
+    # queries in flight when the host fails time out together
+    threads = [threading.Thread(target=breaker.record_failure) for _ in range(FAILURE_THRESHOLD + 8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert breaker.state == OPEN
+
+    clock.now += circuit_breaker.BACKOFF_BASE_SECONDS + 0.1
+
+    assert breaker.probe_due()
+
+
+def test_ranks_by_latency_and_errors(clock):
+    stats = HostStats(['rank-a', 'rank-b', 'rank-c', 'rank-d'])
+    stats.record('rank-a', 0.2, True)
+    stats.record('rank-b', 0.1, True)
+    stats.record('rank-c', 0.05, False)
+
+    # rank-d has no recent requests and is tried first to measure it
+    assert stats.ranked(['rank-a', 'rank-b', 'rank-c', 'rank-d']) == ['rank-d', 'rank-b', 'rank-a', 'rank-c']
+    assert stats.ranked(['rank-a', 'rank-b', 'rank-c', 'rank-d'], ['rank-d', 'rank-b']) == \
+        ['rank-a', 'rank-c', 'rank-d', 'rank-b']
+
+
+def test_stale_stats_are_measured_again(clock):
+    stats = HostStats(['stale-a', 'stale-b'])
+    stats.record('stale-a', 0.1, True)
+    stats.record('stale-b', 1.0, True)
+    clock.now += STATS_MAX_AGE_SECONDS / 2
+    stats.record('stale-a', 0.1, True)
+
+    clock.now += STATS_MAX_AGE_SECONDS / 2 + 1
+
+    assert stats.score('stale-b') == 0
+    assert stats.ranked(['stale-a', 'stale-b']) == ['stale-b', 'stale-a']
+
+
+def test_server_errors_do_not_close_the_circuit(simulator):
+    hosts = [host.address for host in simulator.hosts]
+    connection = Connection(hosts, 'user', 'password')
+    breaker = CircuitBreakers(hosts).get(hosts[0])
+    simulator.hosts[0].injection = injection_tuple(0.0, 0.0, 0.0, 1.0)
+
+    for _ in range(FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    assert connection.getRequest(hosts[0], '/api/node/class/fabricNode.json') is None
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+
+
+def test_responses_close_the_circuit(simulator):
+    hosts = [host.address for host in simulator.hosts]
+    connection = Connection(hosts, 'user', 'password')
+    breaker = CircuitBreakers(hosts).get(hosts[0])
+
+    for _ in range(FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    assert connection.getRequest(hosts[0], '/api/node/class/fabricNode.json') is not None
+    breaker.record_failure()
+
+    assert breaker.state == CLOSED
@@ -0,0 +1,135 @@
+import threading
+
+from time import time
+from typing import Dict
+
+from prometheus_client.core import GaugeMetricFamily
+
+from apic_simulator import injection_tuple
+from BaseCollector import BaseCollector
+from Collector import Collector
+from modules.CircuitBreaker import CircuitBreakers, CLOSED
+
+NODE_QUERY = '/api/node/class/fabricNode.json'
+
+
+class NodeCollector(Collector):
+    """Counts the fabric nodes. The first rejected_payloads payloads are rejected by get_metrics."""
+
+    def __init__(self, config: Dict):
+        super().__init__('test_nodes', config)
+        self.rejected_payloads = 0
+        self.queried_hosts = []
+
+    def describe(self):
+        yield GaugeMetricFamily('test_nodes', 'Fabric nodes')
+
+    def get_query(self) -> str:
+        return NODE_QUERY
+
+    def get_metrics(self, host: str, data: Dict):
+        self.queried_hosts.append(host)
+        if len(self.queried_hosts) <= self.rejected_payloads:
+            return None
+        g_nodes = GaugeMetricFamily('test_nodes', 'Fabric nodes', labels=['apicHost'])
+        g_nodes.add_metric(labels=[host], value=len(data['imdata']))
+        return [g_nodes]
+
+
+def make_config(simulator, **options) -> Dict:
+    return {
+        'apic_hosts': ','.join(host.address for host in simulator.hosts),
+        'apic_user': 'user',
+        'apic_password': 'password',
+        **options
+    }
+
+
+def test_hedged_result_rejected_falls_back_to_the_remaining_hosts(simulator):
+    collector = NodeCollector(make_config(simulator, hedge_requests=True))
+    collector.rejected_payloads = 1
+
+    metrics = list(collector.collect())
+
+    assert len(collector.queried_hosts) == 2
+    assert collector.queried_hosts[0] != collector.queried_hosts[1]
+    assert metrics[0].samples[0].labels == {'apicHost': collector.queried_hosts[1]}
+
+
+class BatchCollector(BaseCollector):
+    """Queries the nodes of the fabric in a batch and records the time each run spends in collect"""
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        self.results = None
+        self.runs = []
+
+    def describe(self):
+        yield GaugeMetricFamily('test_batch', 'Batched queries')
+
+    def collect(self):
+        started = time()
+        queries = {i: f'/api/node/class/fabricNode.json?batch={i}' for i in range(8)}
+        self.results = self.query_host_batch(self.hosts[0], queries)
+        g_batch = GaugeMetricFamily('test_batch', 'Batched queries')
+        g_batch.add_metric(labels=[], value=len(self.results))
+        self.runs.append((started, time()))
+        yield g_batch
+
+
+def test_failed_run_keeps_the_last_metrics(simulator):
+    collector = NodeCollector(make_config(simulator, time_budget_seconds=0.5))
+    first = collector.run()
+    collector.rejected_payloads = 100
+
+    failed = collector.run()
+    for host in simulator.hosts:
+        host.injection = injection_tuple(1.0, 0.0, 0.0, 0.0)
+    timed_out = collector.run()
+
+    assert len(first.metrics) == 1
+    assert failed.metrics == [] and not failed.timed_out
+    assert timed_out.timed_out
+    assert timed_out.metrics == first.metrics
+
+
+def test_asyncio_batch_is_cancelled_with_the_budget(simulator):
+    collector = BatchCollector(
+        make_config(simulator, connection_engine='asyncio', max_parallel_queries=2, time_budget_seconds=0.5))
+    simulator.hosts[0].injection = injection_tuple(0.5, 0.0, 0.0, 0.0)
+
+    result = collector.run()
+
+    # 8 queries of 0.5 sec, 2 at a time, would take 2 sec
+    assert result.timed_out
+    assert result.duration < 1.5
+    assert collector.results == {}
+
+
+def test_runs_of_a_collector_do_not_overlap(simulator):
+    collector = BatchCollector(make_config(simulator, time_budget_seconds=5))
+    simulator.hosts[0].injection = injection_tuple(0.1, 0.0, 0.0, 0.0)
+
+    threads = [threading.Thread(target=collector.run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    runs = sorted(collector.runs)
+    assert len(runs) == 3
+    assert all(previous[1] <= following[0] for previous, following in zip(runs, runs[1:]))
+    assert collector.results == {i: collector.results[i] for i in range(8)}
+
+
+def test_queries_in_flight_are_cut_short_by_the_budget(simulator):
+    collector = NodeCollector(make_config(simulator, time_budget_seconds=0.5))
+    for host in simulator.hosts:
+        host.injection = injection_tuple(3.0, 0.0, 0.0, 0.0)
+
+    result = collector.run()
+
+    assert result.timed_out
+    assert result.duration < 1.5
+    # the hosts did not fail, the budget was exceeded
+    assert [CircuitBreakers(collector.hosts).get(host).state for host in collector.hosts] == [CLOSED] * 3
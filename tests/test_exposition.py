@@ -0,0 +1,182 @@
+import gzip
+import pytest
+
+from wsgiref.util import setup_testing_defaults
+
+from prometheus_client.core import CollectorRegistry, GaugeMetricFamily
+
+from modules import Exposition as exposition
+from modules import Scheduler as scheduler
+from modules.Exposition import make_cached_app
+from modules.Scheduler import RefreshScheduler
+
+
+class CountingCollector(object):
+    """Yields two gauges and counts how often it was collected"""
+
+    def __init__(self):
+        self.collects = 0
+        self.value = 1
+
+    def describe(self):
+        yield GaugeMetricFamily('test_first', 'First gauge')
+        yield GaugeMetricFamily('test_second', 'Second gauge')
+
+    def collect(self):
+        self.collects += 1
+        yield GaugeMetricFamily('test_first', 'First gauge', value=self.value)
+        yield GaugeMetricFamily('test_second', 'Second gauge', value=2)
+
+
+class Generation(object):
+
+    def __init__(self):
+        self.value = 0
+
+    def __call__(self) -> int:
+        return self.value
+
+
+class Response(object):
+
+    def __init__(self, app, **environ):
+        setup_testing_defaults(environ)
+        self.body = b''.join(app(environ, self.start_response))
+
+    def start_response(self, status: str, headers: list):
+        self.status = status
+        self.headers = dict(headers)
+
+
+@pytest.fixture
+def collector() -> CountingCollector:
+    return CountingCollector()
+
+
+@pytest.fixture
+def generation() -> Generation:
+    return Generation()
+
+
+@pytest.fixture
+def app(collector, generation):
+    registry = CollectorRegistry()
+    registry.register(collector)
+    return make_cached_app(registry, generation)
+
+
+def test_renders_once_per_generation(app, collector):
+    first = Response(app)
+    second = Response(app)
+
+    assert first.status == '200 OK'
+    assert b'test_first 1.0' in first.body
+    assert second.body == first.body
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert first.headers['Content-Length'] == str(len(first.body))
+    assert collector.collects == 1
+
+
+def test_matching_etag_is_not_modified(app):
+    etag = Response(app).headers['ETag']
+
+    response = Response(app, HTTP_IF_NONE_MATCH=f'"other", {etag}')
+
+    assert response.status == '304 Not Modified'
+    assert response.body == b''
+    assert response.headers['ETag'] == etag
+    assert Response(app, HTTP_IF_NONE_MATCH='"other"').status == '200 OK'
+
+
+def test_gzipped_representation_has_its_own_etag(app):
+    plain = Response(app)
+    compressed = Response(app, HTTP_ACCEPT_ENCODING='gzip')
+
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert gzip.decompress(compressed.body) == plain.body
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert Response(app, HTTP_IF_NONE_MATCH=plain.headers['ETag'], HTTP_ACCEPT_ENCODING='gzip').status == '200 OK'
+    assert Response(app, HTTP_IF_NONE_MATCH=compressed.headers['ETag'],
+                    HTTP_ACCEPT_ENCODING='gzip').status == '304 Not Modified'
+
+
+def test_new_generation_is_rendered_again(app, collector, generation):
+    etag = Response(app).headers['ETag']
+    collector.value = 5
+
+    assert Response(app, HTTP_IF_NONE_MATCH=etag).status == '304 Not Modified'
+    generation.value += 1
+    response = Response(app, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status == '200 OK'
+    assert b'test_first 5.0' in response.body
+    assert response.headers['ETag'] != etag
+
+
+def test_head_has_no_body(app):
+    response = Response(app, REQUEST_METHOD='HEAD')
+
+    assert response.status == '200 OK'
+    assert response.body == b''
+    assert int(response.headers['Content-Length']) > 0
+
+
+def test_name_filter_is_rendered_live(app, collector):
+    Response(app)
+    collects = collector.collects
+
+    response = Response(app, QUERY_STRING='name[]=test_second')
+
+    assert b'test_second 2.0' in response.body
+    assert b'test_first' not in response.body
+    assert 'ETag' not in response.headers
+    assert collector.collects == collects + 1
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(exposition, 'time', clock)
+    monkeypatch.setattr(scheduler, 'time', clock)
+    return clock
+
+
+def test_rendered_again_after_max_age(collector, generation, clock):
+    registry = CollectorRegistry()
+    registry.register(collector)
+    app = make_cached_app(registry, generation, 60)
+    etag = Response(app).headers['ETag']
+    collector.value = 5
+
+    clock.now += 59
+    assert Response(app, HTTP_IF_NONE_MATCH=etag).status == '304 Not Modified'
+    clock.now += 1
+    response = Response(app, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status == '200 OK'
+    assert b'test_first 5.0' in response.body
+
+
+def test_snapshot_age_grows_while_the_refresh_stalls(collector, clock):
+    runner = RefreshScheduler([collector])
+    runner.restore({'CountingCollector': {'timestamp': clock.now, 'metrics': []}})
+    registry = CollectorRegistry()
+    registry.register(runner)
+    app = make_cached_app(registry, lambda: runner.generation, 60)
+
+    Response(app)
+    # no refresh completes, the generation does not change
+    clock.now += 600
+    response = Response(app)
+
+    assert b'apic_exporter_collector_snapshot_age_seconds{collector="CountingCollector"} 600.0' in response.body
@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+
+from collectors.ApicFaultsCollector import ApicFaultsCollector, parse_timestamp, format_timestamp
+from test_collector import make_config
+from test_subscription import NEW_FAULT, active_faults
+
+
+def fault_counts(metrics) -> dict:
+    counts = {}
+    for sample in metrics[0].samples:
+        key = (sample.labels['code'], sample.labels['severity'])
+        counts[key] = counts.get(key, 0) + sample.value
+    return counts
+
+
+def expected_counts(simulator) -> dict:
+    counts = {}
+    for attrs in active_faults(simulator):
+        key = (attrs['code'], attrs['severity'])
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def requests(simulator) -> int:
+    return sum(host.stats().get('requests', 0) for host in simulator.hosts)
+
+
+def test_delta_sync_applies_modified_and_deleted_faults(simulator):
+    collector = ApicFaultsCollector(make_config(simulator, fault_source='delta'))
+    assert fault_counts(list(collector.collect())) == expected_counts(simulator)
+    faults = active_faults(simulator)
+
+    simulator.fabric.remove(faults[0]['dn'])
+    simulator.fabric.update('faultInst', {'dn': faults[1]['dn'], 'severity': 'critical', 'lc': 'raised'})
+    simulator.fabric.update('faultInst', {**NEW_FAULT, 'modTs': format_timestamp(datetime.now(timezone.utc))})
+    before = requests(simulator)
+    metrics = list(collector.collect())
+
+    # one query for the modified faults and one for the deletion records instead of a full load
+    assert requests(simulator) - before == 2
+    assert fault_counts(metrics) == expected_counts(simulator)
+    assert ('F9999', 'critical') in fault_counts(metrics)
+
+
+def test_deletion_records_remove_the_fault_of_the_affected_object(simulator):
+    collector = ApicFaultsCollector(make_config(simulator, fault_source='delta'))
+    list(collector.collect())
+    removed = active_faults(simulator)[0]
+
+    simulator.fabric.remove(removed['dn'])
+    records = simulator.fabric.query('/api/node/class/faultRecord.json',
+                                     {'query-target-filter': 'eq(faultRecord.ind,"deletion")'})['imdata']
+    list(collector.collect())
+
+    assert len(records) == 1
+    assert f'{records[0]["faultRecord"]["attributes"]["affected"]}/fault-{removed["code"]}' == removed['dn']
+    assert removed['dn'] not in [attrs['dn'] for attrs in collector.fault_index.get_faults([removed['code']])]
+
+
+def test_watermark_is_the_latest_modification_across_offsets(simulator):
+    collector = ApicFaultsCollector(make_config(simulator, fault_source='delta'))
+    # 10:30 UTC is the latest, although 09:30-01:00 sorts first as a string
+    objects = [{
+        'faultInst': {
+            'attributes': {
+                'modTs': mod_ts
+            }
+        }
+    } for mod_ts in ('2030-01-01T10:00:00.000+00:00', '2030-01-01T09:30:00.000-01:00', '2030-01-01T11:00:00.000+02:00',
+                     'invalid')]
+    watermark = [None]
+
+    assert list(collector._track_watermark(iter(objects), watermark)) == objects
+    assert format_timestamp(watermark[0]) == '2030-01-01T10:30:00.000+00:00'
+
+
+def test_timestamps():
+    assert parse_timestamp('2016-10-27T12:04:43.380+02:00') == datetime(2016, 10, 27, 10, 4, 43, 380000, timezone.utc)
+    assert parse_timestamp('2016-10-27T12:04:43') == datetime(2016, 10, 27, 12, 4, 43, tzinfo=timezone.utc)
+    assert parse_timestamp('') is None
+    assert parse_timestamp(None) is None
+    assert format_timestamp(parse_timestamp('2016-10-27T12:04:43.380123-01:30')) == '2016-10-27T13:34:43.380+00:00'
@@ -0,0 +1,117 @@
+import json
+import pytest
+
+from collectors.ApicEquipmentCollector import ApicEquipmentCollector
+from modules.Connection import Connection
+from modules.JsonStream import ImdataStream
+from test_collector import make_config
+
+DOCUMENT = {
+    'totalCount': '3',
+    'imdata': [
+        {
+            'faultInst': {
+                'attributes': {
+                    'dn': 'topology/pod-1/node-101/sys/phys-[eth1/1]/fault-F0532',
+                    'descr': 'Schnittstelle außer Betrieb ✓'
+                }
+            }
+        },
+        {
+            'eqptcapacityL2Usage5min': {
+                'attributes': {
+                    'localEpLast': 12345,
+                    'ratio': 0.125
+                },
+                'children': [{
+                    'x': {
+                        'attributes': {}
+                    }
+                }]
+            }
+        },
+        123456789,
+    ],
+    'trailer': [1, 2]
+}
+
+
+def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 1 << 20])
+def test_decodes_the_objects_across_chunk_boundaries(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False, indent=1).encode()
+    stream = ImdataStream(chunked(data, size))
+
+    assert stream.read_header() == {'totalCount': '3'}
+    assert list(stream.objects()) == DOCUMENT['imdata']
+    # keys after imdata are read once the objects are exhausted
+    assert stream.attributes == {'totalCount': '3', 'trailer': [1, 2]}
+
+
+def test_empty_imdata():
+    stream = ImdataStream(chunked(b'{"totalCount":"0","imdata":[]}', 5))
+
+    assert list(stream.objects()) == []
+    assert stream.attributes == {'totalCount': '0'}
+
+
+@pytest.mark.parametrize('data', [
+    b'{"totalCount":"2","imdata":[{"a":1},{"b":',
+    b'{"totalCount":"2","imdata":[{"a":1}',
+    b'["not an apic response"]',
+])
+def test_invalid_documents_raise(data):
+    stream = ImdataStream(chunked(data, 4))
+
+    with pytest.raises(json.JSONDecodeError):
+        list(stream.objects())
+
+
+def test_streamed_pages_match_the_decoded_response(simulator):
+    hosts = [host.address for host in simulator.hosts]
+    connection = Connection(hosts, 'user', 'password')
+    query = '/api/node/class/l1PhysIf.json'
+
+    decoded = connection.getPagedRequest(hosts[0], query, page_size=0)
+    streamed = connection.getPagedRequest(hosts[0], query, page_size=7, stream=True)
+
+    assert streamed['totalCount'] == decoded['totalCount']
+    assert list(streamed['imdata']) == sorted(decoded['imdata'], key=lambda o: o['l1PhysIf']['attributes']['dn'])
+
+
+class CountingDecoder(json.JSONDecoder):
+
+    def __init__(self):
+        super().__init__()
+        self.attempts = 0
+
+    def raw_decode(self, s, idx=0):
+        self.attempts += 1
+        return super().raw_decode(s, idx)
+
+
+def test_large_object_is_not_decoded_again_for_every_chunk():
+    large = {'topSystem': {'children': [{'l1PhysIf': {'attributes': {'id': f'eth1/{i}'}}} for i in range(20000)]}}
+    data = json.dumps({'totalCount': '1', 'imdata': [large]}).encode()
+    stream = ImdataStream(chunked(data, 1024))
+    decoder = stream._ImdataStream__decoder = CountingDecoder()
+
+    assert list(stream.objects()) == [large]
+    # the object spans hundreds of chunks, it is decoded again each time the buffered part doubled
+    assert len(data) // 1024 > 500
+    assert decoder.attempts < 30
+
+
+def test_equipment_is_streamed(simulator):
+    decoded = ApicEquipmentCollector(make_config(simulator, page_size=0))
+    streamed = ApicEquipmentCollector(make_config(simulator, page_size=2, stream_responses=True))
+
+    def flashes(collector) -> list:
+        return sorted((s.labels['node'], s.labels['model'], s.value) for s in list(collector.collect())[0].samples)
+
+    assert len(flashes(streamed)) > 0
+    assert flashes(streamed) == flashes(decoded)
@@ -0,0 +1,30 @@
+import pstats
+import threading
+
+from modules.Profiler import profile_cycle, format_text
+from test_collector import NodeCollector, make_config
+
+
+def test_profiles_a_collection_cycle(simulator):
+    collector = NodeCollector(make_config(simulator))
+
+    result = profile_cycle([collector])
+
+    assert result.collectors == ['NodeCollector']
+    assert 'collection cycle of NodeCollector' in format_text(result)
+    assert 'get_metrics' in [function for _, _, function in pstats.Stats(result.profile).stats]
+
+
+def test_waits_for_a_running_collector(simulator):
+    collector = NodeCollector(make_config(simulator))
+    profiled = threading.Event()
+
+    with collector.exclusive():
+        thread = threading.Thread(target=lambda: profile_cycle([collector]) and profiled.set())
+        thread.start()
+        assert not profiled.wait(0.5)
+        assert collector.queried_hosts == []
+    thread.join()
+
+    assert profiled.is_set()
+    assert len(collector.queried_hosts) == 1
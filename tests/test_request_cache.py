@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+import threading
+
+from itertools import count
+from time import time
+
+from conftest import wait_for
+from modules.Connection import RequestCache
+
+
+class Fetch(object):
+    """Returns t0, t1, ... on each call. While blocked, calls wait until release is set."""
+
+    def __init__(self):
+        self.calls = count()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self) -> dict:
+        result = {'imdata': [f't{next(self.calls)}']}
+        self.started.set()
+        self.release.wait()
+        return result
+
+
+def test_results_are_memoized_within_a_cycle():
+    cache = RequestCache(['memoized'])
+    fetch = Fetch()
+
+    with cache.cycle():
+        first = cache.get('apic', '/query', fetch)
+        second = cache.get('apic', '/query', fetch)
+    with cache.cycle():
+        third = cache.get('apic', '/query', fetch)
+
+    assert first is second
+    assert third == {'imdata': ['t1']}
+
+
+def test_overlapping_cycles_get_fresh_data():
+    cache = RequestCache(['overlapping'])
+    fetch = Fetch()
+    results = []
+
+    # each cycle starts while the previous one is still active, so some cycle is active all the time
+    a = cache.cycle()
+    a.__enter__()
+    results.append(cache.get('apic', '/query', fetch))
+    previous = a
+    for _ in range(3):
+        following = cache.cycle()
+        following.__enter__()
+        previous.__exit__(None, None, None)
+        results.append(cache.get('apic', '/query', fetch))
+        results.append(cache.get('apic', '/query', fetch))
+        previous = following
+    previous.__exit__(None, None, None)
+
+    assert [r['imdata'][0] for r in results] == ['t0', 't1', 't1', 't2', 't2', 't3', 't3']
+
+
+def test_requests_in_flight_before_a_cycle_are_not_joined():
+    cache = RequestCache(['in-flight'])
+    fetch = Fetch()
+    fetch.release.clear()
+    results = {}
+
+    with cache.cycle():
+        thread = threading.Thread(target=lambda: results.update(first=cache.get('apic', '/query', fetch)))
+        thread.start()
+        assert wait_for(fetch.started.is_set)
+        with cache.cycle():
+            fetch.release.set()
+            results['second'] = cache.get('apic', '/query', fetch)
+            thread.join()
+            results['memoized'] = cache.get('apic', '/query', fetch)
+
+    assert results['first'] == {'imdata': ['t0']}
+    assert results['second'] == {'imdata': ['t1']}
+    # the result of the earlier cycle does not replace the one of the current cycle
+    assert results['memoized'] is results['second']
+
+
+def test_async_waiters_do_not_hold_executor_threads():
+    cache = RequestCache(['async-waiters'])
+    fetch = Fetch()
+    fetch.release.clear()
+    leader = threading.Thread(target=cache.get, args=('apic', '/query', fetch))
+    leader.start()
+    assert wait_for(fetch.started.is_set)
+    # keeps a deadlock from hanging the test
+    safety = threading.Timer(5, fetch.release.set)
+    safety.start()
+
+    async def follow() -> tuple:
+        followers = asyncio.gather(*[cache.get_async('apic', '/query', fetch) for _ in range(64)])
+        await asyncio.sleep(0.1)
+        # like a login of the asyncio engine, which runs on the default executor
+        started = time()
+        await asyncio.get_running_loop().run_in_executor(None, fetch.release.set)
+        return time() - started, await followers
+
+    try:
+        waited, results = asyncio.run(follow())
+    finally:
+        safety.cancel()
+        leader.join()
+
+    assert waited < 1
+    assert results == [{'imdata': ['t0']}] * 64
+
+
+def test_cancelled_async_waiter_does_not_cancel_the_flight():
+    cache = RequestCache(['cancelled-waiter'])
+    fetch = Fetch()
+    fetch.release.clear()
+    results = {}
+    leader = threading.Thread(target=lambda: results.update(leader=cache.get('apic', '/query', fetch)))
+    leader.start()
+    assert wait_for(fetch.started.is_set)
+
+    async def follow():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(cache.get_async('apic', '/query', fetch), 0.1)
+        waiter = asyncio.ensure_future(cache.get_async('apic', '/query', fetch))
+        await asyncio.sleep(0.1)
+        fetch.release.set()
+        results['follower'] = await waiter
+
+    asyncio.run(follow())
+    leader.join()
+
+    assert results == {'leader': {'imdata': ['t0']}, 'follower': {'imdata': ['t0']}}
@@ -0,0 +1,128 @@
+import gzip
+import json
+import pytest
+
+from modules.Connection import Connection
+from modules.Scheduler import RefreshScheduler
+from modules.SnapshotStore import SnapshotStore, SNAPSHOT_VERSION
+from modules.Topology import Topology
+from test_collector import NodeCollector, make_config
+
+
+def samples(metrics) -> list:
+    return [(s.name, s.labels, s.value) for m in metrics for s in m.samples]
+
+
+def collected(scheduler: RefreshScheduler, name: str) -> list:
+    return [s for s in samples(scheduler.collect()) if s[0] == name]
+
+
+def write_snapshot(path, data):
+    with gzip.open(path, 'wt') as f:
+        json.dump(data, f)
+
+
+def test_round_trip(simulator, tmp_path):
+    hosts = [host.address for host in simulator.hosts]
+    path = str(tmp_path / 'snapshot.json.gz')
+    scheduler = RefreshScheduler([NodeCollector(make_config(simulator))])
+    scheduler.refresh()
+    topology = Topology(hosts, Connection(hosts, 'user', 'password'))
+    assert len(topology.get_nodes()) > 0
+    store = SnapshotStore(path)
+    store.register('fabric', scheduler, topology)
+    store.save()
+
+    restored = RefreshScheduler([NodeCollector(make_config(simulator))])
+    # a topology of another fabric, that was not fetched yet
+    restored_topology = Topology([path], None)
+    SnapshotStore(path).register('fabric', restored, restored_topology)
+
+    assert collected(restored, 'test_nodes') == collected(scheduler, 'test_nodes')
+    assert collected(restored, 'apic_exporter_collector_last_success_timestamp_seconds') == \
+        collected(scheduler, 'apic_exporter_collector_last_success_timestamp_seconds')
+    assert collected(restored, 'apic_exporter_collector_snapshot_restored') == \
+        [('apic_exporter_collector_snapshot_restored', {'collector': 'NodeCollector'}, 1)]
+    assert restored_topology.get_nodes() == topology.get_nodes()
+
+
+def test_missing_file_starts_cold(simulator, tmp_path):
+    scheduler = RefreshScheduler([NodeCollector(make_config(simulator))])
+
+    SnapshotStore(str(tmp_path / 'missing.json.gz')).register('fabric', scheduler)
+
+    assert scheduler.export() == {}
+
+
+@pytest.mark.parametrize('data', [
+    ['not', 'a', 'snapshot'],
+    'not a snapshot',
+    {
+        'version': SNAPSHOT_VERSION + 1,
+        'saved': 0,
+        'fabrics': {}
+    },
+    {
+        'version': SNAPSHOT_VERSION,
+        'saved': 0,
+        'fabrics': ['fabric']
+    },
+    {
+        'version': SNAPSHOT_VERSION,
+        'saved': 0,
+        'fabrics': {
+            'fabric': ['collectors']
+        }
+    },
+    {
+        'version': SNAPSHOT_VERSION,
+        'saved': 0,
+        'fabrics': {
+            'fabric': {
+                'collectors': {
+                    'NodeCollector': {
+                        'timestamp': 0
+                    }
+                }
+            }
+        }
+    },
+])
+def test_malformed_files_are_ignored(simulator, tmp_path, data):
+    path = str(tmp_path / 'snapshot.json.gz')
+    write_snapshot(path, data)
+    scheduler = RefreshScheduler([NodeCollector(make_config(simulator))])
+
+    SnapshotStore(path).register('fabric', scheduler)
+
+    assert scheduler.export() == {}
+
+
+def test_corrupt_file_is_ignored(simulator, tmp_path):
+    path = tmp_path / 'snapshot.json.gz'
+    path.write_bytes(b'\x1f\x8b\x08\x00truncated')
+    scheduler = RefreshScheduler([NodeCollector(make_config(simulator))])
+
+    SnapshotStore(str(path)).register('fabric', scheduler)
+
+    assert scheduler.export() == {}
+
+
+def test_snapshot_without_saved_timestamp_is_restored(simulator, tmp_path):
+    path = str(tmp_path / 'snapshot.json.gz')
+    snapshot = {'timestamp': 1000.0, 'metrics': []}
+    write_snapshot(path, {
+        'version': SNAPSHOT_VERSION,
+        'fabrics': {
+            'fabric': {
+                'collectors': {
+                    'NodeCollector': snapshot
+                }
+            }
+        }
+    })
+    scheduler = RefreshScheduler([NodeCollector(make_config(simulator))])
+
+    SnapshotStore(path).register('fabric', scheduler)
+
+    assert scheduler.export() == {'NodeCollector': snapshot}
@@ -0,0 +1,178 @@
+import logging
+import threading
+import pytest
+
+from prometheus_client import REGISTRY
+
+from apic_simulator import injection_tuple
+from conftest import wait_for
+from modules import Subscription as subscription
+from modules.FaultIndex import FaultIndex, FAULT_QUERY
+from modules.Subscription import SubscriptionEngine
+
+ACTIVE_FAULTS = {'query-target-filter': 'or(eq(faultInst.lc,"raised"),eq(faultInst.lc,"soaking"))'}
+NEW_FAULT = {
+    'dn': 'topology/pod-1/node-101/sys/phys-[eth1/1]/fault-F9999',
+    'code': 'F9999',
+    'ack': 'no',
+    'cause': 'test',
+    'domain': 'access',
+    'type': 'communications',
+    'severity': 'critical',
+    'lc': 'raised',
+    'modTs': '2024-01-01T00:00:00.000+00:00'
+}
+
+
+def active_faults(simulator) -> list:
+    return [
+        o['faultInst']['attributes']
+        for o in simulator.fabric.query('/api/node/class/faultInst.json', dict(ACTIVE_FAULTS))['imdata']
+    ]
+
+
+def indexed(index: FaultIndex) -> int:
+    return sum(index.get_counts().values())
+
+
+def is_indexed(index: FaultIndex, dn: str) -> bool:
+    return dn in [attrs['dn'] for attrs in index.get_faults([dn.split('fault-')[1]])]
+
+
+def subscribe(simulator) -> FaultIndex:
+    hosts = [host.address for host in simulator.hosts]
+    index = FaultIndex(hosts)
+    SubscriptionEngine(hosts, 'user', 'password').subscribe(FAULT_QUERY, index)
+    return index
+
+
+@pytest.fixture(autouse=True)
+def engine(simulator, monkeypatch):
+    """Reconnects fast and stops the engine of the simulated fabric after the test"""
+    monkeypatch.setattr(subscription, 'RECONNECT_SECONDS', 0.2)
+    yield
+    SubscriptionEngine([host.address for host in simulator.hosts], 'user', 'password').stop()
+
+
+def test_subscribe_loads_the_faults(simulator):
+    index = subscribe(simulator)
+
+    assert wait_for(index.is_synced)
+    assert indexed(index) == len(active_faults(simulator))
+    assert index.host == simulator.hosts[0].address
+    assert len(simulator.hosts[0].subscriptions()) == 1
+    assert REGISTRY.get_sample_value('apic_exporter_subscription_connected',
+                                     {'apicHost': simulator.hosts[0].address}) == 1
+
+
+def test_pushed_changes_update_the_index(simulator):
+    index = subscribe(simulator)
+    assert wait_for(index.is_synced)
+    removed = active_faults(simulator)[0]['dn']
+
+    simulator.fabric.update('faultInst', NEW_FAULT)
+    assert wait_for(lambda: is_indexed(index, NEW_FAULT['dn']))
+    simulator.fabric.update('faultInst', {'dn': NEW_FAULT['dn'], 'severity': 'minor'})
+    assert wait_for(lambda: [f['severity'] for f in index.get_faults(['F9999'])] == ['minor'])
+    # faults that are not raised or soaking anymore are removed
+    simulator.fabric.update('faultInst', {'dn': NEW_FAULT['dn'], 'lc': 'retaining'})
+    assert wait_for(lambda: not is_indexed(index, NEW_FAULT['dn']))
+    simulator.fabric.remove(removed)
+    assert wait_for(lambda: not is_indexed(index, removed))
+
+    assert indexed(index) == len(active_faults(simulator))
+
+
+def test_changes_pushed_before_the_subscription_id_is_known_are_applied(simulator):
+    for host in simulator.hosts:
+        host.injection = injection_tuple(1.0, 0.0, 0.0, 0.0)
+    removed = active_faults(simulator)[0]['dn']
+
+    def change_after_subscribing():
+        # the query response is delayed by the injected latency, the changes are pushed before it arrives
+        wait_for(lambda: any(host.subscriptions() for host in simulator.hosts), interval=0.01)
+        simulator.fabric.remove(removed)
+        simulator.fabric.update('faultInst', NEW_FAULT)
+
+    thread = threading.Thread(target=change_after_subscribing)
+    thread.start()
+    index = subscribe(simulator)
+    thread.join()
+
+    assert wait_for(lambda: index.is_synced() and is_indexed(index, NEW_FAULT['dn']))
+    assert not is_indexed(index, removed)
+    assert indexed(index) == len(active_faults(simulator))
+
+
+def test_resyncs_after_a_gap(simulator):
+    index = subscribe(simulator)
+    assert wait_for(index.is_synced)
+    removed = active_faults(simulator)[0]['dn']
+
+    for host in simulator.hosts:
+        host.accept_websockets = False
+        host.drop_websockets()
+    assert wait_for(lambda: not index.is_synced())
+    # changes while disconnected are not pushed
+    simulator.fabric.remove(removed)
+    simulator.fabric.update('faultInst', NEW_FAULT)
+    assert is_indexed(index, removed)
+    for host in simulator.hosts:
+        host.accept_websockets = True
+
+    assert wait_for(lambda: index.is_synced() and not is_indexed(index, removed))
+    assert is_indexed(index, NEW_FAULT['dn'])
+    assert indexed(index) == len(active_faults(simulator))
+
+
+def test_reconnects_after_a_drop(simulator):
+    index = subscribe(simulator)
+    assert wait_for(index.is_synced)
+
+    for host in simulator.hosts:
+        host.drop_websockets()
+
+    assert wait_for(lambda: sum(host.stats().get('websockets', 0) for host in simulator.hosts) == 2)
+    assert wait_for(lambda: sum(len(host.subscriptions()) for host in simulator.hosts) == 1)
+    simulator.fabric.update('faultInst', NEW_FAULT)
+    assert wait_for(lambda: is_indexed(index, NEW_FAULT['dn']))
+    assert index.is_synced()
+
+
+def test_subscriptions_are_refreshed(simulator, monkeypatch):
+    monkeypatch.setattr(subscription, 'SUBSCRIPTION_REFRESH_SECONDS', 0.3)
+    index = subscribe(simulator)
+    assert wait_for(index.is_synced)
+
+    assert wait_for(lambda: simulator.hosts[0].stats().get('subscription_refreshes', 0) >= 2)
+
+
+def test_resync_is_paged(simulator, monkeypatch):
+    monkeypatch.setattr(subscription, 'PAGE_SIZE', 7)
+    index = subscribe(simulator)
+
+    assert wait_for(index.is_synced)
+    assert len(active_faults(simulator)) > 2 * 7
+    assert indexed(index) == len(active_faults(simulator))
+    # the login and a request per page, only the first page subscribes
+    assert simulator.hosts[0].stats()['requests'] >= 1 + len(active_faults(simulator)) // 7
+    assert len(simulator.hosts[0].subscriptions()) == 1
+
+    simulator.fabric.update('faultInst', NEW_FAULT)
+    assert wait_for(lambda: is_indexed(index, NEW_FAULT['dn']))
+
+
+def test_reconnects_with_exponential_backoff(simulator, monkeypatch, caplog):
+    caplog.set_level(logging.INFO, logger='apic_exporter.exporter')
+    monkeypatch.setattr(subscription, 'RECONNECT_MAX_SECONDS', 0.8)
+    monkeypatch.setattr(subscription.random, 'uniform', lambda a, b: b)
+    for host in simulator.hosts:
+        host.accept_websockets = False
+
+    def delays() -> list:
+        return [r.getMessage() for r in caplog.records if r.getMessage().startswith('reconnecting subscriptions')]
+
+    subscribe(simulator)
+
+    assert wait_for(lambda: len(delays()) >= 4)
+    assert delays()[:4] == [f'reconnecting subscriptions in {delay} sec' for delay in ('0.2', '0.4', '0.8', '0.8')]